@@ -1,19 +1,32 @@
 import os
+import csv
+import io
 import json
-import threading
+import hashlib
+import queue
 import time
+import uuid
 from datetime import datetime, timedelta, timezone
 from functools import wraps
+from typing import Optional
 
-from flask import Flask, jsonify, request
+import click
+from flask import Flask, Response, jsonify, request, stream_with_context
 from flask_cors import CORS
 from dotenv import load_dotenv
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import inspect
+from sqlalchemy import event, inspect
+from sqlalchemy.exc import IntegrityError
 import jwt
 
 # UnivaPay client wrapper
-from univapay_client import UnivapayClient, UnivapayError
+from univapay_client import ProviderUnavailable, UnivapayClient, UnivapayError
+from status_broker import StatusBroker
+from poll_worker import PollWorker
+from event_archive import SegmentWriter, prune_segments
+from inbox_worker import InboxWorker
+from recent_keys import RecentKeys, RecentValues
+from payload_codec import CompressedText, compress_text, is_compressed
 
 # -------------------------
 # Env & App Initialization
@@ -30,6 +43,40 @@ WEBHOOK_AUTH = os.getenv("UNIVAPAY_WEBHOOK_AUTH", "").strip()  # shared secret t
 ENABLE_POLL_FALLBACK = os.getenv("UNIVAPAY_POLL_ENABLE", "true").lower() in ("1", "true", "yes")
 POLL_AFTER_SECONDS = int(os.getenv("UNIVAPAY_POLL_AFTER_SECONDS", "30"))
 POLL_RETRY_AFTER_SECONDS = int(os.getenv("UNIVAPAY_POLL_RETRY_SECONDS", "60"))
+POLL_MAX_ATTEMPTS = int(os.getenv("UNIVAPAY_POLL_MAX_ATTEMPTS", "6"))
+POLL_BACKOFF_MAX_SECONDS = int(os.getenv("UNIVAPAY_POLL_BACKOFF_MAX_SECONDS", "3600"))
+POLL_CONCURRENCY = int(os.getenv("UNIVAPAY_POLL_CONCURRENCY", "4"))
+POLL_LEASE_SECONDS = int(os.getenv("UNIVAPAY_POLL_LEASE_SECONDS", "120"))  # claim window across processes
+
+# /api/payments keyset pagination
+PAYMENTS_PAGE_DEFAULT = int(os.getenv("PAYMENTS_PAGE_DEFAULT", "50"))
+PAYMENTS_PAGE_MAX = int(os.getenv("PAYMENTS_PAGE_MAX", "200"))
+
+# /api/payments/stream (SSE)
+SSE_KEEPALIVE_SECONDS = int(os.getenv("SSE_KEEPALIVE_SECONDS", "15"))
+SSE_TOKEN_SECONDS = int(os.getenv("SSE_TOKEN_SECONDS", "60"))  # lifetime of the ?token= minted for one connect
+
+# /api/payments/export and `flask --app app export-payments`
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "2000"))  # rows per server-side cursor fetch
+
+# Webhook inbox (events are acked on insert and applied by a background consumer)
+WEBHOOK_CONSUMER_ENABLE = os.getenv("WEBHOOK_CONSUMER_ENABLE", "true").lower() in ("1", "true", "yes")
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", "200"))
+WEBHOOK_IDLE_SECONDS = float(os.getenv("WEBHOOK_IDLE_SECONDS", "5"))
+WEBHOOK_DEDUP_TTL_SECONDS = float(os.getenv("WEBHOOK_DEDUP_TTL_SECONDS", "600"))    # in-memory front only
+WEBHOOK_DEDUP_CACHE_SIZE = int(os.getenv("WEBHOOK_DEDUP_CACHE_SIZE", "10000"))
+
+# Webhook event log retention (processed events older than this move to daily archive segments)
+WEBHOOK_LOG_RETENTION_DAYS = int(os.getenv("WEBHOOK_LOG_RETENTION_DAYS", "7"))
+WEBHOOK_ARCHIVE_DIR = os.getenv("WEBHOOK_ARCHIVE_DIR", "webhook_archive")
+WEBHOOK_ARCHIVE_KEEP_DAYS = int(os.getenv("WEBHOOK_ARCHIVE_KEEP_DAYS", "0"))        # 0 = keep segments forever
+WEBHOOK_ARCHIVE_SEGMENT_ROWS = int(os.getenv("WEBHOOK_ARCHIVE_SEGMENT_ROWS", "50000"))
+
+# Client Idempotency-Key on /api/checkout/charge (repeats replay the stored response)
+IDEMPOTENCY_TTL_HOURS = int(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))            # completed keys replay this long
+IDEMPOTENCY_LOCK_SECONDS = int(os.getenv("IDEMPOTENCY_LOCK_SECONDS", "120"))     # unfinished claims older than this are abandoned
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))       # in-memory front only
+IDEMPOTENCY_CACHE_SECONDS = float(os.getenv("IDEMPOTENCY_CACHE_SECONDS", "600"))
 
 def now_utc():
     return datetime.now(timezone.utc)
@@ -63,13 +110,27 @@ CORS(app, resources={
     r"/api/*": {
         "origins": ALLOWED_ORIGINS or "*",
         "methods": ["GET", "POST", "OPTIONS"],
-        "allow_headers": ["Content-Type", "Authorization"],
+        "allow_headers": ["Content-Type", "Authorization", "Idempotency-Key"],
+        "expose_headers": ["Idempotent-Replayed", "Retry-After"],
         "supports_credentials": False,
     }
 })
 
 db = SQLAlchemy(app)
 
+def _sqlite_enforce_fks(dbapi_conn, _record):
+    # SQLite ignores FOREIGN KEY constraints unless enabled per connection
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA foreign_keys=ON")
+    cur.close()
+
+with app.app_context():
+    if db.engine.dialect.name == "sqlite":
+        event.listen(db.engine, "connect", _sqlite_enforce_fks)
+
+# Status transitions from the webhook handler and poller, fanned out to SSE streams
+status_broker = StatusBroker()
+
 # Try init UnivaPay client (ok if keys missing; we simply show a warning)
 try:
     univapay = UnivapayClient()
@@ -83,6 +144,10 @@ except Exception as e:
 # -------------
 class Payment(db.Model):
     __tablename__ = "payments"
+    __table_args__ = (
+        # Serves the keyset scan in list_payments: WHERE user=? ORDER BY created_at DESC, id DESC
+        db.Index("ix_payments_user_created_id", "user", "created_at", "id"),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user = db.Column(db.String(64), nullable=False)         # e.g., "Nayeem"
     kind = db.Column(db.String(32), nullable=False)         # "product" | "subscription"
@@ -104,28 +169,301 @@ class Payment(db.Model):
 
 class ProviderPayment(db.Model):
     __tablename__ = "provider_payments"
+    __table_args__ = (
+        # Serves the outer join in list_payments
+        db.Index("ix_provider_payments_payment_provider", "payment_id", "provider"),
+        # Webhook/poller/reconcile lookups by provider id; NULLs don't collide
+        db.Index("ux_provider_payments_provider_charge", "provider", "provider_charge_id", unique=True),
+        db.Index("ux_provider_payments_provider_subscription", "provider", "provider_subscription_id", unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
     provider = db.Column(db.String(32), nullable=False, default="univapay")
-    payment_id = db.Column(db.Integer, nullable=False)  # logical FK to payments.id
+    payment_id = db.Column(db.Integer, db.ForeignKey("payments.id", name="fk_provider_payments_payment"), nullable=False)
     provider_charge_id = db.Column(db.String(64), nullable=True)
     provider_subscription_id = db.Column(db.String(64), nullable=True)
     status = db.Column(db.String(32), nullable=True)    # e.g., pending/successful/failed/current/...
     currency = db.Column(db.String(8), nullable=True, default="JPY")
-    raw_json = db.Column(db.Text, nullable=True)
+    raw_json = db.deferred(db.Column(CompressedText, nullable=True))  # loaded and decoded on first access
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
 
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "provider": self.provider,
+            "charge_id": self.provider_charge_id,
+            "subscription_id": self.provider_subscription_id,
+            "status": self.status,
+            "currency": self.currency,
+            "created_at": utc_iso(self.created_at) if self.created_at else None,
+            "updated_at": utc_iso(self.updated_at) if self.updated_at else None,
+        }
+
+class PollJob(db.Model):
+    """Durable status-poll queue drained by the single background PollWorker."""
+    __tablename__ = "poll_jobs"
+    id = db.Column(db.Integer, primary_key=True)
+    provider_payment_id = db.Column(db.Integer, nullable=False, index=True)  # ProviderPayment.id
+    kind = db.Column(db.String(16), nullable=False)                          # "charge" | "subscription"
+    attempt = db.Column(db.Integer, nullable=False, default=0)               # polls completed so far
+    next_poll_at = db.Column(db.DateTime, nullable=False, index=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
 class WebhookEvent(db.Model):
+    """Raw webhook deliveries; doubles as the inbox drained by the webhook consumer."""
     __tablename__ = "webhook_events"
+    __table_args__ = (
+        # Serves the consumer's scan: WHERE processed_at IS NULL ORDER BY id
+        db.Index("ix_webhook_events_pending", "processed_at", "id"),
+        # Provider retries of the same delivery are rejected on insert
+        db.Index("ux_webhook_events_dedup", "dedup_key", unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
     provider = db.Column(db.String(32), nullable=False, default="univapay")
     event_type = db.Column(db.String(64), nullable=True)    # e.g., CHARGE_FINISHED, SUBSCRIPTION_PAYMENT
-    payload = db.Column(db.Text, nullable=False)            # raw JSON body
+    payload = db.Column(CompressedText, nullable=False)     # raw JSON body (compressed)
     headers = db.Column(db.Text, nullable=True)             # captured subset of headers
     received_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    processed_at = db.Column(db.DateTime, nullable=True)    # NULL until the consumer has applied it
+    dedup_key = db.Column(db.String(80), nullable=True)     # sha256 of the raw body (see _webhook_dedup_key)
+
+class PaymentSummary(db.Model):
+    """Per-user dashboard totals, kept current by every payment write (see _record_payment_transitions)."""
+    __tablename__ = "payment_summaries"
+    user = db.Column(db.String(64), primary_key=True)
+    spend_by_currency = db.Column(db.JSON, nullable=False, default=dict)   # {"JPY": 12000}
+    payments_count = db.Column(db.Integer, nullable=False, default=0)
+    successful_payments = db.Column(db.Integer, nullable=False, default=0)
+    active_subscriptions = db.Column(db.Integer, nullable=False, default=0)
+    last_payment_id = db.Column(db.Integer, nullable=True)                 # Payment.id
+    last_payment_status = db.Column(db.String(32), nullable=True)
+    last_payment_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            "user": self.user,
+            "spend_by_currency": self.spend_by_currency or {},
+            "payments_count": self.payments_count or 0,
+            "successful_payments": self.successful_payments or 0,
+            "active_subscriptions": self.active_subscriptions or 0,
+            "last_payment": {
+                "id": self.last_payment_id,
+                "status": self.last_payment_status,
+                "created_at": utc_iso(self.last_payment_at),
+            } if self.last_payment_id else None,
+            "updated_at": utc_iso(self.updated_at) if self.updated_at else None,
+        }
+
+class IdempotencyKey(db.Model):
+    """Client Idempotency-Key claims on checkout; the stored response is replayed for repeats."""
+    __tablename__ = "idempotency_keys"
+    __table_args__ = (
+        # One claim per (user, key); a concurrent duplicate fails on insert
+        db.Index("ux_idempotency_keys_user_key", "user", "key", unique=True),
+        # Serves prune-idempotency-keys
+        db.Index("ix_idempotency_keys_claimed_at", "claimed_at"),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    user = db.Column(db.String(64), nullable=False)
+    key = db.Column(db.String(255), nullable=False)
+    request_hash = db.Column(db.String(64), nullable=False)     # sha256 of the JSON body
+    response_status = db.Column(db.Integer, nullable=True)      # NULL while the first request is in flight
+    response_body = db.Column(db.Text, nullable=True)           # JSON
+    claimed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    completed_at = db.Column(db.DateTime, nullable=True)
 
 with app.app_context():
+    _had_payment_summaries = inspect(db.engine).has_table(PaymentSummary.__tablename__)
     db.create_all()
+    # create_all() skips tables that already exist, so add newer columns and indexes explicitly
+    _webhook_cols = {c["name"] for c in inspect(db.engine).get_columns("webhook_events")}
+    if "processed_at" not in _webhook_cols:
+        with db.engine.begin() as _conn:
+            _conn.execute(db.text("ALTER TABLE webhook_events ADD COLUMN processed_at TIMESTAMP"))
+            # Older rows were applied synchronously by the webhook handler
+            _conn.execute(db.text("UPDATE webhook_events SET processed_at = received_at"))
+    if "dedup_key" not in _webhook_cols:
+        with db.engine.begin() as _conn:
+            _conn.execute(db.text("ALTER TABLE webhook_events ADD COLUMN dedup_key VARCHAR(80)"))
+    for _table in (Payment.__table__, ProviderPayment.__table__, WebhookEvent.__table__):
+        for _idx in _table.indexes:
+            try:
+                _idx.create(db.engine, checkfirst=True)
+            except Exception as e:
+                # e.g. duplicate provider ids in an old database; the migration command reports them
+                print(f"[DB] Could not create index {_idx.name}: {e.__class__.__name__}. Run `flask --app app migrate-provider-ids`.")
+    if not inspect(db.engine).get_foreign_keys("provider_payments"):
+        print("[DB] provider_payments.payment_id has no foreign key yet. Run `flask --app app migrate-provider-ids`.")
+
+# ------------------------------------
+# Schema migration (existing databases)
+# ------------------------------------
+def _provider_id_conflicts(sample: int = 20) -> dict:
+    """Rows that would block the unique provider-id indexes or the payment_id foreign key."""
+    def _dupes(col):
+        return [
+            value for value, in db.session.query(col)
+            .filter(col.isnot(None))
+            .group_by(ProviderPayment.provider, col)
+            .having(db.func.count() > 1)
+            .limit(sample)
+        ]
+    orphans = [
+        row_id for row_id, in db.session.query(ProviderPayment.id)
+        .outerjoin(Payment, Payment.id == ProviderPayment.payment_id)
+        .filter(Payment.id.is_(None))
+        .limit(sample)
+    ]
+    return {
+        "duplicate charge ids": _dupes(ProviderPayment.provider_charge_id),
+        "duplicate subscription ids": _dupes(ProviderPayment.provider_subscription_id),
+        "provider rows without a payment": orphans,
+    }
+
+def _rebuild_provider_payments_sqlite():
+    """SQLite can't add a constraint in place: copy into a freshly created table in one transaction."""
+    table = ProviderPayment.__table__
+    cols = ", ".join(c.name for c in table.columns)
+    old_indexes = [i["name"] for i in inspect(db.engine).get_indexes(table.name) if i.get("name")]
+    statements = [f"ALTER TABLE {table.name} RENAME TO {table.name}_old"]
+    statements += [f'DROP INDEX IF EXISTS "{name}"' for name in old_indexes]
+    statements.append(str(db.schema.CreateTable(table).compile(db.engine)))
+    statements += [str(db.schema.CreateIndex(idx).compile(db.engine)) for idx in table.indexes]
+    statements.append(f"INSERT INTO {table.name} ({cols}) SELECT {cols} FROM {table.name}_old")
+    statements.append(f"DROP TABLE {table.name}_old")
+
+    db.session.remove()
+    raw = db.engine.raw_connection()
+    driver = raw.driver_connection
+    isolation = driver.isolation_level
+    driver.isolation_level = None  # pysqlite would otherwise auto-commit each DDL statement
+    cur = raw.cursor()
+    try:
+        cur.execute("BEGIN")
+        for stmt in statements:
+            cur.execute(stmt)
+        cur.execute("COMMIT")
+    except Exception:
+        cur.execute("ROLLBACK")
+        raise
+    finally:
+        cur.close()
+        driver.isolation_level = isolation
+        raw.close()
+
+def migrate_provider_ids() -> list:
+    """
+    Bring an existing provider_payments table up to the current schema: unique
+    (provider, provider_charge_id) / (provider, provider_subscription_id) indexes and a
+    real payment_id -> payments.id foreign key. Safe to re-run; returns the steps applied.
+    """
+    conflicts = {k: v for k, v in _provider_id_conflicts().items() if v}
+    if conflicts:
+        detail = "; ".join(f"{k}: {', '.join(map(str, v))}" for k, v in conflicts.items())
+        raise RuntimeError(f"Resolve these rows before migrating ({detail})")
+
+    table = ProviderPayment.__table__
+    insp = inspect(db.engine)
+    has_fk = bool(insp.get_foreign_keys(table.name))
+    existing = {i["name"] for i in insp.get_indexes(table.name)}
+    steps = []
+
+    if db.engine.dialect.name == "sqlite":
+        if not has_fk:
+            _rebuild_provider_payments_sqlite()
+            steps.append("rebuilt provider_payments with payment_id foreign key and indexes")
+            existing = {idx.name for idx in table.indexes}
+        for idx in table.indexes:
+            if idx.name not in existing:
+                idx.create(db.engine)
+                steps.append(f"created index {idx.name}")
+    elif db.engine.dialect.name == "postgresql":
+        # Build indexes without blocking writes, and validate the FK separately from adding it
+        db.session.remove()
+        with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            for idx in table.indexes:
+                if idx.name not in existing:
+                    unique = "UNIQUE " if idx.unique else ""
+                    cols = ", ".join(c.name for c in idx.columns)
+                    conn.execute(db.text(f"CREATE {unique}INDEX CONCURRENTLY IF NOT EXISTS {idx.name} ON {table.name} ({cols})"))
+                    steps.append(f"created index {idx.name}")
+            if not has_fk:
+                conn.execute(db.text(
+                    f"ALTER TABLE {table.name} ADD CONSTRAINT fk_provider_payments_payment "
+                    "FOREIGN KEY (payment_id) REFERENCES payments (id) NOT VALID"
+                ))
+                conn.execute(db.text(f"ALTER TABLE {table.name} VALIDATE CONSTRAINT fk_provider_payments_payment"))
+                steps.append("added foreign key fk_provider_payments_payment")
+    else:
+        raise RuntimeError(f"No migration path for dialect {db.engine.dialect.name!r}")
+    return steps
+
+@app.cli.command("migrate-provider-ids")
+def migrate_provider_ids_command():
+    """Add provider-id unique indexes and the payment_id FK to an existing provider_payments table."""
+    try:
+        steps = migrate_provider_ids()
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    for step in steps:
+        click.echo(f"[DB] {step}")
+    if not steps:
+        click.echo("[DB] provider_payments is up to date")
+
+_COMPRESSED_COLUMNS = (("provider_payments", "raw_json"), ("webhook_events", "payload"))
+
+def compress_payloads(batch_size: int = 500) -> dict:
+    """
+    Rewrite legacy plain-text raw_json/payload values in compressed form, in id-ordered
+    batches. On Postgres the TEXT columns are first converted to BYTEA. Safe to re-run.
+    Returns {table: (rows_rewritten, bytes_before, bytes_after)}.
+    """
+    insp = inspect(db.engine)
+    result = {}
+    for table, column in _COMPRESSED_COLUMNS:
+        if db.engine.dialect.name == "postgresql":
+            col_type = next(c["type"] for c in insp.get_columns(table) if c["name"] == column)
+            if not isinstance(col_type, db.LargeBinary):
+                with db.engine.begin() as conn:
+                    conn.execute(db.text(
+                        f"ALTER TABLE {table} ALTER COLUMN {column} TYPE BYTEA USING convert_to({column}, 'UTF8')"
+                    ))
+
+        select_batch = db.text(f"SELECT id, {column} FROM {table} WHERE id > :after ORDER BY id LIMIT :n")
+        update_row = db.text(f"UPDATE {table} SET {column} = :value WHERE id = :id").bindparams(
+            db.bindparam("value", type_=db.LargeBinary)
+        )
+        rows_done = before = after = 0
+        last_id = 0
+        while True:
+            rows = db.session.execute(select_batch, {"after": last_id, "n": batch_size}).all()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            updates = []
+            for row_id, value in rows:
+                if value is None or is_compressed(value):
+                    continue
+                text = value if isinstance(value, str) else bytes(value).decode("utf-8")
+                packed = compress_text(text)
+                before += len(text.encode("utf-8"))
+                after += len(packed)
+                updates.append({"id": row_id, "value": packed})
+            if updates:
+                db.session.execute(update_row, updates)
+                db.session.commit()
+                rows_done += len(updates)
+        result[table] = (rows_done, before, after)
+    return result
+
+@app.cli.command("compress-payloads")
+@click.option("--batch-size", default=500, show_default=True, help="Rows per transaction.")
+def compress_payloads_command(batch_size):
+    """Compress raw_json / webhook payload values written before compression was enabled."""
+    for table, (rows, before, after) in compress_payloads(batch_size=batch_size).items():
+        ratio = f" ({after / before:.0%} of original)" if before else ""
+        click.echo(f"[DB] {table}: compressed {rows} row(s), {before} -> {after} bytes{ratio}")
 
 # -------------
 # Auth Helpers
@@ -138,15 +476,34 @@ def create_token(username: str) -> str:
     }
     return jwt.encode(payload, SECRET_KEY, algorithm="HS256")
 
+# Query-string tokens end up in access and proxy logs, so streams only take these:
+# short-lived and accepted nowhere else
+STREAM_TOKEN_SCOPE = "payments_stream"
+
+def create_stream_token(username: str) -> str:
+    payload = {
+        "sub": username,
+        "scope": STREAM_TOKEN_SCOPE,
+        "iat": now_utc(),
+        "exp": now_utc() + timedelta(seconds=SSE_TOKEN_SECONDS),
+    }
+    return jwt.encode(payload, SECRET_KEY, algorithm="HS256")
+
 def auth_required(fn):
     @wraps(fn)
     def wrapper(*args, **kwargs):
         auth = request.headers.get("Authorization", "")
-        if not auth.startswith("Bearer "):
+        if auth.startswith("Bearer "):
+            token, scope = auth.split(" ", 1)[1].strip(), None
+        elif getattr(fn, "allow_query_token", False) and request.args.get("token"):
+            # EventSource cannot send headers, so streaming endpoints accept a stream token as ?token=
+            token, scope = request.args["token"].strip(), STREAM_TOKEN_SCOPE
+        else:
             return jsonify({"error": "Missing or invalid Authorization header"}), 401
-        token = auth.split(" ", 1)[1].strip()
         try:
             data = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+            if data.get("scope") != scope:
+                raise jwt.InvalidTokenError("token scope mismatch")
             request.user = data["sub"]
         except jwt.ExpiredSignatureError:
             return jsonify({"error": "Token expired"}), 401
@@ -165,7 +522,8 @@ def healthz():
         "env": {
             "PORT": PORT,
             "DB": DATABASE_URL.split(":///")[-1],
-        }
+        },
+        "univapay": univapay.guard_status() if univapay is not None else None,
     })
 
 @app.get("/db/health")
@@ -218,6 +576,8 @@ def purchase():
 
     row = Payment(user=request.user, kind="product", item_name=item_name, amount_jpy=amount, plan=None)
     db.session.add(row)
+    db.session.flush()
+    _record_payment_created(row)
     db.session.commit()
     return jsonify({"ok": True, "payment": row.to_dict()}), 201
 
@@ -233,82 +593,728 @@ def subscribe():
 
     row = Payment(user=request.user, kind="subscription", item_jpy=None, item_name=None, amount_jpy=PRICES[plan], plan=plan)
     db.session.add(row)
+    db.session.flush()
+    _record_payment_created(row)
     db.session.commit()
     return jsonify({"ok": True, "payment": row.to_dict()}), 201
 
+def _parse_payments_cursor(raw: str):
+    """Parse an `after` cursor of the form '<created_at ISO>,<id>' into (naive UTC datetime, id)."""
+    ts_part, _, id_part = raw.rpartition(",")
+    ts = datetime.fromisoformat(ts_part.strip().replace("Z", "+00:00"))
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return ts, int(id_part)
+
+def _parse_since(raw: str) -> datetime:
+    """Parse an ISO timestamp (with or without 'Z') into a naive UTC datetime."""
+    ts = datetime.fromisoformat(raw.strip().replace("Z", "+00:00"))
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return ts
+
+def _payments_version(user: str):
+    """
+    Per-user change version for /api/payments: (updated_at, payments_count) of the user's
+    PaymentSummary row, a primary-key read. Every write to the user's payments or their
+    provider rows stamps updated_at (see _record_payment_transitions); (None, 0) without payments.
+    """
+    row = (
+        db.session.query(PaymentSummary.updated_at, PaymentSummary.payments_count)
+        .filter(PaymentSummary.user == user)
+        .first()
+    )
+    return row if row else (None, 0)
+
 @app.get("/api/payments")
 @auth_required
 def list_payments():
-    # 1. Load all local payments for this user
-    payments = Payment.query.filter_by(user=request.user).order_by(Payment.created_at.desc()).all()
-
-    # 2. Build response including provider data (if exists)
-    result = []
-    for p in payments:
-        provider = ProviderPayment.query.filter_by(payment_id=p.id, provider="univapay").first()
-        result.append({
-            **p.to_dict(),
-            "provider": {
-                "id": provider.id if provider else None,
-                "provider": provider.provider if provider else None,
-                "charge_id": provider.provider_charge_id if provider else None,
-                "subscription_id": provider.provider_subscription_id if provider else None,
-                "status": provider.status if provider else None,
-                "currency": provider.currency if provider else None,
-                "created_at": provider.created_at.isoformat() + "Z" if provider and provider.created_at else None,
-                "updated_at": provider.updated_at.isoformat() + "Z" if provider and provider.updated_at else None,
-            } if provider else None
-        })
-
-    return jsonify({"payments": result})
+    # 0. Conditional GET: the ETag covers the user's change version and the query string,
+    #    so an unchanged poll returns 304 without loading or serializing any rows.
+    version, total = _payments_version(request.user)
+    etag = hashlib.sha1(
+        f"{request.user}|{version}|{total}|{request.query_string.decode()}".encode()
+    ).hexdigest()
+    if request.if_none_match.contains(etag):
+        resp = app.response_class(status=304)
+        resp.set_etag(etag)
+        resp.headers["Cache-Control"] = "private, no-cache"
+        return resp
+
+    # Keyset pagination: ?after=<created_at,id>&limit=N (newest first)
+    try:
+        limit = int(request.args.get("limit", PAYMENTS_PAGE_DEFAULT))
+        assert limit > 0
+    except Exception:
+        return jsonify({"error": "limit must be a positive integer"}), 400
+    limit = min(limit, PAYMENTS_PAGE_MAX)
+
+    after = (request.args.get("after") or "").strip()
+    cursor = None
+    if after:
+        try:
+            cursor = _parse_payments_cursor(after)
+        except Exception:
+            return jsonify({"error": "after must look like '<created_at ISO>,<id>'"}), 400
+
+    # Delta mode: ?since=<iso> returns only rows created or whose provider status changed after it
+    since = None
+    if (request.args.get("since") or "").strip():
+        try:
+            since = _parse_since(request.args["since"])
+        except Exception:
+            return jsonify({"error": "since must be an ISO-8601 timestamp"}), 400
+
+    # 1. One outer-join query for the page (local payment + its UnivaPay mapping)
+    q = (
+        db.session.query(Payment, ProviderPayment)
+        .outerjoin(
+            ProviderPayment,
+            db.and_(ProviderPayment.payment_id == Payment.id, ProviderPayment.provider == "univapay"),
+        )
+        .filter(Payment.user == request.user)
+    )
+    if cursor:
+        ts, pid = cursor
+        q = q.filter(db.or_(Payment.created_at < ts, db.and_(Payment.created_at == ts, Payment.id < pid)))
+    if since:
+        q = q.filter(db.or_(ProviderPayment.updated_at > since, Payment.created_at > since))
+    rows = q.order_by(Payment.created_at.desc(), Payment.id.desc()).limit(limit + 1).all()
+
+    # 2. Build response; the extra row only tells us whether another page exists
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    result = [{**p.to_dict(), "provider": prov.to_dict() if prov else None} for p, prov in rows]
+
+    next_cursor = None
+    if has_more and rows:
+        last = rows[-1][0]
+        next_cursor = f"{utc_iso(last.created_at)},{last.id}"
+
+    resp = jsonify({
+        "payments": result,
+        "next_cursor": next_cursor,
+        # Pass back as ?since= to fetch only what changed after this response
+        "as_of": utc_iso(version) if version else None,
+    })
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp
+
+# ------------------------------------
+# Per-user payment summary
+# ------------------------------------
+SUMMARY_SPEND_STATUSES = ("successful", "partially_refunded")   # product charges that count as spent
+SUMMARY_SUCCESS_STATUSES = {"product": ("successful",), "subscription": ("current",)}
+SUMMARY_ACTIVE_STATUSES = ("current",)
+# Rows without a UnivaPay mapping come from the POC endpoints and are paid on creation
+SUMMARY_LOCAL_STATUS = {"product": "successful", "subscription": "current"}
+_NOT_CREATED = object()  # "old status" of a payment created in the current transaction
+
+def _summary_rows_query():
+    """Payment rows as the summary sees them: (id, user, kind, amount, currency, created_at, status)."""
+    return (
+        db.session.query(
+            Payment.id, Payment.user, Payment.kind, Payment.amount_jpy, ProviderPayment.currency,
+            Payment.created_at, ProviderPayment.id.isnot(None), ProviderPayment.status,
+        )
+        .outerjoin(
+            ProviderPayment,
+            db.and_(ProviderPayment.payment_id == Payment.id, ProviderPayment.provider == "univapay"),
+        )
+    )
+
+def _summary_row(values) -> tuple:
+    """One _summary_rows_query() result as (row dict, effective status)."""
+    pay_id, user, kind, amount, currency, created_at, has_provider, status = values
+    row = {"id": pay_id, "user": user, "kind": kind, "amount": amount or 0,
+           "currency": currency or "JPY", "created_at": created_at}
+    return row, (status if has_provider else SUMMARY_LOCAL_STATUS.get(kind))
+
+def _summary_rows_for_provider(provider_ids) -> dict:
+    """{ProviderPayment.id: row dict} for rows whose provider status is about to change."""
+    if not provider_ids:
+        return {}
+    q = _summary_rows_query().add_columns(ProviderPayment.id).filter(ProviderPayment.id.in_(list(provider_ids)))
+    return {values[-1]: _summary_row(values[:-1])[0] for values in q}
+
+def _summary_contribution(row: dict, status) -> tuple:
+    """(payments, successful, active subscriptions, spend currency or None) of one row in `status`."""
+    if status is _NOT_CREATED:
+        return 0, 0, 0, None
+    successful = int(status in SUMMARY_SUCCESS_STATUSES.get(row["kind"], ()))
+    active = int(row["kind"] == "subscription" and status in SUMMARY_ACTIVE_STATUSES)
+    spend = row["currency"] if row["kind"] == "product" and status in SUMMARY_SPEND_STATUSES else None
+    return 1, successful, active, spend
+
+def _summary_is_newer(row: dict, summary: "PaymentSummary") -> bool:
+    if summary.last_payment_id is None or row["id"] == summary.last_payment_id:
+        return True
+    return (row["created_at"], row["id"]) > (summary.last_payment_at, summary.last_payment_id)
+
+def _apply_summary_change(summary: "PaymentSummary", row: dict, old_status, new_status):
+    before, after = _summary_contribution(row, old_status), _summary_contribution(row, new_status)
+    summary.payments_count = (summary.payments_count or 0) + after[0] - before[0]
+    summary.successful_payments = (summary.successful_payments or 0) + after[1] - before[1]
+    summary.active_subscriptions = (summary.active_subscriptions or 0) + after[2] - before[2]
+    spend = dict(summary.spend_by_currency or {})
+    for currency, sign in ((before[3], -1), (after[3], 1)):
+        if currency:
+            spend[currency] = spend.get(currency, 0) + sign * row["amount"]
+            if not spend[currency]:
+                del spend[currency]
+    summary.spend_by_currency = spend  # reassigned so the JSON column is marked dirty
+    if _summary_is_newer(row, summary):
+        summary.last_payment_id = row["id"]
+        summary.last_payment_status = new_status
+        summary.last_payment_at = row["created_at"]
+
+def compute_payment_summaries(users=None) -> dict:
+    """Full recomputation: {user: PaymentSummary} (unsaved) from the payment rows."""
+    q = _summary_rows_query()
+    if users is not None:
+        q = q.filter(Payment.user.in_(list(users)))
+    now = datetime.utcnow()
+    summaries = {}
+    for values in q.order_by(Payment.id).yield_per(EXPORT_CHUNK_ROWS):
+        row, status = _summary_row(values)
+        summary = summaries.get(row["user"])
+        if summary is None:
+            summary = summaries[row["user"]] = PaymentSummary(user=row["user"], spend_by_currency={}, updated_at=now)
+        _apply_summary_change(summary, row, _NOT_CREATED, status)
+    return summaries
+
+def _record_payment_transitions(transitions):
+    """
+    Fold payment status changes into the owners' summary rows, in the caller's transaction.
+
+    `transitions` holds (row, old_status, new_status) with rows from _summary_row(); use
+    _NOT_CREATED as old_status for a payment added in this transaction. Pass rows whose
+    provider row was touched without a status change too (old == new): they only stamp
+    updated_at, which is the /api/payments ETag version. Call after the payment writes
+    are flushed and before the commit. Summary rows are locked (SELECT ... FOR UPDATE on
+    Postgres; SQLite already serializes writers), and a user without a row gets one
+    computed from scratch, which includes this transaction's writes.
+    """
+    by_user = {}
+    for row, old_status, new_status in transitions:
+        by_user.setdefault(row["user"], []).append((row, old_status, new_status))
+    if not by_user:
+        return
+
+    summaries = {
+        s.user: s for s in PaymentSummary.query.filter(PaymentSummary.user.in_(list(by_user))).with_for_update()
+    }
+    missing = [user for user in by_user if user not in summaries]
+    for user, fresh in (compute_payment_summaries(missing) if missing else {}).items():
+        try:
+            with db.session.begin_nested():
+                db.session.add(fresh)
+        except IntegrityError:
+            # Created concurrently from rows that can't include ours yet: apply the change to it
+            summaries[user] = PaymentSummary.query.filter_by(user=user).with_for_update().one()
+
+    now = datetime.utcnow()
+    for user, summary in summaries.items():
+        for row, old_status, new_status in by_user[user]:
+            if old_status != new_status:
+                _apply_summary_change(summary, row, old_status, new_status)
+        summary.updated_at = now
+
+def _record_payment_created(pay: "Payment", prov: Optional["ProviderPayment"] = None):
+    values = (pay.id, pay.user, pay.kind, pay.amount_jpy, prov.currency if prov else None,
+              pay.created_at, prov is not None, prov.status if prov else None)
+    row, status = _summary_row(values)
+    _record_payment_transitions([(row, _NOT_CREATED, status)])
+
+def rebuild_payment_summaries(users=None) -> int:
+    """Recompute summary rows (all users, or `users`) from the payment tables; returns rows written."""
+    summaries = compute_payment_summaries(users)
+    stale = PaymentSummary.query
+    if users is not None:
+        stale = stale.filter(PaymentSummary.user.in_(list(users)))
+    stale.delete(synchronize_session=False)
+    db.session.add_all(summaries.values())
+    db.session.commit()
+    return len(summaries)
+
+@app.cli.command("rebuild-payment-summaries")
+@click.option("--user", "users", multiple=True, help="Only rebuild these users (repeatable).")
+def rebuild_payment_summaries_command(users):
+    """Recompute per-user payment summaries from payments (repair / backfill)."""
+    count = rebuild_payment_summaries(list(users) or None)
+    click.echo(f"Rebuilt {count} payment summar{'y' if count == 1 else 'ies'}.")
+
+if not _had_payment_summaries:
+    # New table on an existing database: backfill once so dashboards don't start empty
+    with app.app_context():
+        print(f"[DB] Built {rebuild_payment_summaries()} payment summaries.")
+
+@app.get("/api/payments/summary")
+@auth_required
+def payments_summary():
+    # Single primary-key read; a user without payments has no row yet
+    summary = db.session.get(PaymentSummary, request.user) or PaymentSummary(user=request.user)
+    return jsonify({"summary": summary.to_dict()})
+
+def _publish_status(prov: "ProviderPayment"):
+    """Push a provider status transition to the owning user's open SSE streams."""
+    pay = db.session.get(Payment, prov.payment_id)
+    if pay is None:
+        return
+    status_broker.publish(pay.user, {"payment_id": pay.id, "payment": pay.to_dict(), "provider": prov.to_dict()})
+
+def _query_token(fn):
+    fn.allow_query_token = True
+    return fn
+
+@app.post("/api/payments/stream-token")
+@auth_required
+def payments_stream_token():
+    # Exchanged for each EventSource connect, so the session JWT never goes in a URL
+    return jsonify({"token": create_stream_token(request.user), "expires_in": SSE_TOKEN_SECONDS})
+
+@app.get("/api/payments/stream")
+@auth_required
+@_query_token
+def payments_stream():
+    user = request.user
+    sub = status_broker.subscribe(user)
+
+    def _events():
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    evt = sub.get(timeout=SSE_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    # Comment line keeps proxies from closing an idle stream
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: payment\ndata: {json.dumps(evt, ensure_ascii=False)}\n\n"
+        finally:
+            status_broker.unsubscribe(user, sub)
+
+    return Response(_events(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+
+EXPORT_FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+# (header, column) pairs; raw_json stays on disk
+EXPORT_COLUMNS = (
+    ("id", Payment.id),
+    ("created_at", Payment.created_at),
+    ("user", Payment.user),
+    ("kind", Payment.kind),
+    ("item_name", Payment.item_name),
+    ("amount_jpy", Payment.amount_jpy),
+    ("plan", Payment.plan),
+    ("provider_status", ProviderPayment.status),
+    ("currency", ProviderPayment.currency),
+    ("provider_charge_id", ProviderPayment.provider_charge_id),
+    ("provider_subscription_id", ProviderPayment.provider_subscription_id),
+    ("provider_updated_at", ProviderPayment.updated_at),
+)
+EXPORT_HEADER = tuple(name for name, _ in EXPORT_COLUMNS)
+
+def _export_payment_rows(user: Optional[str] = None):
+    """
+    Yield (Payment + univapay ProviderPayment) rows as plain tuples in id order.
+    Column selects skip ORM identity tracking, and stream_results/yield_per fetch through
+    a server-side cursor (Postgres) EXPORT_CHUNK_ROWS at a time, so memory stays flat.
+    """
+    q = (
+        db.select(*(col for _, col in EXPORT_COLUMNS))
+        .outerjoin(
+            ProviderPayment,
+            db.and_(ProviderPayment.payment_id == Payment.id, ProviderPayment.provider == "univapay"),
+        )
+        .order_by(Payment.id)
+    )
+    if user:
+        q = q.where(Payment.user == user)
+    result = db.session.execute(q.execution_options(stream_results=True, yield_per=EXPORT_CHUNK_ROWS))
+    try:
+        for row in result:
+            yield tuple(utc_iso(v) if isinstance(v, datetime) else v for v in row)
+    finally:
+        result.close()
+
+def _export_lines(rows, fmt: str):
+    if fmt == "ndjson":
+        for row in rows:
+            yield json.dumps(dict(zip(EXPORT_HEADER, row)), ensure_ascii=False) + "\n"
+        return
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+
+    def _line(row) -> str:
+        writer.writerow(row)
+        line = buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+        return line
+
+    yield _line(EXPORT_HEADER)
+    for row in rows:
+        yield _line(row)
+
+@app.get("/api/payments/export")
+@auth_required
+def export_payments():
+    """Stream the caller's payments as CSV (default) or NDJSON: ?fmt=csv|ndjson"""
+    fmt = (request.args.get("fmt") or "csv").strip().lower()
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"error": f"fmt must be one of {', '.join(EXPORT_FORMATS)}"}), 400
+    stamp = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
+    return Response(
+        stream_with_context(_export_lines(_export_payment_rows(request.user), fmt)),
+        mimetype=EXPORT_FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="payments-{stamp}.{fmt}"'},
+    )
+
+@app.cli.command("export-payments")
+@click.option("--format", "fmt", type=click.Choice(sorted(EXPORT_FORMATS)), default="csv", show_default=True)
+@click.option("--output", type=click.File("w", encoding="utf-8", lazy=True), default="-", help="File path, or - for stdout.")
+@click.option("--user", default=None, help="Only this user's payments.")
+def export_payments_command(fmt, output, user):
+    """Stream all payments (with their UnivaPay mapping) as CSV or NDJSON in constant memory."""
+    for line in _export_lines(_export_payment_rows(user), fmt):
+        output.write(line)
 
 # ------------------------------------
 # Internal: polling fallback utilities
 # ------------------------------------
-def _poll_provider_status_later(kind: str, provider_row_id: int, delay_s: int, retry=False):
+# Statuses that are still worth polling again
+_POLL_UNSETTLED = {
+    "charge": (None, "", "pending", "awaiting"),
+    "subscription": (None, "", "unverified", "unconfirmed"),
+}
+
+def _epoch(dt: datetime) -> float:
+    """Naive-UTC DB datetime -> epoch seconds (the PollWorker heap key)."""
+    return dt.replace(tzinfo=timezone.utc).timestamp()
+
+def _poll_backoff(attempt: int) -> timedelta:
+    """Exponential backoff after `attempt` completed polls, capped."""
+    return timedelta(seconds=min(POLL_BACKOFF_MAX_SECONDS, POLL_RETRY_AFTER_SECONDS * 2 ** max(0, attempt - 1)))
+
+def _enqueue_status_poll(kind: str, provider_row_id: int, delay_s: int) -> PollJob:
     """
-    Schedule a one-off background poll to refresh provider status.
+    Add a durable poll job to the current session (the caller commits).
     kind: 'charge' | 'subscription'
     provider_row_id: ProviderPayment.id
-    delay_s: seconds to wait
-    retry: whether this is the second attempt
+    delay_s: seconds until the first poll
     """
-    if not ENABLE_POLL_FALLBACK or univapay is None:
-        return
+    job = PollJob(
+        provider_payment_id=provider_row_id,
+        kind=kind,
+        attempt=0,
+        next_poll_at=datetime.utcnow() + timedelta(seconds=delay_s),
+    )
+    db.session.add(job)
+    return job
 
-    def _task():
-        with app.app_context():
-            prov = ProviderPayment.query.get(provider_row_id)
-            if not prov:
-                return
-            try:
-                if kind == "charge" and prov.provider_charge_id:
-                    data = univapay.get_charge(prov.provider_charge_id)
-                elif kind == "subscription" and prov.provider_subscription_id:
-                    data = univapay.get_subscription(prov.provider_subscription_id)
-                else:
-                    return
-
-                status = (data or {}).get("status")
-                prov.status = status or prov.status
-                prov.updated_at = datetime.utcnow()
-                prov.raw_json = json.dumps(data or {}, ensure_ascii=False)
-                db.session.add(prov)
-                db.session.commit()
+def _wake_poll_worker(job):
+    """Hand a committed job to the in-process worker so it doesn't wait for the next refill."""
+    if job is not None and job.id and poll_worker.running:
+        poll_worker.schedule(job.id, _epoch(job.next_poll_at))
 
-                # Optional: second attempt if still "pending/awaiting" for charges
-                if not retry and kind == "charge" and (status in ("pending", "awaiting") or not status):
-                    _poll_provider_status_later(kind, provider_row_id, POLL_RETRY_AFTER_SECONDS, retry=True)
+def _load_due_poll_jobs(horizon: float):
+    horizon_dt = datetime.fromtimestamp(horizon, timezone.utc).replace(tzinfo=None)
+    with app.app_context():
+        try:
+            rows = (
+                db.session.query(PollJob.id, PollJob.next_poll_at)
+                .filter(PollJob.next_poll_at <= horizon_dt)
+                .order_by(PollJob.next_poll_at)
+                .limit(1000)
+                .all()
+            )
+            return [(_epoch(next_at), job_id) for job_id, next_at in rows]
+        finally:
+            db.session.remove()  # runs on the worker thread: return its connection to the pool
+
+def _run_poll_job(job_id: int):
+    """Poll UnivaPay once for a job; returns the next due time (epoch) or None when finished."""
+    with app.app_context():
+        try:
+            return _poll_job_once(job_id)
+        finally:
+            db.session.remove()  # runs on a pool thread: return its connection to the pool
+
+def _poll_job_once(job_id: int):
+    now = datetime.utcnow()
+    # Claim the job by pushing next_poll_at out by a lease, so other processes skip it
+    claimed = (
+        PollJob.query.filter(PollJob.id == job_id, PollJob.next_poll_at <= now)
+        .update({"next_poll_at": now + timedelta(seconds=POLL_LEASE_SECONDS)}, synchronize_session=False)
+    )
+    db.session.commit()
+    job = db.session.get(PollJob, job_id)
+    if job is None:
+        return None
+    if not claimed:
+        return _epoch(job.next_poll_at)
+
+    prov = db.session.get(ProviderPayment, job.provider_payment_id)
+    if prov is None:
+        db.session.delete(job)
+        db.session.commit()
+        return None
 
-            except Exception as e:
-                db.session.rollback()
-                print(f"[Poller] Error polling {kind} provider_id={provider_row_id}: {e}")
+    kind = job.kind
+    try:
+        if kind == "charge" and prov.provider_charge_id:
+            data = univapay.get_charge(prov.provider_charge_id)
+        elif kind == "subscription" and prov.provider_subscription_id:
+            data = univapay.get_subscription(prov.provider_subscription_id)
+        else:
+            db.session.delete(job)
+            db.session.commit()
+            return None
+
+        status = (data or {}).get("status")
+        changed = bool(status) and status != prov.status
+        before = prov.status
+        prov.status = status or prov.status
+        prov.updated_at = datetime.utcnow()
+        prov.raw_json = json.dumps(data or {}, ensure_ascii=False)
+        db.session.add(prov)
+        row = _summary_rows_for_provider([prov.id]).get(prov.id)
+        if row:
+            _record_payment_transitions([(row, before, prov.status)])
+        settled = status not in _POLL_UNSETTLED.get(kind, ())
+    except Exception as e:
+        db.session.rollback()
+        print(f"[Poller] Error polling {kind} provider_id={job.provider_payment_id}: {e}")
+        changed, settled = False, False
+
+    job.attempt += 1
+    done = settled or job.attempt >= POLL_MAX_ATTEMPTS
+    if done:
+        db.session.delete(job)
+    else:
+        job.next_poll_at = datetime.utcnow() + _poll_backoff(job.attempt)
+    db.session.commit()
+
+    if changed:
+        _publish_status(prov)
+    return None if done else _epoch(job.next_poll_at)
+
+# One worker per process drains the poll_jobs table (replaces a threading.Timer per payment)
+poll_worker = PollWorker(_load_due_poll_jobs, _run_poll_job, max_concurrency=POLL_CONCURRENCY)
+
+@app.before_request
+def _start_poll_worker():
+    # Started lazily from a request so only serving processes (not the reloader parent) run it
+    if ENABLE_POLL_FALLBACK and univapay is not None and not poll_worker.running:
+        poll_worker.start()
+
+# ------------------------------------
+# Internal: batched status reconciliation
+# ------------------------------------
+RECONCILE_SLACK = timedelta(hours=1)  # provider created_on may lead our created_at slightly
+
+def _parse_provider_ts(val):
+    try:
+        return _parse_since(val) if val else None
+    except Exception:
+        return None
+
+def _reconcile_kind(kind: str, page_size: int) -> int:
+    """
+    Walk the store-scoped list endpoint (newest first) and bulk-apply status changes to
+    unsettled ProviderPayment rows, one transaction per page. Stops once the pages are
+    older than the oldest unsettled row. Returns the number of rows updated.
+    """
+    id_col = ProviderPayment.provider_charge_id if kind == "charge" else ProviderPayment.provider_subscription_id
+    rows = (
+        db.session.query(ProviderPayment.id, id_col, ProviderPayment.status, ProviderPayment.created_at)
+        .filter(ProviderPayment.provider == "univapay", id_col.isnot(None))
+        .filter(db.or_(ProviderPayment.status.is_(None), ProviderPayment.status.in_(_POLL_UNSETTLED[kind][1:])))
+        .all()
+    )
+    if not rows:
+        return 0
+    pending = {ext_id: (row_id, status) for row_id, ext_id, status, _ in rows}
+    oldest = min(created for *_, created in rows) - RECONCILE_SLACK
+
+    pages = univapay.iter_charges(page_size=page_size) if kind == "charge" else univapay.iter_subscriptions(page_size=page_size)
+    updated = 0
+    for items in pages:
+        now = datetime.utcnow()
+        changes = []
+        before = {}  # ProviderPayment.id -> status being replaced
+        for item in items:
+            match = pending.pop(str(item.get("id")), None)
+            if match and item.get("status") and item["status"] != match[1]:
+                before[match[0]] = match[1]
+                changes.append({
+                    "id": match[0],
+                    "status": item["status"],
+                    "updated_at": now,
+                    "raw_json": json.dumps(item, ensure_ascii=False),
+                })
+        if changes:
+            # ORM bulk UPDATE by primary key: one executemany per page
+            db.session.execute(db.update(ProviderPayment), changes)
+            summary_rows = _summary_rows_for_provider(c["id"] for c in changes)
+            _record_payment_transitions(
+                (summary_rows[c["id"]], before[c["id"]], c["status"]) for c in changes if c["id"] in summary_rows
+            )
+            settled = [c["id"] for c in changes if c["status"] not in _POLL_UNSETTLED[kind]]
+            if settled:
+                PollJob.query.filter(PollJob.provider_payment_id.in_(settled)).delete(synchronize_session=False)
+            db.session.commit()
+            updated += len(changes)
+            for prov in ProviderPayment.query.filter(ProviderPayment.id.in_([c["id"] for c in changes])):
+                _publish_status(prov)
+
+        last_created = _parse_provider_ts(items[-1].get("created_on"))
+        if not pending or (last_created is not None and last_created < oldest):
+            break
+    return updated
+
+def reconcile_provider_statuses(page_size: int = 100) -> dict:
+    """Reconcile every unsettled charge and subscription using paged list calls."""
+    if univapay is None:
+        raise RuntimeError("UnivaPay client not initialized (check env vars).")
+    return {kind: _reconcile_kind(kind, page_size) for kind in ("charge", "subscription")}
 
-    threading.Timer(delay_s, _task).start()
+@app.cli.command("reconcile-statuses")
+@click.option("--page-size", default=100, show_default=True, help="Items per provider list call.")
+def reconcile_statuses_command(page_size):
+    """Bulk-refresh unsettled provider statuses from UnivaPay list endpoints."""
+    result = reconcile_provider_statuses(page_size=page_size)
+    click.echo(f"[Reconcile] updated charges={result['charge']} subscriptions={result['subscription']}")
+
+# ------------------------------------
+# Checkout idempotency (client Idempotency-Key)
+# ------------------------------------
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+# UnivaPay's own Idempotency-Key is derived from (user, client key), so a repeat that
+# slips past the local claim (e.g. after a crash mid-request) is still collapsed upstream
+IDEMPOTENCY_PROVIDER_NAMESPACE = uuid.UUID("5b0f2f7e-93c1-4c39-9d3c-6f1f6d0c9a71")
+
+# O(1) front for completed keys: (user, key) -> (request_hash, status, body JSON)
+recent_idempotent = RecentValues(max_size=IDEMPOTENCY_CACHE_SIZE, ttl_seconds=IDEMPOTENCY_CACHE_SECONDS)
+
+def _idempotency_fingerprint(data) -> str:
+    return hashlib.sha256(json.dumps(data, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def _provider_idempotency_key(user: str, key: str) -> str:
+    return str(uuid.uuid5(IDEMPOTENCY_PROVIDER_NAMESPACE, f"{user}:{key}"))
+
+def _replay_idempotent(stored: tuple, fingerprint: str):
+    request_hash, status, body = stored
+    if request_hash != fingerprint:
+        return jsonify({"error": f"{IDEMPOTENCY_HEADER} was already used for a different request"}), 422
+    resp = Response(body, status=status, mimetype="application/json")
+    resp.headers["Idempotent-Replayed"] = "true"
+    return resp
+
+def _claim_idempotency_key(user: str, key: str, data):
+    """
+    Claim (user, key) before calling UnivaPay. Returns (claim, None) when this request
+    should run, or (None, response) to return as-is: the stored response of the first
+    request, 409 while it is still in flight, 422 when the key is reused with another body.
+    The claim is committed at once so a concurrent duplicate sees it; it is returned as
+    (IdempotencyKey.id, request_hash) so completing it doesn't reload the expired row.
+    """
+    if len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        return None, (jsonify({"error": f"{IDEMPOTENCY_HEADER} must be at most {IDEMPOTENCY_KEY_MAX_LENGTH} characters"}), 400)
+    fingerprint = _idempotency_fingerprint(data)
+    stored = recent_idempotent.get((user, key))
+    if stored is not None:
+        return None, _replay_idempotent(stored, fingerprint)
+
+    row = IdempotencyKey(user=user, key=key, request_hash=fingerprint, claimed_at=datetime.utcnow())
+    db.session.add(row)
+    try:
+        db.session.flush()
+        claim = (row.id, fingerprint)
+        db.session.commit()
+        return claim, None
+    except IntegrityError:
+        db.session.rollback()
+
+    row = IdempotencyKey.query.filter_by(user=user, key=key).first()
+    current = datetime.utcnow()
+    if row is not None and row.response_status is not None and row.claimed_at > current - timedelta(hours=IDEMPOTENCY_TTL_HOURS):
+        stored = (row.request_hash, row.response_status, row.response_body)
+        db.session.rollback()
+        recent_idempotent.put((user, key), stored)
+        return None, _replay_idempotent(stored, fingerprint)
+    if row is not None and row.response_status is None and row.request_hash != fingerprint:
+        db.session.rollback()
+        return None, (jsonify({"error": f"{IDEMPOTENCY_HEADER} was already used for a different request"}), 422)
+
+    # Expired, or claimed by a request that never finished: take it over (compare-and-set)
+    taken = 0
+    if row is not None:
+        taken = IdempotencyKey.query.filter(
+            IdempotencyKey.id == row.id,
+            IdempotencyKey.claimed_at == row.claimed_at,
+            db.or_(IdempotencyKey.response_status.isnot(None),
+                   IdempotencyKey.claimed_at < current - timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS)),
+        ).update({
+            "request_hash": fingerprint, "response_status": None, "response_body": None,
+            "claimed_at": current, "completed_at": None,
+        }, synchronize_session=False)
+    claim = (row.id, fingerprint) if taken else None
+    db.session.commit()
+    if not taken:
+        return None, (jsonify({"error": f"A request with this {IDEMPOTENCY_HEADER} is still in progress"}), 409)
+    return claim, None
+
+def _complete_idempotency_key(claim: tuple, status: int, body: dict) -> tuple:
+    """Stage the response on the claim (commit it with the request's own writes); returns the cache entry."""
+    claim_id, request_hash = claim
+    response_body = json.dumps(body, ensure_ascii=False)
+    db.session.execute(
+        db.update(IdempotencyKey).where(IdempotencyKey.id == claim_id)
+        .values(response_status=status, response_body=response_body, completed_at=datetime.utcnow())
+    )
+    return (request_hash, status, response_body)
+
+def _release_idempotency_key(claim: tuple) -> None:
+    """Give the key back after a failure that a retry could fix (nothing was stored)."""
+    db.session.rollback()
+    try:
+        IdempotencyKey.query.filter(
+            IdempotencyKey.id == claim[0], IdempotencyKey.response_status.is_(None)
+        ).delete(synchronize_session=False)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()  # the claim expires after IDEMPOTENCY_LOCK_SECONDS anyway
+        print(f"[Idempotency] Could not release key: {e.__class__.__name__}")
+
+def prune_idempotency_keys(older_than_hours: int = IDEMPOTENCY_TTL_HOURS) -> int:
+    cutoff = datetime.utcnow() - timedelta(hours=older_than_hours)
+    removed = IdempotencyKey.query.filter(IdempotencyKey.claimed_at < cutoff).delete(synchronize_session=False)
+    db.session.commit()
+    return removed
+
+@app.cli.command("prune-idempotency-keys")
+@click.option("--older-than-hours", default=IDEMPOTENCY_TTL_HOURS, show_default=True,
+              help="Delete claims made longer ago than this.")
+def prune_idempotency_keys_command(older_than_hours):
+    """Delete expired checkout idempotency keys (run daily, e.g. from cron)."""
+    click.echo(f"[Idempotency] removed {prune_idempotency_keys(older_than_hours)} key(s)")
 
 # ------------------------------------
 # UnivaPay: Checkout (server-to-server)
 # ------------------------------------
+def _provider_unavailable(e: ProviderUnavailable):
+    """503 for a call the client shed locally (breaker open / concurrency limit): nothing reached UnivaPay."""
+    resp = jsonify({"error": "UnivaPay is temporarily unavailable", "detail": str(e)})
+    resp.headers["Retry-After"] = str(max(1, round(e.retry_after)))
+    return resp, 503
+
 @app.post("/api/checkout/charge")
 @auth_required
 def univapay_checkout_charge():
@@ -333,8 +1339,17 @@ def univapay_checkout_charge():
     except Exception:
         return jsonify({"error": "amount must be a positive integer (JPY)"}), 400
 
+    # Optional client key: a double-clicked pay button or a client retry replays the first response
+    claim = None
+    client_key = (request.headers.get(IDEMPOTENCY_HEADER) or "").strip()
+    if client_key:
+        claim, early = _claim_idempotency_key(request.user, client_key, data)
+        if early is not None:
+            return early
+
     try:
-        idem_key = UnivapayClient.new_idempotency_key()
+        idem_key = (_provider_idempotency_key(request.user, client_key) if claim is not None
+                    else UnivapayClient.new_idempotency_key())
         resp = univapay.create_charge(
             transaction_token_id=token_id,
             amount=amount,
@@ -364,13 +1379,15 @@ def univapay_checkout_charge():
             updated_at=datetime.utcnow(),
         )
         db.session.add(prov)
-        db.session.commit()
+        db.session.flush()
+        _record_payment_created(pay, prov)
 
-        # 4) Schedule a one-off poll as fallback to webhook
+        # 4) Queue a durable status poll as fallback to webhook (same transaction)
+        job = None
         if ENABLE_POLL_FALLBACK and prov.provider_charge_id:
-            _poll_provider_status_later("charge", prov.id, POLL_AFTER_SECONDS)
+            job = _enqueue_status_poll("charge", prov.id, POLL_AFTER_SECONDS)
 
-        return jsonify({
+        body = {
             "ok": True,
             "payment": pay.to_dict(),
             "provider": {
@@ -386,10 +1403,36 @@ def univapay_checkout_charge():
                 # UnivaPay can return redirect/three_ds info (for 3DS flows)
                 "redirect": (resp.get("redirect") or resp.get("three_ds") or {}) if isinstance(resp, dict) else {},
             }
-        }), 201
+        }
+        # 5) Store the response for replays in the same transaction as the payment rows
+        stored = _complete_idempotency_key(claim, 201, body) if claim is not None else None
+        db.session.commit()
+        _wake_poll_worker(job)
+        if stored is not None:
+            recent_idempotent.put((request.user, client_key), stored)
+        return jsonify(body), 201
+    except ProviderUnavailable as e:
+        if claim is not None:
+            _release_idempotency_key(claim)
+        return _provider_unavailable(e)
     except UnivapayError as e:
-        return jsonify({"error": "UnivaPay charge failed", "detail": e.body, "status": e.status}), 400
+        body = {"error": "UnivaPay charge failed", "detail": e.body, "status": e.status}
+        if claim is not None:
+            if e.status is not None and 400 <= e.status < 500 and e.status != 429:
+                # A rejected card/token fails the same way again: replay the rejection
+                try:
+                    db.session.rollback()
+                    stored = _complete_idempotency_key(claim, 400, body)
+                    db.session.commit()
+                    recent_idempotent.put((request.user, client_key), stored)
+                except Exception:
+                    _release_idempotency_key(claim)
+            else:
+                _release_idempotency_key(claim)
+        return jsonify(body), 400
     except Exception as e:
+        if claim is not None:
+            _release_idempotency_key(claim)
         return jsonify({"error": "Unexpected error creating charge", "detail": str(e)}), 500
 
 @app.post("/api/checkout/subscription")
@@ -446,11 +1489,15 @@ def univapay_checkout_subscription():
             updated_at=datetime.utcnow(),
         )
         db.session.add(prov)
-        db.session.commit()
+        db.session.flush()
+        _record_payment_created(pay, prov)
 
-        # 4) Schedule a one-off poll as fallback to webhook
+        # 4) Queue a durable status poll as fallback to webhook (same transaction)
+        job = None
         if ENABLE_POLL_FALLBACK and prov.provider_subscription_id:
-            _poll_provider_status_later("subscription", prov.id, POLL_AFTER_SECONDS)
+            job = _enqueue_status_poll("subscription", prov.id, POLL_AFTER_SECONDS)
+        db.session.commit()
+        _wake_poll_worker(job)
 
         return jsonify({
             "ok": True,
@@ -468,6 +1515,8 @@ def univapay_checkout_subscription():
                 "next_payment": resp.get("next_payment") if isinstance(resp, dict) else None,
             }
         }), 201
+    except ProviderUnavailable as e:
+        return _provider_unavailable(e)
     except UnivapayError as e:
         return jsonify({"error": "UnivaPay subscription failed", "detail": e.body, "status": e.status}), 400
     except Exception as e:
@@ -476,6 +1525,146 @@ def univapay_checkout_subscription():
 # ------------------------
 # Webhook: receive & apply
 # ------------------------
+def _webhook_target(payload: dict):
+    """Extract (charge_id, subscription_id, new_status) from the several payload shapes UnivaPay sends."""
+    obj = payload.get("object")
+    data_obj = payload.get("data") if isinstance(payload.get("data"), dict) else {}
+
+    charge_id = None
+    subscription_id = None
+
+    if obj in ("charge", "charges"):
+        charge_id = payload.get("id") or data_obj.get("id")
+    elif obj in ("subscription", "subscriptions"):
+        subscription_id = payload.get("id") or data_obj.get("id")
+    else:
+        # Try nested shapes
+        charge_id = (payload.get("charge", {}) or {}).get("id") or data_obj.get("charge_id")
+        subscription_id = (payload.get("subscription", {}) or {}).get("id") or data_obj.get("subscription_id")
+
+    new_status = payload.get("status") or data_obj.get("status")
+    return (
+        str(charge_id) if charge_id else None,
+        str(subscription_id) if subscription_id else None,
+        str(new_status) if new_status else None,
+    )
+
+def _apply_webhook_batch(limit: int = WEBHOOK_BATCH_SIZE) -> int:
+    """
+    Apply up to `limit` unprocessed inbox events in arrival order, in one transaction:
+    one IN-lookup per id kind, status writes coalesced per row, events marked processed.
+    Returns the number of events consumed.
+    """
+    events = (
+        WebhookEvent.query.filter(WebhookEvent.processed_at.is_(None))
+        .order_by(WebhookEvent.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)  # no-op on SQLite; lets several consumers share Postgres
+        .all()
+    )
+    if not events:
+        db.session.rollback()
+        return 0
+
+    targets = []
+    for evt in events:
+        try:
+            payload = json.loads(evt.payload)
+        except ValueError:
+            payload = None
+        targets.append(_webhook_target(payload) if isinstance(payload, dict) else (None, None, None))
+
+    charge_ids = {c for c, _, _ in targets if c}
+    subscription_ids = {s for _, s, _ in targets if s}
+    by_charge = {}
+    by_subscription = {}
+    if charge_ids:
+        by_charge = {
+            p.provider_charge_id: p
+            for p in ProviderPayment.query.filter(
+                ProviderPayment.provider == "univapay", ProviderPayment.provider_charge_id.in_(charge_ids)
+            )
+        }
+    if subscription_ids:
+        by_subscription = {
+            p.provider_subscription_id: p
+            for p in ProviderPayment.query.filter(
+                ProviderPayment.provider == "univapay", ProviderPayment.provider_subscription_id.in_(subscription_ids)
+            )
+        }
+
+    now = datetime.utcnow()
+    touched = {}  # ProviderPayment.id -> (row, status before this batch)
+    for charge_id, subscription_id, new_status in targets:
+        prov = by_charge.get(charge_id) if charge_id else None
+        if prov is None and subscription_id:
+            prov = by_subscription.get(subscription_id)
+        if prov is None:
+            continue
+        touched.setdefault(prov.id, (prov, prov.status))
+        if new_status:
+            prov.status = new_status
+        prov.updated_at = now
+
+    changed = [(prov, before) for prov, before in touched.values() if prov.status != before]
+    # Every touched row moves updated_at in /api/payments, so all of them stamp the summary
+    summary_rows = _summary_rows_for_provider(touched)
+    _record_payment_transitions(
+        (summary_rows[prov.id], before, prov.status) for prov, before in touched.values() if prov.id in summary_rows
+    )
+
+    # A settled status from the webhook makes any queued poll for these rows redundant
+    unsettled = _POLL_UNSETTLED["charge"] + _POLL_UNSETTLED["subscription"]
+    settled_ids = [row_id for row_id, (prov, _) in touched.items() if prov.status not in unsettled]
+    if settled_ids:
+        PollJob.query.filter(PollJob.provider_payment_id.in_(settled_ids)).delete(synchronize_session=False)
+
+    WebhookEvent.query.filter(WebhookEvent.id.in_([e.id for e in events])).update(
+        {"processed_at": now}, synchronize_session=False
+    )
+    db.session.commit()
+
+    for prov, _ in changed:
+        _publish_status(prov)
+    return len(events)
+
+def _drain_webhook_inbox() -> int:
+    with app.app_context():
+        try:
+            return _apply_webhook_batch()
+        except Exception as e:
+            db.session.rollback()
+            print(f"[Webhook] Error applying inbox batch: {e}")
+            return 0
+
+def _webhook_dedup_key(raw: bytes) -> str:
+    # UnivaPay payloads carry the charge/subscription id but no delivery id, and a retry
+    # resends the identical body, so the body hash identifies the delivery
+    return "sha256:" + hashlib.sha256(raw).hexdigest()
+
+# O(1) front for ux_webhook_events_dedup; a miss falls through to the unique index
+recent_webhooks = RecentKeys(max_size=WEBHOOK_DEDUP_CACHE_SIZE, ttl_seconds=WEBHOOK_DEDUP_TTL_SECONDS)
+
+# One consumer per process applies inbox events; the webhook handler only appends
+webhook_inbox = InboxWorker(_drain_webhook_inbox, idle_seconds=WEBHOOK_IDLE_SECONDS, name="webhook-inbox")
+
+@app.before_request
+def _start_webhook_inbox():
+    if WEBHOOK_CONSUMER_ENABLE and not webhook_inbox.running:
+        webhook_inbox.start()
+
+@app.cli.command("process-webhooks")
+@click.option("--batch-size", default=WEBHOOK_BATCH_SIZE, show_default=True, help="Events per transaction.")
+def process_webhooks_command(batch_size):
+    """Apply every pending webhook inbox event (for running the consumer out of process)."""
+    total = 0
+    while True:
+        n = _apply_webhook_batch(limit=batch_size)
+        if not n:
+            break
+        total += n
+    click.echo(f"[Webhook] applied {total} event(s)")
+
 @app.post("/api/univapay/webhook")
 def univapay_webhook():
     # 1) Verify a simple shared secret in Authorization header
@@ -487,7 +1676,7 @@ def univapay_webhook():
 
     # 2) Parse body
     payload = request.get_json(silent=True)
-    if payload is None:
+    if not isinstance(payload, dict):
         return jsonify({"error": "Invalid JSON"}), 400
 
     # Capture basic event fields
@@ -499,64 +1688,133 @@ def univapay_webhook():
         "x-forwarded-for": request.headers.get("X-Forwarded-For"),
     }
 
-    # 3) Store the raw webhook (for audit/debug)
+    # 3) Drop redelivered events before touching the database
+    raw = request.get_data()
+    dedup_key = _webhook_dedup_key(raw)
+    if dedup_key in recent_webhooks:
+        return jsonify({"ok": True, "duplicate": True})
+
+    # 4) Append the raw event to the inbox; the consumer applies status updates in batches
     evt = WebhookEvent(
         provider="univapay",
         event_type=str(event_type) if event_type else None,
-        payload=json.dumps(payload, ensure_ascii=False),
+        payload=raw.decode("utf-8", errors="replace"),
         headers=json.dumps(headers_subset, ensure_ascii=False),
+        dedup_key=dedup_key,
     )
-    db.session.add(evt)
-
-    # 4) Attempt to update ProviderPayment status
-    #    We defensively extract IDs from several possible shapes.
-    obj = payload.get("object")
-    data_obj = payload.get("data") if isinstance(payload.get("data"), dict) else {}
-
-    charge_id = None
-    subscription_id = None
-
-    if obj in ("charge", "charges"):
-        charge_id = payload.get("id") or data_obj.get("id")
-    elif obj in ("subscription", "subscriptions"):
-        subscription_id = payload.get("id") or data_obj.get("id")
-    else:
-        # Try nested shapes
-        charge_id = (payload.get("charge", {}) or {}).get("id") or data_obj.get("charge_id")
-        subscription_id = (payload.get("subscription", {}) or {}).get("id") or data_obj.get("subscription_id")
-
-    new_status = payload.get("status") or data_obj.get("status")
-
     try:
-        updated = False
-        now = datetime.utcnow()
-
-        if charge_id:
-            prov = ProviderPayment.query.filter_by(provider="univapay", provider_charge_id=str(charge_id)).first()
-            if prov:
-                if new_status:
-                    prov.status = str(new_status)
-                prov.updated_at = now
-                db.session.add(prov)
-                updated = True
-
-        if subscription_id and not updated:
-            prov = ProviderPayment.query.filter_by(provider="univapay", provider_subscription_id=str(subscription_id)).first()
-            if prov:
-                if new_status:
-                    prov.status = str(new_status)
-                prov.updated_at = now
-                db.session.add(prov)
-                updated = True
-
+        db.session.add(evt)
         db.session.commit()
-    except Exception:
-        # Don't block webhook ack on DB update errors
+    except IntegrityError:
+        # Already in the inbox (another worker, or evicted from the LRU)
+        db.session.rollback()
+        recent_webhooks.add(dedup_key)
+        return jsonify({"ok": True, "duplicate": True})
+    except Exception as e:
+        # Not stored: let UnivaPay retry the delivery
         db.session.rollback()
+        print(f"[Webhook] Failed to store event: {e}")
+        return jsonify({"error": "Webhook not stored"}), 503
+    recent_webhooks.add(dedup_key)
+    webhook_inbox.notify()
 
     # 5) Respond quickly
     return jsonify({"ok": True})
 
+# ------------------------------------
+# Webhook event log retention
+# ------------------------------------
+# webhook_events stays the inbox and dedup index for recent deliveries only; older
+# processed rows move to <WEBHOOK_ARCHIVE_DIR>/webhook_events-YYYY-MM-DD.NNNN.jsonl.gz
+WEBHOOK_ARCHIVE_PREFIX = "webhook_events"
+
+def _archive_record(row) -> dict:
+    return {
+        "id": row.id,
+        "provider": row.provider,
+        "event_type": row.event_type,
+        "received_at": utc_iso(row.received_at),
+        "processed_at": utc_iso(row.processed_at),
+        "dedup_key": row.dedup_key,
+        "headers": json.loads(row.headers) if row.headers else None,
+        "payload": row.payload,  # raw body, exactly as received
+    }
+
+def archive_webhook_events(retention_days: int = WEBHOOK_LOG_RETENTION_DAYS,
+                           archive_dir: str = WEBHOOK_ARCHIVE_DIR,
+                           segment_rows: int = WEBHOOK_ARCHIVE_SEGMENT_ROWS,
+                           batch_size: int = 500) -> list:
+    """
+    Stream processed events received before the retention cutoff (whole UTC days) into
+    daily gzip JSONL segments, deleting each segment's rows once the file is durable.
+    Pending events are never archived. Scans by primary key (received_at is stamped at
+    insert, so id order is arrival order) and stops at the cutoff; no extra index needed.
+    A crash between rename and delete re-archives those rows in a later part; readers
+    should treat `id` as the key. Returns [(path, rows), ...].
+    """
+    cutoff = datetime.combine((datetime.utcnow() - timedelta(days=retention_days)).date(), datetime.min.time())
+    cols = (WebhookEvent.id, WebhookEvent.provider, WebhookEvent.event_type, WebhookEvent.payload,
+            WebhookEvent.headers, WebhookEvent.received_at, WebhookEvent.processed_at, WebhookEvent.dedup_key)
+    written = []
+    segment, segment_ids = None, []
+
+    def finish():
+        path = segment.commit()
+        for i in range(0, len(segment_ids), batch_size):
+            db.session.execute(db.delete(WebhookEvent).where(WebhookEvent.id.in_(segment_ids[i:i + batch_size])))
+            db.session.commit()
+        written.append((path, len(segment_ids)))
+
+    last_id = 0
+    try:
+        while True:
+            rows = db.session.execute(
+                db.select(*cols).where(WebhookEvent.id > last_id).order_by(WebhookEvent.id).limit(batch_size)
+            ).all()
+            db.session.rollback()  # don't hold a read transaction open across the batch
+            if not rows:
+                break
+            reached_cutoff = False
+            for row in rows:
+                last_id = row.id
+                if row.received_at >= cutoff:
+                    reached_cutoff = True
+                    break
+                if row.processed_at is None:
+                    continue
+                day = row.received_at.date()
+                if segment is not None and (segment.day != day or len(segment_ids) >= segment_rows):
+                    finish()
+                    segment, segment_ids = None, []
+                if segment is None:
+                    segment = SegmentWriter(archive_dir, WEBHOOK_ARCHIVE_PREFIX, day)
+                segment.write(_archive_record(row))
+                segment_ids.append(row.id)
+            if reached_cutoff:
+                break
+        if segment is not None:
+            finish()
+            segment = None
+    except Exception:
+        db.session.rollback()
+        if segment is not None:
+            segment.abort()
+        raise
+    return written
+
+@app.cli.command("archive-webhooks")
+@click.option("--retention-days", default=WEBHOOK_LOG_RETENTION_DAYS, show_default=True,
+              help="Keep processed events this many days in webhook_events.")
+@click.option("--archive-dir", default=WEBHOOK_ARCHIVE_DIR, show_default=True)
+@click.option("--keep-days", default=WEBHOOK_ARCHIVE_KEEP_DAYS, show_default=True,
+              help="Delete archive segments older than this many days (0 = keep forever).")
+def archive_webhooks_command(retention_days, archive_dir, keep_days):
+    """Move old processed webhook events to compressed daily segments (run daily, e.g. from cron)."""
+    for path, rows in archive_webhook_events(retention_days=retention_days, archive_dir=archive_dir):
+        click.echo(f"[Webhook] archived {rows} event(s) -> {path}")
+    for path in prune_segments(archive_dir, WEBHOOK_ARCHIVE_PREFIX, keep_days, datetime.utcnow().date()):
+        click.echo(f"[Webhook] removed expired segment {path}")
+
 # -----------
 # Entrypoint
 # -----------
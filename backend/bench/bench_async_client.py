@@ -0,0 +1,107 @@
+"""
+Throughput of UnivapayClient (threads) vs AsyncUnivapayClient (one event loop)
+against a local stub that answers GET /charges/{id} after a fixed latency.
+
+    python bench/bench_async_client.py --requests 500 --concurrency 50 --latency-ms 50
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from requests.adapters import HTTPAdapter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("UNIVAPAY_APP_TOKEN", "bench-token")
+os.environ.setdefault("UNIVAPAY_APP_SECRET", "bench-secret")
+os.environ["UNIVAPAY_STORE_ID"] = ""
+# Measure the client, not the adaptive concurrency limit (it would shed --concurrency above 20)
+os.environ["UNIVAPAY_CONCURRENCY_INITIAL"] = "10000"
+os.environ["UNIVAPAY_CONCURRENCY_MAX"] = "10000"
+# Nor the shared outbound token bucket (the default 50 reads/s would cap the sync side)
+os.environ["UNIVAPAY_RATE_READS_PER_SECOND"] = "0"
+os.environ["UNIVAPAY_RATE_WRITES_PER_SECOND"] = "0"
+
+from univapay_client import UnivapayClient  # noqa: E402
+from univapay_async import AsyncUnivapayClient  # noqa: E402
+
+
+def _serve_stub(latency_s: float, port_q) -> None:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive
+        disable_nagle_algorithm = True  # headers and body are separate writes
+
+        def do_GET(self):
+            time.sleep(latency_s)
+            body = json.dumps({"id": self.path.rsplit("/", 1)[-1], "status": "successful"}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    class Server(ThreadingHTTPServer):
+        daemon_threads = True
+        request_queue_size = 1024  # the default backlog of 5 drops bursts of concurrent connects
+
+    server = Server(("127.0.0.1", 0), Handler)
+    port_q.put(server.server_address[1])
+    server.serve_forever()
+
+
+def start_stub(latency_s: float):
+    """Run the stub in its own process so its threads don't compete with the client for the GIL."""
+    port_q = multiprocessing.Queue()
+    proc = multiprocessing.Process(target=_serve_stub, args=(latency_s, port_q), daemon=True)
+    proc.start()
+    return proc, f"http://127.0.0.1:{port_q.get(timeout=10)}"
+
+
+def bench_sync(base_url: str, n: int, concurrency: int) -> float:
+    client = UnivapayClient(base_url=base_url)
+    # requests keeps 10 connections per host by default; match the async side's max_connections
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+    client._session.mount("http://", adapter)
+    client._session.mount("https://", adapter)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(lambda i: client.get_charge(f"ch_{i}"), range(n)))
+    return time.perf_counter() - start
+
+
+async def _bench_async(base_url: str, n: int, concurrency: int) -> float:
+    async with AsyncUnivapayClient(base_url=base_url, max_connections=concurrency) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(client.get_charge(f"ch_{i}") for i in range(n)))
+        return time.perf_counter() - start
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--requests", type=int, default=500)
+    ap.add_argument("--concurrency", type=int, default=50)
+    ap.add_argument("--latency-ms", type=float, default=50.0)
+    args = ap.parse_args()
+
+    proc, base_url = start_stub(args.latency_ms / 1000.0)
+    try:
+        sync_s = bench_sync(base_url, args.requests, args.concurrency)
+        async_s = asyncio.run(_bench_async(base_url, args.requests, args.concurrency))
+    finally:
+        proc.terminate()
+
+    print(f"requests={args.requests} concurrency={args.concurrency} latency={args.latency_ms:.0f}ms")
+    print(f"  sync  (threads): {sync_s:7.3f}s  {args.requests / sync_s:8.1f} req/s")
+    print(f"  async (asyncio): {async_s:7.3f}s  {args.requests / async_s:8.1f} req/s")
+
+
+if __name__ == "__main__":
+    main()
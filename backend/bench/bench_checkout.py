@@ -0,0 +1,247 @@
+"""
+Load benchmark for the checkout hot paths in app.py, run against the local UnivaPay
+simulator. For each scenario it reports p50/p95/p99 latency, throughput and the number
+of SQL statements per request, and can save/compare a JSON baseline.
+
+    python bench/bench_checkout.py --requests 300 --concurrency 8 --latency mean=80,jitter=30,dist=lognormal
+    python bench/bench_checkout.py --save-baseline bench/baselines/flask_checkout.json
+    python bench/bench_checkout.py --compare bench/baselines/flask_checkout.json
+
+Scenarios: checkout_charge, checkout_subscription, payments_list, webhook.
+The app runs in-process (Flask test client, one thread per concurrent caller) on a
+throwaway SQLite file unless --database-url is given; the simulator runs in a child process.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Tuple
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+from univapay_simulator import SimConfig, _parse_latency, start_in_process  # noqa: E402
+
+SCENARIOS = ("checkout_charge", "checkout_subscription", "payments_list", "webhook")
+WEBHOOK_SECRET = "bench-webhook-secret"
+
+
+# -------------------------
+# Stats
+# -------------------------
+def percentile(sorted_vals: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_vals:
+        return 0.0
+    k = max(0, min(len(sorted_vals) - 1, int(round(pct / 100.0 * len(sorted_vals) + 0.5)) - 1))
+    return sorted_vals[k]
+
+
+def summarize(samples: List[Tuple[float, int, int]], wall_s: float) -> Dict[str, Any]:
+    """samples: (latency_s, sql_statements, http_status) per request."""
+    lat = sorted(s[0] * 1000.0 for s in samples)
+    n = len(samples)
+    return {
+        "count": n,
+        "errors": sum(1 for s in samples if s[2] >= 400),
+        "p50_ms": round(percentile(lat, 50), 2),
+        "p95_ms": round(percentile(lat, 95), 2),
+        "p99_ms": round(percentile(lat, 99), 2),
+        "mean_ms": round(sum(lat) / n, 2) if n else 0.0,
+        "rps": round(n / wall_s, 1) if wall_s > 0 else 0.0,
+        "queries_per_req": round(sum(s[1] for s in samples) / n, 2) if n else 0.0,
+    }
+
+
+def print_table(results: Dict[str, Dict[str, Any]]) -> None:
+    print(f"{'scenario':<24}{'n':>6}{'err':>5}{'p50ms':>9}{'p95ms':>9}{'p99ms':>9}{'req/s':>9}{'sql/req':>9}")
+    for name, r in results.items():
+        print(
+            f"{name:<24}{r['count']:>6}{r['errors']:>5}{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}"
+            f"{r['p99_ms']:>9.1f}{r['rps']:>9.1f}{r['queries_per_req']:>9.2f}"
+        )
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Regressions vs a saved baseline: p95 beyond tolerance, or any extra SQL per request."""
+    problems = []
+    for name, r in results.items():
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            continue
+        if base["p95_ms"] and r["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            problems.append(f"{name}: p95 {r['p95_ms']:.1f}ms vs baseline {base['p95_ms']:.1f}ms")
+        if r["queries_per_req"] > base["queries_per_req"] + 0.01:
+            problems.append(f"{name}: {r['queries_per_req']:.2f} sql/req vs baseline {base['queries_per_req']:.2f}")
+    return problems
+
+
+# -------------------------
+# Harness
+# -------------------------
+def _load_app(base_url: str, database_url: str, poller: bool):
+    # app.py and univapay_client.py read their config at import time
+    os.environ["UNIVAPAY_BASE_URL"] = base_url
+    os.environ["DATABASE_URL"] = database_url
+    os.environ["UNIVAPAY_WEBHOOK_AUTH"] = WEBHOOK_SECRET
+    os.environ["UNIVAPAY_POLL_ENABLE"] = "true" if poller else "false"
+    os.environ.setdefault("UNIVAPAY_APP_TOKEN", "bench-token")
+    os.environ.setdefault("UNIVAPAY_APP_SECRET", "bench-secret")
+    os.environ.setdefault("UNIVAPAY_STORE_ID", "bench-store")
+    # Measure the app, not the outbound quota (set these to bench the limiter itself)
+    os.environ.setdefault("UNIVAPAY_RATE_WRITES_PER_SECOND", "0")
+    os.environ.setdefault("UNIVAPAY_RATE_READS_PER_SECOND", "0")
+    import app as app_module
+    return app_module
+
+
+class QueryCounter:
+    """Counts SQL statements per thread via the engine's before_cursor_execute hook."""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+
+        self._local = threading.local()
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args, **kwargs):
+        self._local.count = getattr(self._local, "count", 0) + 1
+
+    def reset(self) -> None:
+        self._local.count = 0
+
+    def value(self) -> int:
+        return getattr(self._local, "count", 0)
+
+
+def run_scenario(call: Callable[[int], int], n: int, concurrency: int, counter: QueryCounter) -> Dict[str, Any]:
+    def one(i: int) -> Tuple[float, int, int]:
+        counter.reset()
+        start = time.perf_counter()
+        code = call(i)
+        return time.perf_counter() - start, counter.value(), code
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        samples = list(pool.map(one, range(n)))
+    return summarize(samples, time.perf_counter() - start)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--scenarios", default=",".join(SCENARIOS))
+    ap.add_argument("--latency", default="50", help="simulator latency: ms, or mean=..,jitter=..,dist=..")
+    ap.add_argument("--throttle-rate", type=float, default=0.0)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--database-url", default=None, help="defaults to a throwaway SQLite file")
+    ap.add_argument("--poller", action="store_true", help="leave the background status poller enabled")
+    ap.add_argument("--save-baseline", metavar="PATH")
+    ap.add_argument("--compare", metavar="PATH", help="exit 1 if results regress against this baseline")
+    ap.add_argument("--tolerance", type=float, default=0.25, help="allowed p95 growth vs baseline (fraction)")
+    args = ap.parse_args()
+
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        ap.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    sim = SimConfig(port=0, seed=args.seed, throttle_rate=args.throttle_rate, error_rate=args.error_rate)
+    _parse_latency(args.latency, sim)
+    proc, base_url = start_in_process(sim)
+
+    tmpdir = tempfile.TemporaryDirectory()
+    database_url = args.database_url or f"sqlite:///{os.path.join(tmpdir.name, 'bench.db')}"
+    try:
+        app_module = _load_app(base_url, database_url, args.poller)
+        flask_app = app_module.app
+        with flask_app.app_context():
+            counter = QueryCounter(app_module.db.engine)
+            token = app_module.create_token("bench-user")
+        auth = {"Authorization": f"Bearer {token}"}
+        client = flask_app.test_client()
+        charge_ids: List[str] = []
+
+        def checkout_charge(i: int) -> int:
+            # Clients send an Idempotency-Key, so the claim/complete writes are part of the cost
+            resp = client.post("/api/checkout/charge", headers={**auth, "Idempotency-Key": f"bench-{i}"}, json={
+                "transaction_token_id": f"tok_{i}", "item_name": "bench item", "amount": 1000,
+            })
+            body = resp.get_json(silent=True) or {}
+            if body.get("provider", {}).get("charge_id"):
+                charge_ids.append(body["provider"]["charge_id"])
+            return resp.status_code
+
+        def checkout_subscription(i: int) -> int:
+            resp = client.post("/api/checkout/subscription", headers=auth, json={
+                "transaction_token_id": f"tok_sub_{i}", "plan": "monthly",
+            })
+            return resp.status_code
+
+        def payments_list(i: int) -> int:
+            return client.get("/api/payments", headers=auth).status_code
+
+        def webhook(i: int) -> int:
+            charge_id = charge_ids[i % len(charge_ids)] if charge_ids else f"missing_{i}"
+            status = "successful" if i % 2 else "pending"
+            resp = client.post(
+                "/api/univapay/webhook",
+                headers={"Authorization": f"Bearer {WEBHOOK_SECRET}"},
+                json={"event": "charge.finished", "object": "charge", "id": charge_id, "status": status},
+            )
+            return resp.status_code
+
+        calls = {
+            "checkout_charge": checkout_charge,
+            "checkout_subscription": checkout_subscription,
+            "payments_list": payments_list,
+            "webhook": webhook,
+        }
+        results = {name: run_scenario(calls[name], args.requests, args.concurrency, counter) for name in scenarios}
+    finally:
+        proc.terminate()
+        tmpdir.cleanup()
+
+    print(f"requests={args.requests} concurrency={args.concurrency} latency={args.latency} "
+          f"throttle={args.throttle_rate} errors={args.error_rate}")
+    print_table(results)
+
+    report = {
+        "meta": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "latency": args.latency,
+            "throttle_rate": args.throttle_rate,
+            "error_rate": args.error_rate,
+            "seed": args.seed,
+            "python": sys.version.split()[0],
+            "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        },
+        "results": results,
+    }
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save_baseline)), exist_ok=True)
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        print(f"baseline saved to {args.save_baseline}")
+    if args.compare:
+        with open(args.compare) as f:
+            problems = compare(results, json.load(f), args.tolerance)
+        if problems:
+            print("REGRESSIONS:")
+            for p in problems:
+                print(f"  {p}")
+            sys.exit(1)
+        print("no regressions vs baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Size and latency of payload_codec (zlib + preset UnivaPay dictionary) vs plain JSON
+text and plain zlib, on synthetic charge/subscription/webhook payloads, plus the
+on-disk size of a SQLite table holding them.
+
+    python bench/bench_payload_codec.py --rows 20000
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import uuid
+import zlib
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from bench_checkout import percentile  # noqa: E402
+from payload_codec import compress_text, decompress_text  # noqa: E402
+
+
+def sample_payload(rng: random.Random) -> str:
+    ts = f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T{rng.randint(0, 23):02d}:00:00.{rng.randint(0, 999999):06d}Z"
+    amount = rng.choice((1000, 2500, 10000, 58000))
+    kind = rng.random()
+    if kind < 0.5:
+        obj = {
+            "id": str(uuid.UUID(int=rng.getrandbits(128))), "store_id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "transaction_token_id": str(uuid.UUID(int=rng.getrandbits(128))), "transaction_token_type": "one_time",
+            "requested_amount": amount, "requested_currency": "JPY", "charged_amount": amount,
+            "charged_currency": "JPY", "only_direct_currency": False, "capture_at": None, "descriptor": None,
+            "status": rng.choice(("pending", "successful", "failed")),
+            "metadata": {"user": "Nayeem", "item_name": rng.choice(("T-shirt", "Mug", "Sticker pack"))},
+            "mode": "test", "created_on": ts,
+        }
+    else:
+        obj = {
+            "id": str(uuid.UUID(int=rng.getrandbits(128))), "store_id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "transaction_token_id": str(uuid.UUID(int=rng.getrandbits(128))), "amount": amount, "currency": "JPY",
+            "period": rng.choice(("monthly", "semiannually")), "cyclical_period": None,
+            "schedule_settings": {"start_on": None, "zone_id": "Asia/Tokyo"}, "only_direct_currency": False,
+            "status": rng.choice(("unverified", "current", "unpaid")), "metadata": {"user": "Nayeem", "plan": "monthly"},
+            "mode": "test", "created_on": ts, "next_payment": None,
+        }
+    if kind > 0.75:
+        obj = {"event": "charge.finished", "object": "charge", "id": obj["id"], "status": obj["status"], "data": obj}
+    return json.dumps(obj, ensure_ascii=False)
+
+
+def table_size(rows, encode) -> int:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "size.db")
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, payload BLOB)")
+        conn.executemany("INSERT INTO t (payload) VALUES (?)", ((encode(r),) for r in rows))
+        conn.commit()
+        conn.execute("VACUUM")
+        conn.close()
+        return os.path.getsize(path)
+
+
+def timed(fn, values):
+    out, lat = [], []
+    for v in values:
+        t0 = time.perf_counter()
+        out.append(fn(v))
+        lat.append((time.perf_counter() - t0) * 1e6)
+    lat.sort()
+    return out, lat
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--rows", type=int, default=20000)
+    ap.add_argument("--seed", type=int, default=11)
+    args = ap.parse_args()
+
+    rng = random.Random(args.seed)
+    rows = [sample_payload(rng) for _ in range(args.rows)]
+    raw_bytes = sum(len(r.encode("utf-8")) for r in rows)
+
+    packed, enc_lat = timed(compress_text, rows)
+    unpacked, dec_lat = timed(decompress_text, packed)
+    assert unpacked == rows
+    plain_zlib = sum(len(zlib.compress(r.encode("utf-8"), 6)) for r in rows)
+    dict_bytes = sum(len(p) for p in packed)
+
+    print(f"rows={args.rows}  avg payload={raw_bytes / args.rows:.0f}B")
+    print(f"  json text          {raw_bytes / args.rows:8.0f} B/row  100%")
+    print(f"  zlib               {plain_zlib / args.rows:8.0f} B/row  {plain_zlib / raw_bytes:4.0%}")
+    print(f"  zlib + dictionary  {dict_bytes / args.rows:8.0f} B/row  {dict_bytes / raw_bytes:4.0%}")
+    print(f"  encode p50={percentile(enc_lat, 50):6.1f}us p99={percentile(enc_lat, 99):6.1f}us")
+    print(f"  decode p50={percentile(dec_lat, 50):6.1f}us p99={percentile(dec_lat, 99):6.1f}us")
+
+    text_size = table_size(rows, lambda r: r)
+    packed_size = table_size(rows, compress_text)
+    print(f"  sqlite table: text {text_size / 1e6:.2f}MB -> compressed {packed_size / 1e6:.2f}MB "
+          f"({packed_size / text_size:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Cost of the webhook's ProviderPayment lookups before and after `migrate-provider-ids`.
+
+Seeds a SQLite file with the pre-index schema (no provider-id indexes, no payment FK),
+times single-id lookups and the inbox consumer's batched IN lookup, runs the migration
+through app.py, and times the same queries again.
+
+    python bench/bench_provider_lookup.py --rows 200000 --lookups 2000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from bench_checkout import percentile  # noqa: E402
+
+# provider_payments/payments as created before the provider-id indexes and FK existed
+OLD_SCHEMA = """
+CREATE TABLE payments (
+    id INTEGER PRIMARY KEY, user VARCHAR(64) NOT NULL, kind VARCHAR(32) NOT NULL,
+    item_name VARCHAR(255), amount_jpy INTEGER NOT NULL, plan VARCHAR(32), created_at DATETIME NOT NULL
+);
+CREATE TABLE provider_payments (
+    id INTEGER PRIMARY KEY, provider VARCHAR(32) NOT NULL, payment_id INTEGER NOT NULL,
+    provider_charge_id VARCHAR(64), provider_subscription_id VARCHAR(64), status VARCHAR(32),
+    currency VARCHAR(8), raw_json TEXT, created_at DATETIME NOT NULL, updated_at DATETIME NOT NULL
+);
+"""
+
+SINGLE = "SELECT id, status FROM provider_payments WHERE provider = ? AND provider_charge_id = ? LIMIT 1"
+
+
+def seed(path: str, rows: int) -> None:
+    conn = sqlite3.connect(path)
+    conn.executescript(OLD_SCHEMA)
+    now = datetime.utcnow().isoformat(sep=" ")
+    conn.executemany(
+        "INSERT INTO payments (id, user, kind, amount_jpy, created_at) VALUES (?, 'bench', 'product', 1000, ?)",
+        ((i, now) for i in range(1, rows + 1)),
+    )
+    conn.executemany(
+        "INSERT INTO provider_payments (id, provider, payment_id, provider_charge_id, provider_subscription_id, "
+        "status, currency, created_at, updated_at) VALUES (?, 'univapay', ?, ?, ?, 'successful', 'JPY', ?, ?)",
+        (
+            (i, i, f"ch_{i:09d}" if i % 4 else None, None if i % 4 else f"sub_{i:09d}", now, now)
+            for i in range(1, rows + 1)
+        ),
+    )
+    conn.commit()
+    conn.close()
+
+
+def measure(path: str, ids, batch: int):
+    conn = sqlite3.connect(path)
+    plan = " | ".join(r[-1] for r in conn.execute("EXPLAIN QUERY PLAN " + SINGLE, ("univapay", ids[0])))
+
+    single = []
+    for charge_id in ids:
+        t0 = time.perf_counter()
+        conn.execute(SINGLE, ("univapay", charge_id)).fetchone()
+        single.append((time.perf_counter() - t0) * 1000.0)
+
+    batched = []
+    marks = ", ".join("?" * batch)
+    sql = f"SELECT id, status FROM provider_payments WHERE provider = ? AND provider_charge_id IN ({marks})"
+    for i in range(0, len(ids) - batch + 1, batch):
+        t0 = time.perf_counter()
+        conn.execute(sql, ("univapay", *ids[i:i + batch])).fetchall()
+        batched.append((time.perf_counter() - t0) * 1000.0)
+    conn.close()
+
+    single.sort()
+    batched.sort()
+    return plan, single, batched
+
+
+def report(label: str, plan: str, single, batched, batch: int) -> None:
+    print(f"{label}")
+    print(f"  plan: {plan}")
+    print(f"  single lookup     p50={percentile(single, 50):9.3f}ms  p99={percentile(single, 99):9.3f}ms")
+    if batched:
+        print(f"  IN ({batch:>3} ids)      p50={percentile(batched, 50):9.3f}ms  p99={percentile(batched, 99):9.3f}ms")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--rows", type=int, default=200000)
+    ap.add_argument("--lookups", type=int, default=500)
+    ap.add_argument("--batch", type=int, default=100, help="ids per IN lookup (the inbox consumer's shape)")
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+
+    rng = random.Random(args.seed)
+    ids = [f"ch_{i:09d}" for i in (rng.randrange(1, args.rows + 1) for _ in range(args.lookups * 2)) if i % 4][: args.lookups]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "lookup.db")
+        seed(path, args.rows)
+        print(f"rows={args.rows} lookups={len(ids)}")
+        report("before (no provider-id index)", *measure(path, ids, args.batch), args.batch)
+
+        os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+        os.environ["UNIVAPAY_POLL_ENABLE"] = "false"
+        os.environ["WEBHOOK_CONSUMER_ENABLE"] = "false"
+        import app as app_module
+
+        t0 = time.perf_counter()
+        with app_module.app.app_context():
+            steps = app_module.migrate_provider_ids()
+        print(f"migrate-provider-ids: {time.perf_counter() - t0:.2f}s ({'; '.join(steps) or 'startup already applied'})")
+        report("after (unique (provider, provider_charge_id))", *measure(path, ids, args.batch), args.batch)
+
+
+if __name__ == "__main__":
+    main()
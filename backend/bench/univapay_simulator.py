@@ -0,0 +1,438 @@
+"""
+Local stand-in for the UnivaPay REST API, for load tests and retry experiments.
+
+Implements the calls our clients make (charges, subscriptions, store-scoped GETs and
+lists, capture, cancel, refunds) with in-memory state, and posts webhooks back to the
+app when objects settle. Latency and failures are injected from a seeded RNG, so a
+run is reproducible on one box.
+
+    python bench/univapay_simulator.py --port 9100 --latency mean=80,jitter=40,dist=lognormal \
+        --error-rate 0.02 --throttle-rate 0.01 --retry-after 1 \
+        --webhook-url http://127.0.0.1:5000/api/univapay/webhook --webhook-auth some-shared-secret
+
+Point the app at it with UNIVAPAY_BASE_URL=http://127.0.0.1:9100. Counters are served
+at GET /_sim/stats and reset with POST /_sim/reset.
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import math
+import multiprocessing
+import random
+import uuid
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from aiohttp import ClientSession, ClientTimeout, web
+
+
+# -------------------------
+# Config
+# -------------------------
+@dataclass
+class SimConfig:
+    host: str = "127.0.0.1"
+    port: int = 9100
+    seed: int = 42
+    # Latency: dist is 'fixed' | 'uniform' | 'exponential' | 'lognormal'
+    latency_ms: float = 50.0
+    jitter_ms: float = 0.0
+    latency_dist: str = "fixed"
+    # Failure injection (fractions of requests, checked before the handler runs)
+    throttle_rate: float = 0.0        # 429 with Retry-After
+    error_rate: float = 0.0           # 500/502/503
+    retry_after_s: float = 1.0
+    # Outcomes
+    decline_rate: float = 0.0         # charges that settle as 'failed'
+    settle_ms: float = 200.0          # pending -> final status delay
+    # Webhooks back to the app (Flask uses Authorization, DRF uses X-Signature HMAC)
+    webhook_url: Optional[str] = None
+    webhook_auth: str = ""
+    webhook_delay_ms: float = 0.0
+    store_id: str = field(default_factory=lambda: str(uuid.uuid4()))
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+# -------------------------
+# Simulator
+# -------------------------
+class UnivapaySimulator:
+    def __init__(self, config: SimConfig):
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.charges: Dict[str, Dict[str, Any]] = {}
+        self.subscriptions: Dict[str, Dict[str, Any]] = {}
+        self.charge_order: List[str] = []          # creation order, for cursor listing
+        self.subscription_order: List[str] = []
+        self.idempotent: Dict[str, Any] = {}       # Idempotency-Key -> (status, body)
+        self.stats: Counter = Counter()
+        self._http: Optional[ClientSession] = None
+        self._tasks = set()
+
+    # ---- fault injection ----
+    def _latency_s(self) -> float:
+        cfg = self.config
+        mean, jitter = cfg.latency_ms, cfg.jitter_ms
+        if cfg.latency_dist == "uniform":
+            ms = self.rng.uniform(max(0.0, mean - jitter), mean + jitter)
+        elif cfg.latency_dist == "exponential":
+            ms = self.rng.expovariate(1.0 / mean) if mean > 0 else 0.0
+        elif cfg.latency_dist == "lognormal" and mean > 0:
+            # Parameterised so the distribution has the requested mean and stddev (jitter)
+            sigma2 = math.log(1 + (jitter / mean) ** 2)
+            ms = self.rng.lognormvariate(math.log(mean) - sigma2 / 2, math.sqrt(sigma2))
+        else:
+            ms = mean
+        return max(0.0, ms) / 1000.0
+
+    @web.middleware
+    async def faults(self, request: web.Request, handler):
+        route = request.match_info.route.resource.canonical if request.match_info.route.resource else request.path
+        if route.startswith("/_sim"):
+            return await handler(request)
+
+        self.stats[f"{request.method} {route}"] += 1
+        roll = self.rng.random()
+        await asyncio.sleep(self._latency_s())
+
+        if roll < self.config.throttle_rate:
+            self.stats["injected_429"] += 1
+            return web.json_response(
+                {"status": "error", "code": "TOO_MANY_REQUESTS"},
+                status=429,
+                headers={"Retry-After": f"{self.config.retry_after_s:g}"},
+            )
+        if roll < self.config.throttle_rate + self.config.error_rate:
+            code = self.rng.choice((500, 502, 503))
+            self.stats[f"injected_{code}"] += 1
+            return web.json_response({"status": "error", "code": "SIMULATED_FAILURE"}, status=code)
+
+        # Replay responses for repeated Idempotency-Key writes
+        key = request.headers.get("Idempotency-Key")
+        if request.method == "POST" and key:
+            if key in self.idempotent:
+                self.stats["idempotent_replays"] += 1
+                status, body = self.idempotent[key]
+                return web.json_response(body, status=status)
+            resp = await handler(request)
+            if resp.status < 500:
+                self.idempotent[key] = (resp.status, json.loads(resp.text))
+            return resp
+        return await handler(request)
+
+    # ---- helpers ----
+    async def _json(self, request: web.Request) -> Dict[str, Any]:
+        if not request.can_read_body:
+            return {}
+        try:
+            return await request.json()
+        except Exception:
+            raise web.HTTPBadRequest(text=json.dumps({"code": "INVALID_JSON"}), content_type="application/json")
+
+    def _lookup(self, table: Dict[str, Dict[str, Any]], obj_id: str) -> Dict[str, Any]:
+        obj = table.get(obj_id)
+        if obj is None:
+            raise web.HTTPNotFound(text=json.dumps({"code": "NOT_FOUND"}), content_type="application/json")
+        return obj
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _settle(self, table: Dict[str, Dict[str, Any]], obj_id: str, final_status: str, kind: str) -> None:
+        await asyncio.sleep(self.config.settle_ms / 1000.0)
+        obj = table.get(obj_id)
+        if obj is None or obj["status"] not in ("pending", "unverified"):
+            return
+        obj["status"] = final_status
+        obj["updated_on"] = _now_iso()
+        await self._send_webhook(kind, obj)
+
+    async def _send_webhook(self, kind: str, obj: Dict[str, Any]) -> None:
+        cfg = self.config
+        if not cfg.webhook_url:
+            return
+        await asyncio.sleep(cfg.webhook_delay_ms / 1000.0)
+        event = {
+            "charge": "charge.finished",
+            "subscription": "subscription.updated",
+            "refund": "refund.finished",
+        }[kind]
+        body = json.dumps({"event": event, "object": kind, "id": obj["id"], "status": obj.get("status"), "data": obj}).encode()
+        headers = {"Content-Type": "application/json"}
+        if cfg.webhook_auth:
+            headers["Authorization"] = f"Bearer {cfg.webhook_auth}"
+            headers["X-Signature"] = hmac.new(cfg.webhook_auth.encode(), body, hashlib.sha256).hexdigest()
+        try:
+            if self._http is None:
+                self._http = ClientSession(timeout=ClientTimeout(total=10))
+            async with self._http.post(cfg.webhook_url, data=body, headers=headers) as resp:
+                self.stats[f"webhook_{resp.status}"] += 1
+        except Exception:
+            self.stats["webhook_error"] += 1
+
+    def _page(self, table: Dict[str, Dict[str, Any]], order: List[str], request: web.Request) -> Dict[str, Any]:
+        q = request.query
+        limit = max(1, min(int(q.get("limit", "10")), 1000))
+        ids = order[::-1] if q.get("cursor_direction", "desc") == "desc" else list(order)
+        start = 0
+        if q.get("cursor"):
+            try:
+                start = ids.index(q["cursor"]) + 1
+            except ValueError:
+                start = len(ids)
+        window = ids[start:start + limit]
+        return {"items": [table[i] for i in window], "has_more": start + limit < len(ids)}
+
+    # ---- charges ----
+    async def create_charge(self, request: web.Request) -> web.Response:
+        body = await self._json(request)
+        if not body.get("transaction_token_id") or not isinstance(body.get("amount"), int) or body["amount"] <= 0:
+            return web.json_response({"code": "VALIDATION_ERROR"}, status=400)
+        cid = str(uuid.uuid4())
+        charge = {
+            "id": cid,
+            "store_id": self.config.store_id,
+            "transaction_token_id": body["transaction_token_id"],
+            "transaction_token_type": "one_time",
+            "requested_amount": body["amount"],
+            "requested_currency": body.get("currency", "JPY"),
+            "charged_amount": body["amount"],
+            "charged_currency": body.get("currency", "JPY"),
+            "only_direct_currency": bool(body.get("only_direct_currency", False)),
+            "capture_at": body.get("capture_at"),
+            "descriptor": body.get("descriptor"),
+            "status": "pending",
+            "metadata": body.get("metadata") or {},
+            "mode": "test",
+            "created_on": _now_iso(),
+        }
+        if body.get("redirect"):
+            charge["redirect"] = {**body["redirect"], "redirect_id": str(uuid.uuid4())}
+        if body.get("three_ds"):
+            charge["three_ds"] = {**body["three_ds"], "redirect_id": str(uuid.uuid4())}
+        self.charges[cid] = charge
+        self.charge_order.append(cid)
+        final = "failed" if self.rng.random() < self.config.decline_rate else (
+            "successful" if body.get("capture", True) else "authorized"
+        )
+        self._spawn(self._settle(self.charges, cid, final, "charge"))
+        return web.json_response(charge, status=201)
+
+    async def get_charge(self, request: web.Request) -> web.Response:
+        return web.json_response(self._lookup(self.charges, request.match_info["charge_id"]))
+
+    async def list_charges(self, request: web.Request) -> web.Response:
+        return web.json_response(self._page(self.charges, self.charge_order, request))
+
+    async def capture_charge(self, request: web.Request) -> web.Response:
+        charge = self._lookup(self.charges, request.match_info["charge_id"])
+        if charge["status"] != "authorized":
+            return web.json_response({"code": "INVALID_STATUS"}, status=409)
+        body = await self._json(request)
+        charge["charged_amount"] = body.get("amount", charge["charged_amount"])
+        charge["status"] = "successful"
+        self._spawn(self._send_webhook("charge", charge))
+        return web.json_response(charge)
+
+    async def cancel_charge(self, request: web.Request) -> web.Response:
+        charge = self._lookup(self.charges, request.match_info["charge_id"])
+        if charge["status"] not in ("pending", "authorized", "awaiting"):
+            return web.json_response({"code": "INVALID_STATUS"}, status=409)
+        charge["status"] = "canceled"
+        self._spawn(self._send_webhook("charge", charge))
+        return web.json_response(charge)
+
+    async def refund_charge(self, request: web.Request) -> web.Response:
+        charge = self._lookup(self.charges, request.match_info["charge_id"])
+        if charge["status"] != "successful":
+            return web.json_response({"code": "INVALID_STATUS"}, status=409)
+        body = await self._json(request)
+        refund = {
+            "id": str(uuid.uuid4()),
+            "charge_id": charge["id"],
+            "store_id": self.config.store_id,
+            "amount": body.get("amount") or charge["charged_amount"],
+            "currency": charge["charged_currency"],
+            "reason": body.get("reason"),
+            "status": "successful",
+            "created_on": _now_iso(),
+        }
+        self._spawn(self._send_webhook("refund", refund))
+        return web.json_response(refund, status=201)
+
+    # ---- subscriptions ----
+    async def create_subscription(self, request: web.Request) -> web.Response:
+        body = await self._json(request)
+        if not body.get("transaction_token_id") or not isinstance(body.get("amount"), int) or body["amount"] <= 0:
+            return web.json_response({"code": "VALIDATION_ERROR"}, status=400)
+        sid = str(uuid.uuid4())
+        sub = {
+            "id": sid,
+            "store_id": self.config.store_id,
+            "transaction_token_id": body["transaction_token_id"],
+            "amount": body["amount"],
+            "currency": body.get("currency", "JPY"),
+            "period": body.get("period"),
+            "cyclical_period": body.get("cyclical_period"),
+            "schedule_settings": body.get("schedule_settings") or {},
+            "only_direct_currency": bool(body.get("only_direct_currency", False)),
+            "status": "unverified",
+            "metadata": body.get("metadata") or {},
+            "mode": "test",
+            "created_on": _now_iso(),
+            "next_payment": None,
+        }
+        self.subscriptions[sid] = sub
+        self.subscription_order.append(sid)
+        final = "unpaid" if self.rng.random() < self.config.decline_rate else "current"
+        self._spawn(self._settle(self.subscriptions, sid, final, "subscription"))
+        return web.json_response(sub, status=201)
+
+    async def get_subscription(self, request: web.Request) -> web.Response:
+        return web.json_response(self._lookup(self.subscriptions, request.match_info["subscription_id"]))
+
+    async def list_subscriptions(self, request: web.Request) -> web.Response:
+        return web.json_response(self._page(self.subscriptions, self.subscription_order, request))
+
+    async def cancel_subscription(self, request: web.Request) -> web.Response:
+        sub = self._lookup(self.subscriptions, request.match_info["subscription_id"])
+        sub["status"] = "canceled"
+        sub["cancelled_on"] = _now_iso()
+        self._spawn(self._send_webhook("subscription", sub))
+        return web.json_response(sub)
+
+    # ---- control ----
+    async def stats_view(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "stats": dict(self.stats),
+            "charges": len(self.charges),
+            "subscriptions": len(self.subscriptions),
+        })
+
+    async def reset_view(self, request: web.Request) -> web.Response:
+        self.stats.clear()
+        return web.json_response({"ok": True})
+
+    async def _cleanup(self, app: web.Application) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+        if self._http is not None:
+            await self._http.close()
+
+    def build_app(self) -> web.Application:
+        app = web.Application(middlewares=[self.faults])
+        r = app.router
+        for prefix in ("", "/stores/{store_id}"):
+            r.add_post(f"{prefix}/charges", self.create_charge)
+            r.add_get(f"{prefix}/charges/{{charge_id}}", self.get_charge)
+            r.add_post(f"{prefix}/charges/{{charge_id}}/capture", self.capture_charge)
+            r.add_post(f"{prefix}/charges/{{charge_id}}/cancel", self.cancel_charge)
+            r.add_post(f"{prefix}/charges/{{charge_id}}/refunds", self.refund_charge)
+            r.add_post(f"{prefix}/subscriptions", self.create_subscription)
+            r.add_get(f"{prefix}/subscriptions/{{subscription_id}}", self.get_subscription)
+            r.add_post(f"{prefix}/subscriptions/{{subscription_id}}/cancel", self.cancel_subscription)
+        r.add_get("/stores/{store_id}/charges", self.list_charges)
+        r.add_get("/stores/{store_id}/subscriptions", self.list_subscriptions)
+        r.add_get("/_sim/stats", self.stats_view)
+        r.add_post("/_sim/reset", self.reset_view)
+        app.on_cleanup.append(self._cleanup)
+        return app
+
+
+# -------------------------
+# Entrypoints
+# -------------------------
+def serve(config: SimConfig, ready=None) -> None:
+    """Run the simulator until interrupted; puts the bound base URL on `ready` if given."""
+    async def _main():
+        runner = web.AppRunner(UnivapaySimulator(config).build_app(), access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, config.host, config.port, backlog=1024)
+        await site.start()
+        port = runner.addresses[0][1]
+        if ready is not None:
+            ready.put(f"http://{config.host}:{port}")
+        else:
+            print(f"[Simulator] listening on http://{config.host}:{port}")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
+
+    try:
+        asyncio.run(_main())
+    except KeyboardInterrupt:
+        pass
+
+
+def start_in_process(config: SimConfig):
+    """
+    Start the simulator in a child process (so it never competes with the code under
+    test for the GIL). Returns (process, base_url); call process.terminate() when done.
+    Use port=0 to pick a free port.
+    """
+    ready = multiprocessing.Queue()
+    proc = multiprocessing.Process(target=serve, args=(config, ready), daemon=True)
+    proc.start()
+    return proc, ready.get(timeout=15)
+
+
+def _parse_latency(spec: str, config: SimConfig) -> None:
+    # "80" or "mean=80,jitter=40,dist=lognormal"
+    if "=" not in spec:
+        config.latency_ms = float(spec)
+        return
+    for part in spec.split(","):
+        k, _, v = part.partition("=")
+        if k == "mean":
+            config.latency_ms = float(v)
+        elif k == "jitter":
+            config.jitter_ms = float(v)
+        elif k == "dist":
+            config.latency_dist = v
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=9100)
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--latency", default="50", help="ms, or mean=..,jitter=..,dist=fixed|uniform|exponential|lognormal")
+    ap.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of requests answered with 429")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 5xx")
+    ap.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds on 429")
+    ap.add_argument("--decline-rate", type=float, default=0.0, help="fraction of charges that settle as failed")
+    ap.add_argument("--settle-ms", type=float, default=200.0, help="delay before pending objects settle")
+    ap.add_argument("--webhook-url", default=None)
+    ap.add_argument("--webhook-auth", default="")
+    ap.add_argument("--webhook-delay-ms", type=float, default=0.0)
+    args = ap.parse_args()
+
+    config = SimConfig(
+        host=args.host,
+        port=args.port,
+        seed=args.seed,
+        throttle_rate=args.throttle_rate,
+        error_rate=args.error_rate,
+        retry_after_s=args.retry_after,
+        decline_rate=args.decline_rate,
+        settle_ms=args.settle_ms,
+        webhook_url=args.webhook_url,
+        webhook_auth=args.webhook_auth,
+        webhook_delay_ms=args.webhook_delay_ms,
+    )
+    _parse_latency(args.latency, config)
+    serve(config)
+
+
+if __name__ == "__main__":
+    main()
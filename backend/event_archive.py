@@ -0,0 +1,74 @@
+# event_archive.py
+import gzip
+import json
+import os
+import re
+from datetime import date, timedelta
+from typing import Any, Dict, List
+
+
+# -------------------------
+# Daily gzip JSONL segments
+# -------------------------
+def _segment_re(prefix: str):
+    return re.compile(rf"^{re.escape(prefix)}-(\d{{4}}-\d{{2}}-\d{{2}})\.(\d{{4}})\.jsonl\.gz$")
+
+
+class SegmentWriter:
+    """
+    One append-only archive segment: <dir>/<prefix>-YYYY-MM-DD.NNNN.jsonl.gz
+
+    Records are streamed to a .tmp file; commit() fsyncs and renames it into place, so
+    a segment that exists under its final name is always complete. A day may have
+    several parts (one per archival run, or when a run caps rows per segment).
+    """
+
+    def __init__(self, archive_dir: str, prefix: str, day: date):
+        os.makedirs(archive_dir, exist_ok=True)
+        self.day = day
+        self.count = 0
+        pattern = _segment_re(prefix)
+        parts = [
+            int(m.group(2)) for m in map(pattern.match, os.listdir(archive_dir))
+            if m and m.group(1) == day.isoformat()
+        ]
+        self.path = os.path.join(archive_dir, f"{prefix}-{day.isoformat()}.{max(parts, default=0) + 1:04d}.jsonl.gz")
+        self._tmp = self.path + ".tmp"
+        self._raw = open(self._tmp, "wb")
+        self._gz = gzip.GzipFile(fileobj=self._raw, mode="wb", compresslevel=6)
+
+    def write(self, record: Dict[str, Any]) -> None:
+        self._gz.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n")
+        self.count += 1
+
+    def commit(self) -> str:
+        self._gz.close()
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+        self._raw.close()
+        os.replace(self._tmp, self.path)
+        return self.path
+
+    def abort(self) -> None:
+        self._gz.close()
+        self._raw.close()
+        try:
+            os.remove(self._tmp)
+        except FileNotFoundError:
+            pass
+
+
+def prune_segments(archive_dir: str, prefix: str, keep_days: int, today: date) -> List[str]:
+    """Delete segments for days older than `keep_days` before `today`. Returns removed paths."""
+    if keep_days <= 0 or not os.path.isdir(archive_dir):
+        return []
+    oldest = today - timedelta(days=keep_days)
+    pattern = _segment_re(prefix)
+    removed = []
+    for name in sorted(os.listdir(archive_dir)):
+        m = pattern.match(name)
+        if m and date.fromisoformat(m.group(1)) < oldest:
+            path = os.path.join(archive_dir, name)
+            os.remove(path)
+            removed.append(path)
+    return removed
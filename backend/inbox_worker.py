@@ -0,0 +1,66 @@
+# inbox_worker.py
+import threading
+from typing import Callable, Optional
+
+
+# -------------------------
+# Consumer
+# -------------------------
+class InboxWorker:
+    """
+    Single background thread that drains a durable inbox in batches.
+
+    - drain() -> number of items processed in one batch (0 when the inbox is empty)
+
+    The thread keeps calling drain() while it returns work, then sleeps until notify()
+    (a new item was committed in this process) or `idle_seconds` pass (items written by
+    other processes, or a batch that failed and should be retried).
+    """
+
+    def __init__(self, drain: Callable[[], int], *, idle_seconds: float = 5.0, name: str = "inbox-worker"):
+        self.drain = drain
+        self.idle_seconds = idle_seconds
+        self.name = name
+
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+
+    # ---- lifecycle ----
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+            self._thread.start()
+
+    def stop(self, wait: bool = True) -> None:
+        with self._lock:
+            self._stopping = True
+            self._wake.set()
+            thread, self._thread = self._thread, None
+        if thread is not None and wait:
+            thread.join()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def notify(self) -> None:
+        """Wake the consumer now instead of at the next idle tick."""
+        self._wake.set()
+
+    # ---- internals ----
+    def _loop(self) -> None:
+        while not self._stopping:
+            self._wake.clear()
+            try:
+                processed = self.drain()
+            except Exception as e:
+                print(f"[Inbox] Unhandled error draining {self.name}: {e}")
+                processed = 0
+            if processed:
+                continue
+            self._wake.wait(timeout=self.idle_seconds)
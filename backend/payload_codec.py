@@ -0,0 +1,83 @@
+# payload_codec.py
+import json
+import zlib
+from typing import Optional, Union
+
+from sqlalchemy.types import LargeBinary, TypeDecorator
+
+# Stored format: MAGIC + dictionary id (1 byte) + raw deflate stream. JSON text never
+# starts with NUL, so legacy uncompressed values are told apart by the first byte.
+MAGIC = b"\x00z"
+COMPRESS_LEVEL = 6
+
+_UUID = "00000000-0000-0000-0000-000000000000"
+_TS = "2025-01-01T00:00:00.000000Z"
+
+# Representative UnivaPay shapes, serialized exactly like the app serializes them
+# (json.dumps defaults). Frequent fragments go last: deflate reaches them with the
+# shortest distances. NEVER edit a published dictionary; add a new id instead.
+_DICT_V1_SAMPLES = (
+    {"event": "subscription.updated", "object": "subscription", "id": _UUID, "status": "current", "data": {
+        "id": _UUID, "store_id": _UUID, "transaction_token_id": _UUID, "amount": 10000, "currency": "JPY",
+        "amount_formatted": 10000, "period": "monthly", "initial_amount": None, "initial_amount_formatted": None,
+        "subsequent_cycles_start": None, "schedule_settings": {"start_on": None, "zone_id": "Asia/Tokyo",
+        "preserve_end_of_month": None}, "only_direct_currency": False, "first_charge_capture_after": None,
+        "first_charge_authorization_only": False, "status": "unverified", "metadata": {"user": "", "plan": "monthly"},
+        "mode": "test", "created_on": _TS, "next_payment": {"id": _UUID, "due_date": "2025-02-01",
+        "zone_id": "Asia/Tokyo", "amount": 10000, "currency": "JPY", "amount_formatted": 10000, "is_paid": False,
+        "is_last_payment": False, "created_on": _TS, "updated_on": _TS, "retry_date": None}, "cyclical_period": None,
+        "termination_mode": None, "cancelled_on": None}},
+    {"event": "charge.finished", "object": "charge", "id": _UUID, "status": "successful", "data": {
+        "id": _UUID, "store_id": _UUID, "transaction_token_id": _UUID, "transaction_token_type": "one_time",
+        "subscription_id": None, "merchant_transaction_id": None, "requested_amount": 1000,
+        "requested_currency": "JPY", "requested_amount_formatted": 1000, "charged_amount": 1000,
+        "charged_currency": "JPY", "charged_amount_formatted": 1000, "fee_amount": None, "fee_currency": None,
+        "fee_amount_formatted": None, "only_direct_currency": False, "capture_at": None, "descriptor": None,
+        "descriptor_phone_number": None, "status": "pending", "error": None, "metadata": {"user": "",
+        "item_name": ""}, "mode": "test", "created_on": _TS, "redirect": {"endpoint": "https://",
+        "redirect_id": _UUID}, "three_ds": {"redirect_endpoint": "https://", "redirect_id": _UUID, "mode": "normal"}}},
+)
+_DICT_V1 = "".join(json.dumps(s, ensure_ascii=False) for s in _DICT_V1_SAMPLES).encode("utf-8")
+
+DICTIONARIES = {1: _DICT_V1}
+CURRENT_DICT_ID = 1
+
+
+# -------------------------
+# Codec
+# -------------------------
+def compress_text(text: str, dict_id: int = CURRENT_DICT_ID) -> bytes:
+    c = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=DICTIONARIES[dict_id])
+    return MAGIC + bytes([dict_id]) + c.compress(text.encode("utf-8")) + c.flush()
+
+def is_compressed(value: Union[bytes, memoryview, str, None]) -> bool:
+    return isinstance(value, (bytes, memoryview)) and bytes(value[:2]) == MAGIC
+
+def decompress_text(value: Union[bytes, memoryview, str, None]) -> Optional[str]:
+    """Decode a stored value: compressed bytes, legacy UTF-8 bytes, or legacy text."""
+    if value is None or isinstance(value, str):
+        return value
+    raw = bytes(value)
+    if raw[:2] != MAGIC:
+        return raw.decode("utf-8")
+    d = zlib.decompressobj(-zlib.MAX_WBITS, zdict=DICTIONARIES[raw[2]])
+    return (d.decompress(raw[3:]) + d.flush()).decode("utf-8")
+
+
+class CompressedText(TypeDecorator):
+    """
+    Text attribute stored as dictionary-compressed bytes. Reads decode transparently,
+    including rows written before compression (see `flask --app app compress-payloads`).
+    Pair with db.deferred() to also skip loading (and decoding) until first access.
+    """
+
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None or is_compressed(value):
+            return value
+        return compress_text(value)
+
+    def process_result_value(self, value, dialect):
+        return decompress_text(value)
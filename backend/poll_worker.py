@@ -0,0 +1,151 @@
+# poll_worker.py
+import heapq
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, List, Optional, Tuple
+
+
+# -------------------------
+# Scheduler
+# -------------------------
+class PollWorker:
+    """
+    Single background thread that drains a durable poll queue.
+
+    The worker only keeps (due_at, job_id) pairs in a min-heap; the jobs themselves
+    live in the database, so nothing is lost on restart. Callbacks:
+
+    - load_due(horizon_ts) -> iterable of (due_at_ts, job_id) for jobs due before horizon
+    - run_job(job_id) -> next due_at_ts to reschedule, or None when the job is finished
+
+    Jobs run on a small thread pool; at most `max_concurrency` are in flight, and the
+    heap is only popped when a slot is free, which gives natural backpressure.
+    """
+
+    def __init__(
+        self,
+        load_due: Callable[[float], Iterable[Tuple[float, int]]],
+        run_job: Callable[[int], Optional[float]],
+        *,
+        max_concurrency: int = 4,
+        refill_seconds: float = 30.0,
+        name: str = "poll-worker",
+    ):
+        self.load_due = load_due
+        self.run_job = run_job
+        self.max_concurrency = max(1, max_concurrency)
+        self.refill_seconds = refill_seconds
+        self.name = name
+
+        self._heap: List[Tuple[float, int]] = []
+        self._queued = set()      # job ids currently in the heap
+        self._running = set()     # job ids currently executing
+        self._cond = threading.Condition()
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self._next_refill = 0.0
+
+    # ---- lifecycle ----
+    def start(self) -> None:
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._stopping = False
+            self._pool = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix=self.name)
+            self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+            self._thread.start()
+
+    def stop(self, wait: bool = True) -> None:
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+            thread, self._thread = self._thread, None
+            pool, self._pool = self._pool, None
+        if thread is not None and wait:
+            thread.join()
+        if pool is not None:
+            pool.shutdown(wait=wait)
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    # ---- scheduling ----
+    def schedule(self, job_id: int, due_at: float) -> None:
+        """Add a job to the in-memory heap (the durable row must already exist)."""
+        with self._cond:
+            if job_id in self._queued or job_id in self._running:
+                return
+            heapq.heappush(self._heap, (due_at, job_id))
+            self._queued.add(job_id)
+            self._cond.notify()
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._heap) + len(self._running)
+
+    # ---- internals ----
+    def _refill(self, now: float) -> None:
+        # Pick up jobs written by other processes or left over from before a restart
+        try:
+            due = list(self.load_due(now + self.refill_seconds))
+        except Exception as e:
+            print(f"[Poller] Error loading due jobs: {e}")
+            due = []
+        with self._cond:
+            for due_at, job_id in due:
+                if job_id not in self._queued and job_id not in self._running:
+                    heapq.heappush(self._heap, (due_at, job_id))
+                    self._queued.add(job_id)
+        self._next_refill = now + self.refill_seconds
+
+    def _loop(self) -> None:
+        while True:
+            now = time.time()
+            if now >= self._next_refill:
+                self._refill(now)
+
+            with self._cond:
+                if self._stopping:
+                    return
+                if not self._heap or self._heap[0][0] > now:
+                    wake_at = self._next_refill
+                    if self._heap:
+                        wake_at = min(wake_at, self._heap[0][0])
+                    self._cond.wait(timeout=max(0.0, wake_at - now))
+                    continue
+
+            # A due job exists; wait for a free slot before taking it off the heap
+            self._slots.acquire()
+            with self._cond:
+                if self._stopping or not self._heap or self._heap[0][0] > time.time():
+                    self._slots.release()
+                    continue
+                _, job_id = heapq.heappop(self._heap)
+                self._queued.discard(job_id)
+                self._running.add(job_id)
+                pool = self._pool  # not None while not stopping; stop() swaps it under this lock
+            try:
+                pool.submit(self._run, job_id)
+            except RuntimeError:
+                # stop(wait=False) shut the pool down in between; the durable row is picked up on restart
+                with self._cond:
+                    self._running.discard(job_id)
+                self._slots.release()
+                return
+
+    def _run(self, job_id: int) -> None:
+        next_due = None
+        try:
+            next_due = self.run_job(job_id)
+        except Exception as e:
+            print(f"[Poller] Unhandled error in job {job_id}: {e}")
+        finally:
+            with self._cond:
+                self._running.discard(job_id)
+            self._slots.release()
+        if next_due is not None:
+            self.schedule(job_id, next_due)
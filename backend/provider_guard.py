@@ -0,0 +1,228 @@
+# provider_guard.py
+import re
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Tuple
+
+
+# -------------------------
+# Endpoint keys
+# -------------------------
+_ID_SEGMENT = re.compile(r"^(?=.*\d)[0-9A-Za-z_-]{8,}$")  # uuids, numeric and opaque ids
+
+
+def endpoint_key(method: str, path: str) -> str:
+    """'GET /stores/<uuid>/charges/<uuid>' -> 'GET /stores/{id}/charges/{id}' (one breaker per route)."""
+    parts = ["{id}" if _ID_SEGMENT.match(p) else p for p in path.split("?", 1)[0].split("/")]
+    return f"{method.upper()} {'/'.join(parts)}"
+
+
+# -------------------------
+# Circuit breaker
+# -------------------------
+class CircuitBreaker:
+    """
+    Per-endpoint breaker over a sliding time window of call outcomes.
+
+    - closed: calls pass; once the window holds `min_calls` outcomes and the failure rate
+      or the slow-call rate (elapsed >= `slow_call_seconds`) reaches its threshold, it opens.
+    - open: calls are rejected without touching the network for `open_seconds`.
+    - half-open: up to `half_open_probes` calls go through; if they all succeed quickly
+      the breaker closes, and any failure opens it again.
+
+    Thread-safe. `allow()` returns whether the call may proceed and whether it is a probe;
+    pass that flag back to `record()`.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(
+        self,
+        *,
+        window_seconds: float = 30.0,
+        min_calls: int = 10,
+        failure_rate: float = 0.5,
+        slow_call_rate: float = 0.5,
+        slow_call_seconds: float = 5.0,
+        open_seconds: float = 15.0,
+        half_open_probes: int = 2,
+    ):
+        self.window_seconds = window_seconds
+        self.min_calls = max(1, min_calls)
+        self.failure_rate = failure_rate
+        self.slow_call_rate = slow_call_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.half_open_probes = max(1, half_open_probes)
+
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._outcomes: Deque[Tuple[float, bool, bool]] = deque()  # (at, failed, slow)
+        self._failed = 0
+        self._slow = 0
+        self._opened_until = 0.0
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() >= self._opened_until:
+                return self.HALF_OPEN
+            return self._state
+
+    def retry_after(self) -> float:
+        """Seconds until an open breaker lets a probe through (0 when not open)."""
+        with self._lock:
+            return max(0.0, self._opened_until - time.monotonic()) if self._state == self.OPEN else 0.0
+
+    def allow(self) -> Tuple[bool, bool]:
+        """(allowed, is_probe) for a call about to start."""
+        now = time.monotonic()
+        with self._lock:
+            if self._state == self.OPEN:
+                if now < self._opened_until:
+                    return False, False
+                self._state = self.HALF_OPEN
+                self._probes_in_flight = 0
+                self._probe_successes = 0
+            if self._state == self.HALF_OPEN:
+                if self._probes_in_flight >= self.half_open_probes:
+                    return False, False
+                self._probes_in_flight += 1
+                return True, True
+            return True, False
+
+    def record(self, ok: bool, elapsed: float, probe: bool = False) -> None:
+        now = time.monotonic()
+        slow = elapsed >= self.slow_call_seconds
+        with self._lock:
+            if probe:
+                if self._state != self.HALF_OPEN:
+                    return
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+                if not ok or slow:
+                    self._open(now)
+                    return
+                self._probe_successes += 1
+                if self._probe_successes >= self.half_open_probes:
+                    self._state = self.CLOSED
+                    self._outcomes.clear()
+                    self._failed = self._slow = 0
+                return
+            if self._state != self.CLOSED:
+                return  # started before the breaker opened
+
+            self._outcomes.append((now, not ok, slow))
+            self._failed += not ok
+            self._slow += slow
+            horizon = now - self.window_seconds
+            while self._outcomes and self._outcomes[0][0] < horizon:
+                _, old_failed, old_slow = self._outcomes.popleft()
+                self._failed -= old_failed
+                self._slow -= old_slow
+
+            total = len(self._outcomes)
+            if total >= self.min_calls and (
+                self._failed / total >= self.failure_rate or self._slow / total >= self.slow_call_rate
+            ):
+                self._open(now)
+
+    def _open(self, now: float) -> None:
+        self._state = self.OPEN
+        self._opened_until = now + self.open_seconds
+        self._outcomes.clear()
+        self._failed = self._slow = 0
+        self._probes_in_flight = 0
+
+
+class BreakerRegistry:
+    """Lazily created CircuitBreaker per endpoint key, all sharing one configuration."""
+
+    def __init__(self, **breaker_kwargs):
+        self._kwargs = breaker_kwargs
+        self._lock = threading.Lock()
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def get(self, key: str) -> CircuitBreaker:
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(key, CircuitBreaker(**self._kwargs))
+        return breaker
+
+    def states(self) -> Dict[str, str]:
+        return {key: breaker.state for key, breaker in list(self._breakers.items())}
+
+
+# -------------------------
+# Adaptive concurrency limit
+# -------------------------
+class AIMDLimiter:
+    """
+    Caps in-flight provider calls with a limit that adapts like TCP congestion control.
+
+    Each fast success adds 1/limit (about +1 per round of `limit` calls); a failure or a
+    call slower than `latency_target` multiplies the limit by `backoff`, at most once per
+    observed call latency so one burst of timeouts doesn't collapse it to the floor.
+    `acquire()` waits up to `wait_seconds` for a slot and returns False when none frees up,
+    so callers shed load instead of piling threads onto a struggling provider.
+    """
+
+    def __init__(
+        self,
+        *,
+        initial: float = 20,
+        min_limit: float = 1,
+        max_limit: float = 100,
+        latency_target: float = 5.0,
+        backoff: float = 0.5,
+        wait_seconds: float = 0.0,
+    ):
+        self.min_limit = max(1.0, float(min_limit))
+        self.max_limit = max(self.min_limit, float(max_limit))
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.wait_seconds = wait_seconds
+
+        self._cond = threading.Condition()
+        self._limit = min(self.max_limit, max(self.min_limit, float(initial)))
+        self._in_flight = 0
+        self._dropped_at = 0.0
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def acquire(self) -> bool:
+        deadline = time.monotonic() + self.wait_seconds
+        with self._cond:
+            while self._in_flight >= int(self._limit):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            self._in_flight += 1
+            return True
+
+    def cancel(self) -> None:
+        """Give back a slot for a call that never started (no effect on the limit)."""
+        with self._cond:
+            self._in_flight = max(0, self._in_flight - 1)
+            self._cond.notify()
+
+    def release(self, ok: bool, elapsed: float) -> None:
+        now = time.monotonic()
+        with self._cond:
+            self._in_flight = max(0, self._in_flight - 1)
+            if ok and elapsed < self.latency_target:
+                self._limit = min(self.max_limit, self._limit + 1.0 / self._limit)
+            elif now - self._dropped_at >= elapsed:
+                self._limit = max(self.min_limit, self._limit * self.backoff)
+                self._dropped_at = now
+            self._cond.notify()
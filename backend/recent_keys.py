@@ -0,0 +1,85 @@
+# recent_keys.py
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+
+# -------------------------
+# Short-lived LRU set
+# -------------------------
+class RecentKeys:
+    """
+    Bounded, thread-safe set of recently seen keys with a TTL.
+
+    Used as an O(1) front for a durable unique index: a hit means "definitely seen
+    recently"; a miss means "ask the database". Oldest keys are evicted first.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl_seconds: float = 600.0):
+        self.max_size = max(1, max_size)
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._keys: "OrderedDict[Hashable, float]" = OrderedDict()  # key -> expires_at
+
+    def __contains__(self, key: Hashable) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            expires_at = self._keys.get(key)
+            if expires_at is None:
+                return False
+            if expires_at <= now:
+                del self._keys[key]
+                return False
+            return True
+
+    def add(self, key: Hashable) -> None:
+        with self._lock:
+            self._keys[key] = time.monotonic() + self.ttl_seconds
+            self._keys.move_to_end(key)
+            while len(self._keys) > self.max_size:
+                self._keys.popitem(last=False)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._keys)
+
+
+# -------------------------
+# Short-lived LRU map
+# -------------------------
+class RecentValues:
+    """
+    Bounded, thread-safe key -> value map with a TTL; same eviction as RecentKeys.
+
+    Used as an in-process front for durable rows that don't change once written
+    (e.g. a completed idempotent response): `get` returns None on a miss.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl_seconds: float = 600.0):
+        self.max_size = max(1, max_size)
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._items: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key -> (expires_at, value)
+
+    def get(self, key: Hashable) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            if item[0] <= now:
+                del self._items[key]
+                return None
+            return item[1]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._items)
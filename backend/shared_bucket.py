@@ -0,0 +1,112 @@
+# shared_bucket.py
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+
+# -------------------------
+# Cross-process token bucket
+# -------------------------
+class SharedTokenBucket:
+    """
+    Token buckets whose state lives in a small local SQLite file, so every worker
+    process on the host draws from the same budget.
+
+    Each named bucket refills at `rate` tokens/second up to `burst` (rate 0 = no steady
+    limit). `acquire()` takes a token, sleeping (outside any lock) until one is available,
+    and gives up with False if that would take longer than `max_wait` seconds.
+    `penalize()` records a provider Retry-After: the bucket is drained and blocked for
+    every process until it passes, whatever its rate.
+
+    One BEGIN IMMEDIATE transaction per attempt serializes the read-modify-write across
+    processes; connections are per thread. Wall-clock time is used because monotonic
+    clocks aren't comparable between processes.
+    """
+
+    def __init__(self, path: str, buckets: Dict[str, Tuple[float, float]], max_wait: float = 2.0):
+        self.path = path
+        self.buckets = {name: (max(0.0, float(rate)), max(1.0, float(burst))) for name, (rate, burst) in buckets.items()}
+        self.max_wait = max_wait
+        self._local = threading.local()
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            " name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL,"
+            " blocked_until REAL NOT NULL DEFAULT 0)"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")  # losing a few tokens on power loss is harmless
+            self._local.conn = conn
+        return conn
+
+    def _take(self, name: str) -> float:
+        """Take a token if one is available; returns 0.0, or the seconds to wait before retrying."""
+        rate, burst = self.buckets[name]
+        conn = self._conn()
+        if not rate:
+            # Unlimited bucket: only a shared Retry-After block can hold it, and a read suffices
+            return self.blocked_for(name)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()  # read under the write lock, so updated_at never moves backwards
+            row = conn.execute("SELECT tokens, updated_at, blocked_until FROM buckets WHERE name = ?", (name,)).fetchone()
+            tokens, updated_at, blocked_until = row if row else (burst, now, 0.0)
+            tokens = min(burst, tokens + max(0.0, now - updated_at) * rate)
+            now = max(now, updated_at)
+            if blocked_until > now:
+                wait = blocked_until - now
+            elif tokens >= 1.0:
+                tokens -= 1.0
+                wait = 0.0
+            else:
+                wait = (1.0 - tokens) / rate
+            conn.execute(
+                "INSERT INTO buckets (name, tokens, updated_at, blocked_until) VALUES (?, ?, ?, ?)"
+                " ON CONFLICT(name) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at",
+                (name, tokens, now, blocked_until),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+    def try_acquire(self, name: str) -> float:
+        """Take a token without sleeping: 0.0 when taken, else seconds to wait before trying again."""
+        return self._take(name) if name in self.buckets else 0.0
+
+    def acquire(self, name: str, max_wait: Optional[float] = None) -> Tuple[bool, float]:
+        """(acquired, seconds until a token is expected when not acquired). Unknown buckets are unlimited."""
+        if name not in self.buckets:
+            return True, 0.0
+        deadline = time.time() + (self.max_wait if max_wait is None else max_wait)
+        while True:
+            wait = self._take(name)
+            if wait <= 0:
+                return True, 0.0
+            if time.time() + wait > deadline:
+                return False, wait
+            time.sleep(wait)
+
+    def penalize(self, name: str, seconds: float) -> None:
+        """Drain `name` and block it for `seconds` (e.g. from a 429 Retry-After) in every process."""
+        if name not in self.buckets or seconds <= 0:
+            return
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            "INSERT INTO buckets (name, tokens, updated_at, blocked_until) VALUES (?, 0, ?, ?)"
+            " ON CONFLICT(name) DO UPDATE SET tokens = 0, updated_at = excluded.updated_at,"
+            " blocked_until = MAX(buckets.blocked_until, excluded.blocked_until)",
+            (name, now, now + seconds),
+        )
+
+    def blocked_for(self, name: str) -> float:
+        """Seconds left on a Retry-After block for `name` (0.0 when not blocked)."""
+        row = self._conn().execute("SELECT blocked_until FROM buckets WHERE name = ?", (name,)).fetchone()
+        return max(0.0, row[0] - time.time()) if row else 0.0
@@ -0,0 +1,62 @@
+# single_flight.py
+import copy
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+# -------------------------
+# Request coalescing
+# -------------------------
+class _Call:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls with the same key into one execution.
+
+    The first caller for a key (the leader) runs `fn`; callers arriving while it is in
+    flight block until it finishes and get the same outcome: a deep copy of the result,
+    so no caller can mutate another's dict, or the same exception re-raised. Nothing is
+    cached: once the leader returns, the next call for the key runs `fn` again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self.shared = 0  # calls answered by someone else's in-flight request
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.shared += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result)
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                shared = call.waiters > 0  # no one can join once the key is gone
+            call.done.set()
+        return copy.deepcopy(call.result) if shared else call.result
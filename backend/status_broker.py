@@ -0,0 +1,54 @@
+# status_broker.py
+import queue
+import threading
+from typing import Any, Dict, Optional, Set
+
+
+# -------------------------
+# In-process pub/sub
+# -------------------------
+class StatusBroker:
+    """
+    Fan-out of payment status transitions to open SSE streams, keyed by user.
+    Each subscriber gets its own bounded queue; a subscriber that stops reading
+    simply drops events (the dashboard can always re-fetch /api/payments).
+    """
+
+    def __init__(self, max_queue: int = 100):
+        self.max_queue = max_queue
+        self._lock = threading.Lock()
+        self._subs: Dict[str, Set[queue.Queue]] = {}
+
+    def subscribe(self, user: str) -> queue.Queue:
+        q: queue.Queue = queue.Queue(maxsize=self.max_queue)
+        with self._lock:
+            self._subs.setdefault(user, set()).add(q)
+        return q
+
+    def unsubscribe(self, user: str, q: queue.Queue) -> None:
+        with self._lock:
+            subs = self._subs.get(user)
+            if not subs:
+                return
+            subs.discard(q)
+            if not subs:
+                del self._subs[user]
+
+    def publish(self, user: str, event: Dict[str, Any]) -> int:
+        """Deliver an event to every stream of `user`. Returns the number of subscribers reached."""
+        with self._lock:
+            subs = list(self._subs.get(user, ()))
+        delivered = 0
+        for q in subs:
+            try:
+                q.put_nowait(event)
+                delivered += 1
+            except queue.Full:
+                pass
+        return delivered
+
+    def subscriber_count(self, user: Optional[str] = None) -> int:
+        with self._lock:
+            if user is not None:
+                return len(self._subs.get(user, ()))
+            return sum(len(s) for s in self._subs.values())
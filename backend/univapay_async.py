@@ -0,0 +1,394 @@
+# univapay_async.py
+import asyncio
+import copy
+import json
+import os
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover - optional dependency
+    aiohttp = None
+
+from provider_guard import CircuitBreaker, endpoint_key
+from univapay_client import (
+    DEFAULT_RETRIES,
+    DEFAULT_TIMEOUT,
+    RETRYABLE_STATUSES,
+    UNIVAPAY_APP_SECRET,
+    UNIVAPAY_APP_TOKEN,
+    UNIVAPAY_BASE_URL,
+    UNIVAPAY_STORE_ID,
+    ProviderUnavailable,
+    UnivapayClient,
+    UnivapayError,
+    _cancel_subscription_body,
+    _capture_body,
+    _charge_body,
+    _guard_status,
+    _make_headers,
+    _new_guards,
+    _page_params,
+    _rate_bucket,
+    _retry_delay,
+    _subscription_body,
+)
+
+DEFAULT_MAX_CONNECTIONS = int(os.getenv("UNIVAPAY_HTTP_MAX_CONNECTIONS", "20"))
+DEFAULT_KEEPALIVE_SECONDS = float(os.getenv("UNIVAPAY_HTTP_KEEPALIVE_SECONDS", "30"))
+
+
+# -------------------------
+# Client
+# -------------------------
+class AsyncUnivapayClient:
+    """
+    asyncio sibling of UnivapayClient with the same method surface.
+
+    All calls share one aiohttp session whose connector is a bounded HTTP/1.1 keep-alive
+    pool (max_connections), so concurrent coroutines reuse warm TCP+TLS connections and
+    queue for a slot instead of opening new ones. Retries back off with asyncio.sleep
+    (honouring Retry-After), so no thread is held while waiting.
+
+    Every attempt goes through the same protections as UnivapayClient._send: the shared
+    outbound rate limit (waited out with asyncio.sleep), the AIMD concurrency limit and the
+    per-endpoint circuit breaker, raising ProviderUnavailable when one sheds the call; and
+    identical concurrent GETs are coalesced. Pass `guards_from=<UnivapayClient>` to share
+    that client's breakers and limiter in the same process (the rate limit is always shared).
+
+    Use as an async context manager, or call `aclose()` when done:
+
+        async with AsyncUnivapayClient() as up:
+            charge = await up.get_charge(charge_id)
+    """
+
+    def __init__(
+        self,
+        base_url: Optional[str] = None,
+        timeout: float = DEFAULT_TIMEOUT,
+        retries: int = DEFAULT_RETRIES,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+        keepalive_seconds: float = DEFAULT_KEEPALIVE_SECONDS,
+        guards_from: Optional[UnivapayClient] = None,
+    ):
+        if aiohttp is None:
+            raise RuntimeError("AsyncUnivapayClient requires aiohttp (pip install aiohttp)")
+
+        self.base_url = (base_url or UNIVAPAY_BASE_URL).rstrip("/")
+        self.timeout = timeout
+        self.retries = max(0, retries)
+        self.max_connections = max(1, max_connections)
+        self.keepalive_seconds = keepalive_seconds
+
+        if not UNIVAPAY_APP_TOKEN:
+            raise RuntimeError("UNIVAPAY_APP_TOKEN is missing")
+        if not UNIVAPAY_APP_SECRET:
+            print("[UnivaPay] Warning: UNIVAPAY_APP_SECRET is empty; some endpoints may fail.")
+
+        self._session = None  # created on first use, inside the running event loop
+        if guards_from is not None:
+            self.breakers, self.limiter, self.rate_limiter = guards_from.breakers, guards_from.limiter, guards_from.rate_limiter
+        else:
+            self.breakers, self.limiter, self.rate_limiter = _new_guards()
+        self._flights: Dict[Hashable, list] = {}  # GET key -> [future, waiters]
+        self.coalesced_gets = 0
+
+    def guard_status(self) -> Dict[str, Any]:
+        """Same shape as UnivapayClient.guard_status()."""
+        return _guard_status(self.breakers, self.limiter, self.rate_limiter, self.coalesced_gets)
+
+    def _http(self) -> "aiohttp.ClientSession":
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=self.keepalive_seconds)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    async def __aenter__(self) -> "AsyncUnivapayClient":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    # ---- guarded send, coalescing and non-blocking retry ----
+    async def _send(self, breaker: CircuitBreaker, key: str, method: str, url: str, **request_kwargs):
+        """One HTTP attempt through the shared rate limit, the endpoint breaker and the concurrency limiter."""
+        bucket = _rate_bucket(method)
+        deadline = time.time() + self.rate_limiter.max_wait
+        while bucket in self.rate_limiter.buckets:
+            # The shared bucket is a SQLite transaction that can wait on the file lock: run it off the loop
+            wait = await asyncio.to_thread(self.rate_limiter.try_acquire, bucket)
+            if wait <= 0:
+                break
+            if time.time() + wait > deadline:
+                raise ProviderUnavailable(f"UnivaPay rate limit reached for {key}", retry_after=wait)
+            await asyncio.sleep(wait)
+        # A limiter configured to wait would block the event loop; wait for the slot in a thread
+        acquired = await asyncio.to_thread(self.limiter.acquire) if self.limiter.wait_seconds > 0 else self.limiter.acquire()
+        if not acquired:
+            raise ProviderUnavailable(f"UnivaPay concurrency limit ({self.limiter.limit}) reached for {key}")
+        allowed, probe = breaker.allow()
+        if not allowed:
+            self.limiter.cancel()
+            raise ProviderUnavailable(f"UnivaPay circuit open for {key}", retry_after=breaker.retry_after())
+
+        started = time.monotonic()
+        ok = False
+        try:
+            async with self._http().request(method, url, **request_kwargs) as resp:
+                raw = await resp.read()
+            # 429 is a quota signal handled by the rate limiter, not a sign of an unhealthy endpoint
+            ok = resp.status not in RETRYABLE_STATUSES or resp.status == 429
+            return resp.status, resp.headers.get("Content-Type", ""), resp.headers.get("Retry-After"), raw
+        finally:
+            elapsed = time.monotonic() - started
+            self.limiter.release(ok, elapsed)
+            breaker.record(ok, elapsed, probe)
+
+    async def _coalesce(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Asyncio SingleFlight: followers await the leader's call and get a deep copy of its result."""
+        flight = self._flights.get(key)
+        if flight is not None:
+            flight[1] += 1
+            self.coalesced_gets += 1
+            return copy.deepcopy(await asyncio.shield(flight[0]))
+
+        future = asyncio.get_running_loop().create_future()
+        flight = self._flights[key] = [future, 0]
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # retrieved here, so an unshared failure isn't logged as unhandled
+            raise
+        finally:
+            del self._flights[key]
+        future.set_result(result)
+        return copy.deepcopy(result) if flight[1] else result
+
+    async def _request(
+        self,
+        method: str,
+        path: str,
+        *,
+        json_body: Optional[dict] = None,
+        params: Optional[Dict[str, Any]] = None,
+        headers: Optional[Dict[str, str]] = None,
+        idempotency_key: Optional[str] = None,
+    ) -> Any:
+        url = f"{self.base_url}{path}"
+        extra_headers = headers or {}
+        if idempotency_key:
+            extra_headers["Idempotency-Key"] = idempotency_key
+
+        hdrs = _make_headers(extra_headers)
+        if method.upper() == "GET":
+            flight_key = (url, tuple(sorted((k, str(v)) for k, v in (params or {}).items())))
+            return await self._coalesce(flight_key, lambda: self._perform(method, path, url, hdrs, json_body, params))
+        return await self._perform(method, path, url, hdrs, json_body, params)
+
+    async def _perform(
+        self,
+        method: str,
+        path: str,
+        url: str,
+        hdrs: Dict[str, str],
+        json_body: Optional[dict],
+        params: Optional[Dict[str, Any]],
+    ) -> Any:
+        """Send one logical request, retrying retryable failures while the endpoint breaker is closed."""
+        key = endpoint_key(method, path)
+        breaker = self.breakers.get(key)
+
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                status, content_type, retry_after, raw = await self._send(
+                    breaker, key, method.upper(), url, headers=hdrs, json=json_body, params=params,
+                )
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt <= self.retries and breaker.state == CircuitBreaker.CLOSED:
+                    await asyncio.sleep(0.4 * attempt)
+                    continue
+                raise UnivapayError(f"Network error calling {url}: {e}")
+
+            # Success
+            if 200 <= status < 300:
+                if raw and content_type.startswith("application/json"):
+                    return json.loads(raw)
+                return None
+
+            # Throttled: pause this bucket for every process (the next attempt waits it out)
+            if status == 429:
+                await asyncio.to_thread(
+                    self.rate_limiter.penalize, _rate_bucket(method), _retry_delay(attempt, retry_after)
+                )
+
+            # Retry on 429/5xx
+            if status in RETRYABLE_STATUSES and attempt <= self.retries and breaker.state == CircuitBreaker.CLOSED:
+                if status != 429:
+                    await asyncio.sleep(_retry_delay(attempt, retry_after))
+                continue
+
+            text = raw.decode("utf-8", errors="replace")
+            try:
+                body = json.loads(text)
+            except Exception:
+                body = text
+
+            raise UnivapayError(f"UnivaPay API error {status} for {path}", status=status, body=body)
+
+    # -------------------------
+    # Charges (one-time)
+    # -------------------------
+    async def create_charge(
+        self,
+        *,
+        transaction_token_id: str,
+        amount: int,
+        currency: str = "JPY",
+        capture: Optional[bool] = True,
+        capture_at: Optional[str] = None,
+        metadata: Optional[Dict[str, Any]] = None,
+        three_ds_mode: Optional[str] = None,
+        redirect_endpoint: Optional[str] = None,
+        idempotency_key: Optional[str] = None,
+    ) -> Any:
+        """Create a one-time charge from a front-end transaction token (see UnivapayClient.create_charge)."""
+        body = _charge_body(
+            transaction_token_id=transaction_token_id,
+            amount=amount,
+            currency=currency,
+            capture=capture,
+            capture_at=capture_at,
+            metadata=metadata,
+            three_ds_mode=three_ds_mode,
+            redirect_endpoint=redirect_endpoint,
+        )
+        return await self._request("POST", "/charges", json_body=body, idempotency_key=idempotency_key)
+
+    async def get_charge(self, charge_id: str) -> Any:
+        """Retrieve a charge by ID (prefers store-scoped path when storeId present)."""
+        if UNIVAPAY_STORE_ID:
+            return await self._request("GET", f"/stores/{UNIVAPAY_STORE_ID}/charges/{charge_id}")
+        return await self._request("GET", f"/charges/{charge_id}")
+
+    async def list_charges(
+        self,
+        *,
+        limit: int = 100,
+        cursor: Optional[str] = None,
+        cursor_direction: str = "desc",
+        **filters: Any,
+    ) -> Any:
+        """One page of store-scoped charges: {'items': [...], 'has_more': bool}."""
+        return await self._request("GET", f"{self._store_path()}/charges", params=_page_params(limit, cursor, cursor_direction, filters))
+
+    async def iter_charges(self, *, page_size: int = 100, **filters: Any) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Yield pages (lists) of store-scoped charges, newest first, following the cursor."""
+        async for items in self._iter_pages(self.list_charges, page_size, filters):
+            yield items
+
+    async def capture_charge(self, charge_id: str, *, amount: Optional[int] = None, idempotency_key: Optional[str] = None) -> Any:
+        """Capture a previously authorized charge."""
+        return await self._request("POST", f"/charges/{charge_id}/capture", json_body=_capture_body(amount), idempotency_key=idempotency_key)
+
+    async def cancel_charge(self, charge_id: str, *, reason: Optional[str] = None, idempotency_key: Optional[str] = None) -> Any:
+        """Cancel (void) an authorized charge."""
+        body = {"reason": reason} if reason else None
+        return await self._request("POST", f"/charges/{charge_id}/cancel", json_body=body, idempotency_key=idempotency_key)
+
+    # -------------------------
+    # Subscriptions (recurring)
+    # -------------------------
+    async def create_subscription(
+        self,
+        *,
+        transaction_token_id: str,
+        amount: int,
+        currency: str = "JPY",
+        period: Optional[str] = "monthly",
+        cyclical_period: Optional[str] = None,
+        start_on: Optional[str] = None,
+        zone_id: str = "Asia/Tokyo",
+        metadata: Optional[Dict[str, Any]] = None,
+        three_ds_mode: Optional[str] = None,
+        redirect_endpoint: Optional[str] = None,
+        idempotency_key: Optional[str] = None,
+    ) -> Any:
+        """Create a subscription (see UnivapayClient.create_subscription)."""
+        body = _subscription_body(
+            transaction_token_id=transaction_token_id,
+            amount=amount,
+            currency=currency,
+            period=period,
+            cyclical_period=cyclical_period,
+            start_on=start_on,
+            zone_id=zone_id,
+            metadata=metadata,
+            three_ds_mode=three_ds_mode,
+            redirect_endpoint=redirect_endpoint,
+        )
+        return await self._request("POST", "/subscriptions", json_body=body, idempotency_key=idempotency_key)
+
+    async def get_subscription(self, subscription_id: str) -> Any:
+        """Retrieve a subscription by ID (prefers store-scoped path when storeId present)."""
+        if UNIVAPAY_STORE_ID:
+            return await self._request("GET", f"/stores/{UNIVAPAY_STORE_ID}/subscriptions/{subscription_id}")
+        return await self._request("GET", f"/subscriptions/{subscription_id}")
+
+    async def list_subscriptions(
+        self,
+        *,
+        limit: int = 100,
+        cursor: Optional[str] = None,
+        cursor_direction: str = "desc",
+        **filters: Any,
+    ) -> Any:
+        """One page of store-scoped subscriptions: {'items': [...], 'has_more': bool}."""
+        return await self._request("GET", f"{self._store_path()}/subscriptions", params=_page_params(limit, cursor, cursor_direction, filters))
+
+    async def iter_subscriptions(self, *, page_size: int = 100, **filters: Any) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Yield pages (lists) of store-scoped subscriptions, newest first, following the cursor."""
+        async for items in self._iter_pages(self.list_subscriptions, page_size, filters):
+            yield items
+
+    async def cancel_subscription(self, subscription_id: str, *, termination_mode: Optional[str] = None) -> Any:
+        """Cancel (permanently stop) a subscription."""
+        return await self._request("POST", f"/subscriptions/{subscription_id}/cancel", json_body=_cancel_subscription_body(termination_mode))
+
+    # -------------------------
+    # Paging
+    # -------------------------
+    def _store_path(self) -> str:
+        if not UNIVAPAY_STORE_ID:
+            raise UnivapayError("UNIVAPAY_STORE_ID is required for list endpoints")
+        return f"/stores/{UNIVAPAY_STORE_ID}"
+
+    @staticmethod
+    async def _iter_pages(fetch, page_size: int, filters: Dict[str, Any]) -> AsyncIterator[List[Dict[str, Any]]]:
+        cursor = None
+        while True:
+            page = await fetch(limit=page_size, cursor=cursor, **filters) or {}
+            items = page.get("items") or []
+            if items:
+                yield items
+            if not page.get("has_more") or not items:
+                return
+            cursor = items[-1].get("id")
+
+    # -------------------------
+    # Utility
+    # -------------------------
+    new_idempotency_key = staticmethod(UnivapayClient.new_idempotency_key)
@@ -1,13 +1,18 @@
 # univapay_client.py
 import os
 import json
+import tempfile
 import time
 import uuid
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Iterator, List, Optional
 
 import requests
 from dotenv import load_dotenv
 
+from provider_guard import AIMDLimiter, BreakerRegistry, CircuitBreaker, endpoint_key
+from shared_bucket import SharedTokenBucket
+from single_flight import SingleFlight
+
 # -------------------------
 # Env
 # -------------------------
@@ -21,6 +26,32 @@ UNIVAPAY_STORE_ID = os.getenv("UNIVAPAY_STORE_ID", "").strip()  # optional, enab
 DEFAULT_TIMEOUT = float(os.getenv("UNIVAPAY_HTTP_TIMEOUT", "15"))
 DEFAULT_RETRIES = int(os.getenv("UNIVAPAY_HTTP_RETRIES", "2"))  # small safety net
 
+# Per-endpoint circuit breaker (fail fast while UnivaPay is erroring or slow)
+BREAKER_WINDOW_SECONDS = float(os.getenv("UNIVAPAY_BREAKER_WINDOW_SECONDS", "30"))
+BREAKER_MIN_CALLS = int(os.getenv("UNIVAPAY_BREAKER_MIN_CALLS", "10"))
+BREAKER_FAILURE_RATE = float(os.getenv("UNIVAPAY_BREAKER_FAILURE_RATE", "0.5"))
+BREAKER_SLOW_CALL_SECONDS = float(os.getenv("UNIVAPAY_BREAKER_SLOW_CALL_SECONDS", "5"))
+BREAKER_SLOW_CALL_RATE = float(os.getenv("UNIVAPAY_BREAKER_SLOW_CALL_RATE", "0.5"))
+BREAKER_OPEN_SECONDS = float(os.getenv("UNIVAPAY_BREAKER_OPEN_SECONDS", "15"))
+BREAKER_HALF_OPEN_PROBES = int(os.getenv("UNIVAPAY_BREAKER_HALF_OPEN_PROBES", "2"))
+
+# AIMD limit on concurrent in-flight calls per client (shed load instead of queueing threads)
+CONCURRENCY_INITIAL = float(os.getenv("UNIVAPAY_CONCURRENCY_INITIAL", "20"))
+CONCURRENCY_MIN = float(os.getenv("UNIVAPAY_CONCURRENCY_MIN", "2"))
+CONCURRENCY_MAX = float(os.getenv("UNIVAPAY_CONCURRENCY_MAX", "100"))
+CONCURRENCY_WAIT_SECONDS = float(os.getenv("UNIVAPAY_CONCURRENCY_WAIT_SECONDS", "0"))
+
+# Outbound rate limit shared by every worker process on the host (0 = no steady limit;
+# a 429 Retry-After still pauses the bucket for all of them)
+RATE_LIMIT_DB = os.getenv("UNIVAPAY_RATE_LIMIT_DB", os.path.join(tempfile.gettempdir(), "univapay_rate_limit.sqlite3"))
+RATE_WRITES_PER_SECOND = float(os.getenv("UNIVAPAY_RATE_WRITES_PER_SECOND", "20"))   # POST /charges, /subscriptions, ...
+RATE_WRITES_BURST = float(os.getenv("UNIVAPAY_RATE_WRITES_BURST", "40"))
+RATE_READS_PER_SECOND = float(os.getenv("UNIVAPAY_RATE_READS_PER_SECOND", "50"))     # GETs
+RATE_READS_BURST = float(os.getenv("UNIVAPAY_RATE_READS_BURST", "100"))
+RATE_WAIT_SECONDS = float(os.getenv("UNIVAPAY_RATE_WAIT_SECONDS", "2"))              # longest wait for a token
+
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+
 
 # -------------------------
 # Errors
@@ -38,6 +69,14 @@ class UnivapayError(Exception):
         return f"{base} (status={self.status}, body={self.body})"
 
 
+class ProviderUnavailable(UnivapayError):
+    """Call rejected locally (circuit open or concurrency limit reached); nothing was sent."""
+
+    def __init__(self, message: str, retry_after: float = 0.0):
+        super().__init__(message, status=503, body=None)
+        self.retry_after = retry_after
+
+
 # -------------------------
 # Helpers
 # -------------------------
@@ -77,6 +116,151 @@ def _validate_amount(amount: Any) -> int:
         raise UnivapayError("amount must be a positive integer (in minor units, e.g., JPY)")  # noqa: B904
 
 
+def _charge_body(
+    *,
+    transaction_token_id: str,
+    amount: int,
+    currency: str,
+    capture: Optional[bool],
+    capture_at: Optional[str],
+    metadata: Optional[Dict[str, Any]],
+    three_ds_mode: Optional[str],
+    redirect_endpoint: Optional[str],
+) -> Dict[str, Any]:
+    amt = _validate_amount(amount)
+    cur = _coerce_currency(currency)
+
+    body: Dict[str, Any] = {
+        "transaction_token_id": transaction_token_id,
+        "amount": amt,
+        "currency": cur,
+    }
+    if capture is not None:
+        body["capture"] = bool(capture)
+    if capture_at:
+        body["capture_at"] = capture_at
+    if metadata:
+        body["metadata"] = metadata
+    if redirect_endpoint:
+        # Per docs, UnivaPay supports a redirect object.
+        body["redirect"] = {"endpoint": redirect_endpoint}
+    if three_ds_mode:
+        # Follow doc field for three_ds mode on charge creation
+        body["three_ds"] = {"mode": three_ds_mode}
+    return body
+
+
+def _subscription_body(
+    *,
+    transaction_token_id: str,
+    amount: int,
+    currency: str,
+    period: Optional[str],
+    cyclical_period: Optional[str],
+    start_on: Optional[str],
+    zone_id: str,
+    metadata: Optional[Dict[str, Any]],
+    three_ds_mode: Optional[str],
+    redirect_endpoint: Optional[str],
+) -> Dict[str, Any]:
+    amt = _validate_amount(amount)
+    cur = _coerce_currency(currency)
+
+    if not period and not cyclical_period:
+        raise UnivapayError("Either 'period' or 'cyclical_period' must be specified for subscription.")
+
+    body: Dict[str, Any] = {
+        "transaction_token_id": transaction_token_id,
+        "amount": amt,
+        "currency": cur,
+        "schedule_settings": {"zone_id": zone_id},
+    }
+    if period:
+        body["period"] = period
+    if cyclical_period:
+        body["cyclical_period"] = cyclical_period
+    if start_on:
+        body["schedule_settings"]["start_on"] = start_on
+    if metadata:
+        body["metadata"] = metadata
+    if redirect_endpoint:
+        body["redirect"] = {"endpoint": redirect_endpoint}
+    if three_ds_mode:
+        body["three_ds"] = {"mode": three_ds_mode}
+    return body
+
+
+def _capture_body(amount: Optional[int]) -> Optional[Dict[str, Any]]:
+    if amount is None:
+        return None
+    return {"amount": _validate_amount(amount)}
+
+
+def _cancel_subscription_body(termination_mode: Optional[str]) -> Optional[Dict[str, Any]]:
+    if not termination_mode:
+        return None
+    return {"schedule_settings": {"termination_mode": termination_mode}}
+
+
+def _retry_delay(attempt: int, retry_after: Optional[str]) -> float:
+    """Backoff for a retryable HTTP status, respecting Retry-After (seconds) if present."""
+    delay = 0.5 * attempt
+    try:
+        if retry_after:
+            delay = max(delay, float(retry_after))
+    except Exception:
+        pass
+    return delay
+
+
+def _rate_bucket(method: str) -> str:
+    return "read" if method.upper() in ("GET", "HEAD") else "write"
+
+
+def _new_guards():
+    """(breakers, limiter, rate_limiter) configured from the env, for one client."""
+    breakers = BreakerRegistry(
+        window_seconds=BREAKER_WINDOW_SECONDS,
+        min_calls=BREAKER_MIN_CALLS,
+        failure_rate=BREAKER_FAILURE_RATE,
+        slow_call_rate=BREAKER_SLOW_CALL_RATE,
+        slow_call_seconds=BREAKER_SLOW_CALL_SECONDS,
+        open_seconds=BREAKER_OPEN_SECONDS,
+        half_open_probes=BREAKER_HALF_OPEN_PROBES,
+    )
+    limiter = AIMDLimiter(
+        initial=CONCURRENCY_INITIAL,
+        min_limit=CONCURRENCY_MIN,
+        max_limit=CONCURRENCY_MAX,
+        latency_target=BREAKER_SLOW_CALL_SECONDS,
+        wait_seconds=CONCURRENCY_WAIT_SECONDS,
+    )
+    rate_limiter = SharedTokenBucket(
+        RATE_LIMIT_DB,
+        {"write": (RATE_WRITES_PER_SECOND, RATE_WRITES_BURST), "read": (RATE_READS_PER_SECOND, RATE_READS_BURST)},
+        max_wait=RATE_WAIT_SECONDS,
+    )
+    return breakers, limiter, rate_limiter
+
+
+def _guard_status(breakers: BreakerRegistry, limiter: AIMDLimiter, rate_limiter: SharedTokenBucket, coalesced: int) -> Dict[str, Any]:
+    return {
+        "concurrency_limit": limiter.limit,
+        "in_flight": limiter.in_flight,
+        "breakers": {k: v for k, v in breakers.states().items() if v != CircuitBreaker.CLOSED},
+        "rate_limited_for": {b: round(rate_limiter.blocked_for(b), 1) for b in ("write", "read")},
+        "coalesced_gets": coalesced,
+    }
+
+
+def _page_params(limit: int, cursor: Optional[str], cursor_direction: str, filters: Dict[str, Any]) -> Dict[str, Any]:
+    params: Dict[str, Any] = {"limit": limit, "cursor_direction": cursor_direction}
+    if cursor:
+        params["cursor"] = cursor
+    params.update({k: v for k, v in filters.items() if v is not None})
+    return params
+
+
 # -------------------------
 # Client
 # -------------------------
@@ -99,6 +283,37 @@ class UnivapayClient:
             print("[UnivaPay] Warning: UNIVAPAY_APP_SECRET is empty; some endpoints may fail.")
 
         self._session = requests.Session()
+        self.breakers, self.limiter, self.rate_limiter = _new_guards()
+        self.single_flight = SingleFlight()
+
+    def guard_status(self) -> Dict[str, Any]:
+        """Concurrency limit and any endpoint breakers that are not closed (for health checks)."""
+        return _guard_status(self.breakers, self.limiter, self.rate_limiter, self.single_flight.shared)
+
+    def _send(self, breaker: CircuitBreaker, key: str, **request_kwargs) -> requests.Response:
+        """One HTTP attempt through the shared rate limit, the endpoint breaker and the concurrency limiter."""
+        # Waits (bounded) for a token before taking a concurrency slot, so waiting callers don't hold one
+        got_token, wait = self.rate_limiter.acquire(_rate_bucket(request_kwargs["method"]))
+        if not got_token:
+            raise ProviderUnavailable(f"UnivaPay rate limit reached for {key}", retry_after=wait)
+        if not self.limiter.acquire():
+            raise ProviderUnavailable(f"UnivaPay concurrency limit ({self.limiter.limit}) reached for {key}")
+        allowed, probe = breaker.allow()
+        if not allowed:
+            self.limiter.cancel()
+            raise ProviderUnavailable(f"UnivaPay circuit open for {key}", retry_after=breaker.retry_after())
+
+        started = time.monotonic()
+        ok = False
+        try:
+            resp = self._session.request(**request_kwargs)
+            # 429 is a quota signal handled by the rate limiter, not a sign of an unhealthy endpoint
+            ok = resp.status_code not in RETRYABLE_STATUSES or resp.status_code == 429
+            return resp
+        finally:
+            elapsed = time.monotonic() - started
+            self.limiter.release(ok, elapsed)
+            breaker.record(ok, elapsed, probe)
 
     # ---- core request with lightweight retry ----
     def _request(
@@ -107,6 +322,7 @@ class UnivapayClient:
         path: str,
         *,
         json_body: Optional[dict] = None,
+        params: Optional[Dict[str, Any]] = None,
         headers: Optional[Dict[str, str]] = None,
         idempotency_key: Optional[str] = None,
     ) -> Any:
@@ -117,20 +333,42 @@ class UnivapayClient:
             extra_headers["Idempotency-Key"] = idempotency_key
 
         hdrs = _make_headers(extra_headers)
+        if method.upper() == "GET":
+            # Identical concurrent reads (poller, status checks, user refreshes) share one HTTP call
+            flight_key = (url, tuple(sorted((k, str(v)) for k, v in (params or {}).items())))
+            return self.single_flight.do(flight_key, lambda: self._perform(method, path, url, hdrs, json_body, params))
+        return self._perform(method, path, url, hdrs, json_body, params)
+
+    def _perform(
+        self,
+        method: str,
+        path: str,
+        url: str,
+        hdrs: Dict[str, str],
+        json_body: Optional[dict],
+        params: Optional[Dict[str, Any]],
+    ) -> Any:
+        """Send one logical request, retrying retryable failures while the endpoint breaker is closed."""
+        key = endpoint_key(method, path)
+        breaker = self.breakers.get(key)
 
         attempt = 0
         while True:
             attempt += 1
             try:
-                resp = self._session.request(
+                resp = self._send(
+                    breaker,
+                    key,
                     method=method.upper(),
                     url=url,
                     headers=hdrs,
                     json=json_body if json_body is not None else None,
+                    params=params,
                     timeout=self.timeout,
                 )
             except requests.RequestException as e:
-                if attempt <= self.retries:
+                # Only retry while the breaker is closed; otherwise fail fast with the real error
+                if attempt <= self.retries and breaker.state == CircuitBreaker.CLOSED:
                     time.sleep(0.4 * attempt)
                     continue
                 raise UnivapayError(f"Network error calling {url}: {e}")
@@ -141,17 +379,15 @@ class UnivapayClient:
                     return resp.json()
                 return None
 
+            # Throttled: pause this bucket for every process (the next acquire waits it out)
+            if resp.status_code == 429:
+                self.rate_limiter.penalize(_rate_bucket(method), _retry_delay(attempt, resp.headers.get("Retry-After")))
+
             # Retry on 429/5xx
-            if resp.status_code in (429, 500, 502, 503, 504) and attempt <= self.retries:
-                # Respect Retry-After if present
-                delay = 0.5 * attempt
-                try:
-                    ra = resp.headers.get("Retry-After")
-                    if ra:
-                        delay = max(delay, float(ra))
-                except Exception:
-                    pass
-                time.sleep(delay)
+            if resp.status_code in RETRYABLE_STATUSES and attempt <= self.retries and breaker.state == CircuitBreaker.CLOSED:
+                if resp.status_code != 429:
+                    # Respect Retry-After if present
+                    time.sleep(_retry_delay(attempt, resp.headers.get("Retry-After")))
                 continue
 
             # Error: parse body if possible
@@ -192,27 +428,16 @@ class UnivapayClient:
         - redirect_endpoint: where UnivaPay should redirect the customer after 3DS
         - idempotency_key: optional string you provide to de-duplicate requests
         """
-        amt = _validate_amount(amount)
-        cur = _coerce_currency(currency)
-
-        body: Dict[str, Any] = {
-            "transaction_token_id": transaction_token_id,
-            "amount": amt,
-            "currency": cur,
-        }
-        if capture is not None:
-            body["capture"] = bool(capture)
-        if capture_at:
-            body["capture_at"] = capture_at
-        if metadata:
-            body["metadata"] = metadata
-        if redirect_endpoint:
-            # Per docs, UnivaPay supports a redirect object.
-            body["redirect"] = {"endpoint": redirect_endpoint}
-        if three_ds_mode:
-            # Follow doc field for three_ds mode on charge creation
-            body["three_ds"] = {"mode": three_ds_mode}
-
+        body = _charge_body(
+            transaction_token_id=transaction_token_id,
+            amount=amount,
+            currency=currency,
+            capture=capture,
+            capture_at=capture_at,
+            metadata=metadata,
+            three_ds_mode=three_ds_mode,
+            redirect_endpoint=redirect_endpoint,
+        )
         return self._request("POST", "/charges", json_body=body, idempotency_key=idempotency_key)
 
     def get_charge(self, charge_id: str) -> Any:
@@ -221,15 +446,30 @@ class UnivapayClient:
             return self._request("GET", f"/stores/{UNIVAPAY_STORE_ID}/charges/{charge_id}")
         return self._request("GET", f"/charges/{charge_id}")
 
+    def list_charges(
+        self,
+        *,
+        limit: int = 100,
+        cursor: Optional[str] = None,
+        cursor_direction: str = "desc",
+        **filters: Any,
+    ) -> Any:
+        """
+        One page of store-scoped charges: {'items': [...], 'has_more': bool}.
+        Pass the last item's id as 'cursor' to fetch the next page.
+        """
+        return self._request("GET", f"{self._store_path()}/charges", params=_page_params(limit, cursor, cursor_direction, filters))
+
+    def iter_charges(self, *, page_size: int = 100, **filters: Any) -> Iterator[List[Dict[str, Any]]]:
+        """Yield pages (lists) of store-scoped charges, newest first, following the cursor."""
+        return self._iter_pages(self.list_charges, page_size, filters)
+
     def capture_charge(self, charge_id: str, *, amount: Optional[int] = None, idempotency_key: Optional[str] = None) -> Any:
         """
         Capture a previously authorized charge.
         If 'amount' provided, must be <= authorized amount.
         """
-        body = {}
-        if amount is not None:
-            body["amount"] = _validate_amount(amount)
-        return self._request("POST", f"/charges/{charge_id}/capture", json_body=body or None, idempotency_key=idempotency_key)
+        return self._request("POST", f"/charges/{charge_id}/capture", json_body=_capture_body(amount), idempotency_key=idempotency_key)
 
     def cancel_charge(self, charge_id: str, *, reason: Optional[str] = None, idempotency_key: Optional[str] = None) -> Any:
         """Cancel (void) an authorized charge (or refund rules depending on status)."""
@@ -260,31 +500,18 @@ class UnivapayClient:
 
         Either 'period' or 'cyclical_period' must be provided.
         """
-        amt = _validate_amount(amount)
-        cur = _coerce_currency(currency)
-
-        if not period and not cyclical_period:
-            raise UnivapayError("Either 'period' or 'cyclical_period' must be specified for subscription.")
-
-        body: Dict[str, Any] = {
-            "transaction_token_id": transaction_token_id,
-            "amount": amt,
-            "currency": cur,
-            "schedule_settings": {"zone_id": zone_id},
-        }
-        if period:
-            body["period"] = period
-        if cyclical_period:
-            body["cyclical_period"] = cyclical_period
-        if start_on:
-            body["schedule_settings"]["start_on"] = start_on
-        if metadata:
-            body["metadata"] = metadata
-        if redirect_endpoint:
-            body["redirect"] = {"endpoint": redirect_endpoint}
-        if three_ds_mode:
-            body["three_ds"] = {"mode": three_ds_mode}
-
+        body = _subscription_body(
+            transaction_token_id=transaction_token_id,
+            amount=amount,
+            currency=currency,
+            period=period,
+            cyclical_period=cyclical_period,
+            start_on=start_on,
+            zone_id=zone_id,
+            metadata=metadata,
+            three_ds_mode=three_ds_mode,
+            redirect_endpoint=redirect_endpoint,
+        )
         return self._request("POST", "/subscriptions", json_body=body, idempotency_key=idempotency_key)
 
     def get_subscription(self, subscription_id: str) -> Any:
@@ -293,15 +520,47 @@ class UnivapayClient:
             return self._request("GET", f"/stores/{UNIVAPAY_STORE_ID}/subscriptions/{subscription_id}")
         return self._request("GET", f"/subscriptions/{subscription_id}")
 
+    def list_subscriptions(
+        self,
+        *,
+        limit: int = 100,
+        cursor: Optional[str] = None,
+        cursor_direction: str = "desc",
+        **filters: Any,
+    ) -> Any:
+        """One page of store-scoped subscriptions: {'items': [...], 'has_more': bool}."""
+        return self._request("GET", f"{self._store_path()}/subscriptions", params=_page_params(limit, cursor, cursor_direction, filters))
+
+    def iter_subscriptions(self, *, page_size: int = 100, **filters: Any) -> Iterator[List[Dict[str, Any]]]:
+        """Yield pages (lists) of store-scoped subscriptions, newest first, following the cursor."""
+        return self._iter_pages(self.list_subscriptions, page_size, filters)
+
     def cancel_subscription(self, subscription_id: str, *, termination_mode: Optional[str] = None) -> Any:
         """
         Cancel (permanently stop) a subscription.
         Optionally specify termination_mode: 'immediate' | 'on_next_payment'
         """
-        body = {}
-        if termination_mode:
-            body["schedule_settings"] = {"termination_mode": termination_mode}
-        return self._request("POST", f"/subscriptions/{subscription_id}/cancel", json_body=body or None)
+        return self._request("POST", f"/subscriptions/{subscription_id}/cancel", json_body=_cancel_subscription_body(termination_mode))
+
+    # -------------------------
+    # Paging
+    # -------------------------
+    def _store_path(self) -> str:
+        if not UNIVAPAY_STORE_ID:
+            raise UnivapayError("UNIVAPAY_STORE_ID is required for list endpoints")
+        return f"/stores/{UNIVAPAY_STORE_ID}"
+
+    @staticmethod
+    def _iter_pages(fetch, page_size: int, filters: Dict[str, Any]) -> Iterator[List[Dict[str, Any]]]:
+        cursor = None
+        while True:
+            page = fetch(limit=page_size, cursor=cursor, **filters) or {}
+            items = page.get("items") or []
+            if items:
+                yield items
+            if not page.get("has_more") or not items:
+                return
+            cursor = items[-1].get("id")
 
     # -------------------------
     # Utility
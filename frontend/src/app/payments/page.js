@@ -1,7 +1,7 @@
 'use client';
 
-import { useEffect, useMemo, useRef, useState } from 'react';
-import { useRouter, useSearchParams } from 'next/navigation';
+import { useEffect, useState } from 'react';
+import { useRouter } from 'next/navigation';
 
 const API_BASE = process.env.NEXT_PUBLIC_API_BASE || 'http://localhost:5000';
 
@@ -88,18 +88,16 @@ function RowDetails({ row }) {
 
 export default function PaymentsPage() {
   const router = useRouter();
-  const sp = useSearchParams();
 
   const [rows, setRows] = useState([]);
   const [loading, setLoading] = useState(true);
   const [err, setErr] = useState('');
   const [openIds, setOpenIds] = useState({}); // expand/collapse details per row
+  const [nextCursor, setNextCursor] = useState(null); // keyset cursor for the next page
+  const [loadingMore, setLoadingMore] = useState(false);
 
-  // When coming from /payments/return, auto-refresh briefly to catch webhook updates
-  const fromReturn = useMemo(() => sp.get('from') === 'return', [sp]);
-  const autorefreshSecs = 30; // total seconds to auto-refresh
-  const [secondsLeft, setSecondsLeft] = useState(fromReturn ? autorefreshSecs : 0);
-  const intervalRef = useRef(null);
+  // Live status updates pushed by the backend (replaces the post-3DS polling loop)
+  const [live, setLive] = useState(false);
 
   // auth guard
   useEffect(() => {
@@ -120,6 +118,7 @@ export default function PaymentsPage() {
       if (!res.ok) throw new Error(data.error || 'Failed to load payments');
       // Expecting each payment to include `provider` object if you applied the BE update
       setRows(Array.isArray(data.payments) ? data.payments : []);
+      setNextCursor(data.next_cursor || null);
     } catch (e) {
       setErr(e.message || 'Error loading payments');
     } finally {
@@ -127,36 +126,92 @@ export default function PaymentsPage() {
     }
   };
 
+  const loadMore = async () => {
+    const token = localStorage.getItem('token');
+    if (!token || !nextCursor) return;
+    try {
+      setLoadingMore(true);
+      const res = await fetch(`${API_BASE}/api/payments?after=${encodeURIComponent(nextCursor)}`, {
+        headers: { Authorization: `Bearer ${token}` },
+      });
+      const data = await res.json().catch(() => ({}));
+      if (!res.ok) throw new Error(data.error || 'Failed to load payments');
+      setRows((prev) => [...prev, ...(Array.isArray(data.payments) ? data.payments : [])]);
+      setNextCursor(data.next_cursor || null);
+    } catch (e) {
+      setErr(e.message || 'Error loading payments');
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   // initial load
   useEffect(() => {
     fetchRows();
   }, []); // eslint-disable-line react-hooks/exhaustive-deps
 
-  // short auto-refresh loop after returning from 3DS
+  // subscribe to provider status transitions over SSE
   useEffect(() => {
-    if (!fromReturn || secondsLeft <= 0 || intervalRef.current) return;
+    if (typeof EventSource === 'undefined') return;
+    let es = null;
+    let retryTimer = null;
+    let closed = false;
 
-    intervalRef.current = setInterval(() => {
-      setSecondsLeft((s) => {
-        const next = s - 5;
-        if (next <= 0) {
-          clearInterval(intervalRef.current);
-          intervalRef.current = null;
-          return 0;
+    const onPayment = (ev) => {
+      let msg;
+      try { msg = JSON.parse(ev.data); } catch { return; }
+      setRows((prev) => {
+        if (prev.some((r) => r.id === msg.payment_id)) {
+          return prev.map((r) => (r.id === msg.payment_id ? { ...r, provider: msg.provider } : r));
+        }
+        // A payment made after this page loaded (e.g. in another tab) goes on top; an older
+        // one that just isn't on the loaded pages stays out of the list
+        const newest = prev[0];
+        if (msg.payment && (!newest || msg.payment.created_at >= newest.created_at)) {
+          return [{ ...msg.payment, provider: msg.provider }, ...prev];
         }
-        return next;
+        return prev;
       });
-      fetchRows();
-    }, 5000);
+    };
 
-    return () => {
-      if (intervalRef.current) {
-        clearInterval(intervalRef.current);
-        intervalRef.current = null;
+    // EventSource can't send headers, so each connect uses a short-lived stream token
+    // instead of putting the session JWT in the URL (and in access/proxy logs)
+    const connect = async () => {
+      const token = localStorage.getItem('token');
+      if (!token || closed) return;
+      try {
+        const res = await fetch(`${API_BASE}/api/payments/stream-token`, {
+          method: 'POST',
+          headers: { Authorization: `Bearer ${token}` },
+        });
+        if (res.status === 401) return; // session expired; the auth guard sends the user to login
+        const data = await res.json().catch(() => ({}));
+        if (!res.ok || !data.token) throw new Error(data.error || 'Failed to open live updates');
+        if (closed) return;
+        es = new EventSource(`${API_BASE}/api/payments/stream?token=${encodeURIComponent(data.token)}`);
+      } catch {
+        retryTimer = setTimeout(connect, 5000);
+        return;
       }
+      es.onopen = () => setLive(true);
+      es.onerror = () => {
+        setLive(false);
+        // EventSource retries by itself, but gives up once its stream token is rejected
+        if (es.readyState === EventSource.CLOSED && !closed) {
+          es.close();
+          retryTimer = setTimeout(connect, 5000);
+        }
+      };
+      es.addEventListener('payment', onPayment);
+    };
+
+    connect();
+    return () => {
+      closed = true;
+      clearTimeout(retryTimer);
+      if (es) es.close();
     };
-    // eslint-disable-next-line react-hooks/exhaustive-deps
-  }, [fromReturn, secondsLeft]);
+  }, []);
 
   const toggleOpen = (id) => {
     setOpenIds((m) => ({ ...m, [id]: !m[id] }));
@@ -168,9 +223,9 @@ export default function PaymentsPage() {
         <div className="flex flex-wrap items-center justify-between gap-3">
           <h1 className="text-xl font-semibold">Your Payments</h1>
           <div className="flex items-center gap-2">
-            {fromReturn && secondsLeft > 0 && (
+            {live && (
               <span className="text-xs text-gray-500">
-                Auto-refreshing… {secondsLeft}s
+                Live
               </span>
             )}
             <button
@@ -276,6 +331,17 @@ export default function PaymentsPage() {
                     })}
                   </tbody>
                 </table>
+                {nextCursor && (
+                  <div className="mt-4 flex justify-center">
+                    <button
+                      onClick={loadMore}
+                      disabled={loadingMore}
+                      className="rounded-md border border-gray-300 bg-white px-3 py-1.5 text-xs font-medium hover:bg-gray-50 disabled:opacity-50"
+                    >
+                      {loadingMore ? 'Loading…' : 'Load more'}
+                    </button>
+                  </div>
+                )}
               </div>
             )}
           </>
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import SubscriptionPlan, PaymentHistory, TransactionToken
+from .models import SubscriptionPlan, PaymentHistory, PaymentPayload, TransactionToken, PollJob, ProcessedWebhook, WebhookInboxEvent, PaymentSummary, IdempotencyRecord
 
 
 @admin.register(SubscriptionPlan)
@@ -42,13 +42,21 @@ class TransactionTokenAdmin(admin.ModelAdmin):
     )
 
 
+class PaymentPayloadInline(admin.StackedInline):
+    model = PaymentPayload
+    readonly_fields = ('raw_json',)
+    can_delete = False
+    classes = ('collapse',)
+
+
 @admin.register(PaymentHistory)
 class PaymentHistoryAdmin(admin.ModelAdmin):
     list_display = ('id', 'user', 'payment_type', 'amount', 'currency', 
                     'status', 'mode', 'created_at')
     list_filter = ('payment_type', 'status', 'mode', 'currency')
     search_fields = ('user__email', 'univapay_id', 'transaction_token__univapay_token_id')
-    readonly_fields = ('created_at', 'updated_at', 'raw_json')
+    readonly_fields = ('created_at', 'updated_at')
+    inlines = (PaymentPayloadInline,)
     date_hierarchy = 'created_at'
     
     fieldsets = (
@@ -70,7 +78,7 @@ class PaymentHistoryAdmin(admin.ModelAdmin):
             'classes': ('collapse',)
         }),
         ('Additional Information', {
-            'fields': ('metadata', 'raw_json'),
+            'fields': ('metadata',),
             'classes': ('collapse',)
         }),
         ('Timestamps', {
@@ -80,4 +88,43 @@ class PaymentHistoryAdmin(admin.ModelAdmin):
     
     def get_queryset(self, request):
         qs = super().get_queryset(request)
-        return qs.select_related('user', 'transaction_token', 'subscription_plan')
\ No newline at end of file
+        return qs.select_related('user', 'transaction_token', 'subscription_plan')
+
+
+@admin.register(PollJob)
+class PollJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'payment', 'kind', 'attempt', 'next_poll_at', 'created_at')
+    list_filter = ('kind',)
+    ordering = ('next_poll_at',)
+
+
+@admin.register(ProcessedWebhook)
+class ProcessedWebhookAdmin(admin.ModelAdmin):
+    list_display = ('id', 'event_type', 'dedup_key', 'received_at')
+    list_filter = ('event_type',)
+    search_fields = ('dedup_key',)
+    ordering = ('-received_at',)
+
+
+@admin.register(WebhookInboxEvent)
+class WebhookInboxEventAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'event_type', 'univapay_id', 'received_at', 'processed_at')
+    list_filter = ('kind', 'event_type')
+    search_fields = ('univapay_id',)
+    ordering = ('-received_at',)
+
+
+@admin.register(PaymentSummary)
+class PaymentSummaryAdmin(admin.ModelAdmin):
+    list_display = ('user', 'payments_count', 'successful_payments', 'active_subscriptions',
+                    'last_payment_status', 'last_payment_at', 'updated_at')
+    search_fields = ('user__email',)
+    readonly_fields = [f.name for f in PaymentSummary._meta.fields]
+
+
+@admin.register(IdempotencyRecord)
+class IdempotencyRecordAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'key', 'response_status', 'claimed_at', 'completed_at')
+    list_filter = ('response_status',)
+    search_fields = ('key', 'user__email')
+    ordering = ('-claimed_at',)
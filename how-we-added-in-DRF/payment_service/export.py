@@ -0,0 +1,71 @@
+import csv
+import json
+from datetime import date, datetime
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import PaymentHistory
+
+# Constants
+EXPORT_CHUNK_SIZE = 2000  # rows per server-side cursor fetch
+EXPORT_FORMATS = ('csv', 'ndjson')
+
+# Flat columns only (plus two FK lookups); raw payloads stay in PaymentPayload
+EXPORT_FIELDS = (
+    'id', 'created_at', 'updated_at', 'user__email', 'payment_type', 'status', 'mode',
+    'amount', 'currency', 'charged_amount', 'charged_currency', 'fee_amount', 'fee_currency',
+    'univapay_id', 'subscription_id', 'merchant_transaction_id', 'subscription_plan__name',
+    'period', 'next_payment_due_date', 'next_payment_amount', 'cancelled_on',
+    'error_code', 'error_message',
+)
+
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def export_rows(queryset=None):
+    """
+    Yield PaymentHistory rows as tuples in EXPORT_FIELDS order, oldest first.
+
+    values_list() skips model instantiation and iterator() streams through a
+    server-side cursor (on PostgreSQL) in EXPORT_CHUNK_SIZE fetches, so memory stays
+    flat however many rows are exported.
+    """
+    if queryset is None:
+        queryset = PaymentHistory.objects.all()
+    return queryset.order_by('id').values_list(*EXPORT_FIELDS).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+class _Echo:
+    """csv.writer target that hands back each formatted line instead of buffering it."""
+
+    def write(self, value):
+        return value
+
+
+def _cell(value):
+    # Full-precision ISO timestamps (DjangoJSONEncoder would cut them to milliseconds)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow([name.replace('__', '_') for name in EXPORT_FIELDS])
+    for row in rows:
+        yield writer.writerow([_cell(v) for v in row])
+
+
+def ndjson_lines(rows):
+    keys = [name.replace('__', '_') for name in EXPORT_FIELDS]
+    for row in rows:
+        yield json.dumps(dict(zip(keys, map(_cell, row))), cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+
+def export_lines(rows, export_format):
+    if export_format == 'ndjson':
+        return ndjson_lines(rows)
+    return csv_lines(rows)
@@ -0,0 +1,113 @@
+import json
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+
+# Constants
+# Stored format: MAGIC + dictionary id (1 byte) + raw deflate stream. JSON text never
+# starts with NUL, so legacy uncompressed rows are told apart by the first byte.
+MAGIC = b'\x00z'
+COMPRESS_LEVEL = 6
+
+_UUID = '00000000-0000-0000-0000-000000000000'
+_TS = '2025-01-01T00:00:00.000000Z'
+
+# Representative UnivaPay responses. Frequent fragments go last: deflate reaches them
+# with the shortest distances. NEVER edit a published dictionary; add a new id instead.
+_DICT_V1_SAMPLES = (
+    {'id': _UUID, 'store_id': _UUID, 'email': '', 'payment_type': 'card', 'active': True, 'mode': 'test',
+     'type': 'recurring', 'usage_limit': None, 'confirmed': None, 'metadata': {}, 'created_on': _TS,
+     'last_used_on': None, 'data': {'card': {'cardholder': '', 'exp_month': 12, 'exp_year': 2030,
+     'card_bin': '424242', 'last_four': '4242', 'brand': 'visa', 'card_type': 'credit', 'country': 'JP',
+     'category': None, 'issuer': None, 'sub_brand': 'none'}, 'billing': {'line1': None, 'line2': None,
+     'state': None, 'city': None, 'country': None, 'zip': None, 'phone_number': {'country_code': 81,
+     'local_number': ''}}, 'cvv_authorize': {'enabled': False, 'status': None, 'charge_id': None,
+     'credentials_id': None, 'currency': None}, 'three_ds': {'enabled': True, 'status': None}}},
+    {'id': _UUID, 'store_id': _UUID, 'transaction_token_id': _UUID, 'amount': 10000, 'currency': 'JPY',
+     'amount_formatted': 10000, 'period': 'monthly', 'initial_amount': None, 'initial_amount_formatted': None,
+     'subsequent_cycles_start': None, 'schedule_settings': {'start_on': None, 'zone_id': 'Asia/Tokyo',
+     'preserve_end_of_month': None}, 'only_direct_currency': False, 'first_charge_capture_after': None,
+     'first_charge_authorization_only': False, 'status': 'unverified', 'metadata': {}, 'mode': 'test',
+     'created_on': _TS, 'next_payment': {'id': _UUID, 'due_date': '2025-02-01', 'zone_id': 'Asia/Tokyo',
+     'amount': 10000, 'currency': 'JPY', 'amount_formatted': 10000, 'is_paid': False, 'is_last_payment': False,
+     'created_on': _TS, 'updated_on': _TS, 'retry_date': None}, 'cyclical_period': None,
+     'termination_mode': None, 'cancelled_on': None},
+    {'id': _UUID, 'store_id': _UUID, 'transaction_token_id': _UUID, 'transaction_token_type': 'one_time',
+     'subscription_id': None, 'merchant_transaction_id': None, 'requested_amount': 1000,
+     'requested_currency': 'JPY', 'requested_amount_formatted': 1000, 'charged_amount': 1000,
+     'charged_currency': 'JPY', 'charged_amount_formatted': 1000, 'fee_amount': None, 'fee_currency': None,
+     'fee_amount_formatted': None, 'only_direct_currency': False, 'capture_at': None, 'descriptor': None,
+     'descriptor_phone_number': None, 'status': 'pending', 'error': None, 'metadata': {}, 'mode': 'test',
+     'created_on': _TS, 'redirect': {'endpoint': 'https://', 'redirect_id': _UUID},
+     'three_ds': {'redirect_endpoint': 'https://', 'redirect_id': _UUID, 'mode': 'normal'}},
+)
+_DICT_V1 = ''.join(json.dumps(s, cls=DjangoJSONEncoder) for s in _DICT_V1_SAMPLES).encode('utf-8')
+
+DICTIONARIES = {1: _DICT_V1}
+CURRENT_DICT_ID = 1
+
+
+def compress_json_text(text, dict_id=CURRENT_DICT_ID):
+    c = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=DICTIONARIES[dict_id])
+    return MAGIC + bytes([dict_id]) + c.compress(text.encode('utf-8')) + c.flush()
+
+
+def is_compressed(value):
+    return isinstance(value, (bytes, bytearray, memoryview)) and bytes(value[:2]) == MAGIC
+
+
+def decompress_json_text(value):
+    """Decode a stored value: compressed bytes, legacy UTF-8 bytes, or legacy text."""
+    if value is None or isinstance(value, str):
+        return value
+    raw = bytes(value)
+    if raw[:2] != MAGIC:
+        return raw.decode('utf-8')
+    d = zlib.decompressobj(-zlib.MAX_WBITS, zdict=DICTIONARIES[raw[2]])
+    return (d.decompress(raw[3:]) + d.flush()).decode('utf-8')
+
+
+class CompressedJSONField(models.BinaryField):
+    """
+    JSON value stored as dictionary-compressed bytes.
+
+    Behaves like a JSONField for reads and writes (no lookups into the document).
+    Rows written before the column was converted still decode; the
+    `univapay_compress_payloads` command rewrites them in place.
+    """
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('editable', True)
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if kwargs.get('editable') is True:
+            del kwargs['editable']
+        return name, path, args, kwargs
+
+    def get_prep_value(self, value):
+        if value is None or is_compressed(value):
+            return value
+        return compress_json_text(json.dumps(value, cls=DjangoJSONEncoder))
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if not prepared:
+            value = self.get_prep_value(value)
+        return connection.Database.Binary(value) if value is not None else None
+
+    def from_db_value(self, value, expression, connection):
+        text = decompress_json_text(value)
+        return json.loads(text) if text is not None else None
+
+    def to_python(self, value):
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return json.loads(decompress_json_text(value))
+        return value
+
+    def value_to_string(self, obj):
+        return json.dumps(self.value_from_object(obj), cls=DjangoJSONEncoder)
+
+    def formfield(self, **kwargs):
+        return models.JSONField().formfield(**kwargs)
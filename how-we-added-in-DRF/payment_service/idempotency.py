@@ -0,0 +1,134 @@
+import hashlib
+import json
+import uuid
+from datetime import timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils.timezone import now
+
+from .inprocess import RecentValues
+from .models import IdempotencyRecord
+
+# Constants
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+IDEMPOTENCY_TTL = timedelta(hours=24)  # completed keys replay for this long
+IDEMPOTENCY_LOCK_SECONDS = 120  # an unfinished claim older than this is treated as abandoned
+IDEMPOTENCY_CACHE_SIZE = 10000  # in-memory front for completed responses
+IDEMPOTENCY_CACHE_SECONDS = 600
+
+# Provider Idempotency-Key derived from (user, client key), so UnivaPay also collapses repeats
+PROVIDER_KEY_NAMESPACE = uuid.UUID('5b0f2f7e-93c1-4c39-9d3c-6f1f6d0c9a71')
+
+
+class IdempotencyError(Exception):
+    """The key can't be used for this request right now (status is the HTTP status to return)."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+_recent = RecentValues(IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_CACHE_SECONDS)  # completed responses
+
+
+def request_fingerprint(data):
+    return hashlib.sha256(json.dumps(data, sort_keys=True, cls=DjangoJSONEncoder).encode()).hexdigest()
+
+
+def provider_idempotency_key(user_id, key):
+    return str(uuid.uuid5(PROVIDER_KEY_NAMESPACE, f'{user_id}:{key}'))
+
+
+class IdempotentRequest:
+    """
+    One request carrying a client Idempotency-Key.
+
+        idem = IdempotentRequest.begin(request.user, key, request.data)
+        if idem.replay is not None:
+            status_code, body = idem.replay     # stored response of the first request
+        ...
+        with transaction.atomic():
+            ...                                 # the request's own writes
+            idem.complete(status_code, body)    # committed together with them
+        # or idem.release() on a transient failure, so a retry can run again
+
+    `begin` raises IdempotencyError (409) while another request holds the key, and (422)
+    when the key is reused with a different body.
+    """
+
+    def __init__(self, record=None, replay=None):
+        self.record = record
+        self.replay = replay
+
+    @property
+    def provider_key(self):
+        return provider_idempotency_key(self.record.user_id, self.record.key)
+
+    @classmethod
+    def begin(cls, user, key, data):
+        if len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            raise IdempotencyError(400, f'{IDEMPOTENCY_HEADER} must be at most {IDEMPOTENCY_KEY_MAX_LENGTH} characters')
+        fingerprint = request_fingerprint(data)
+        cache_key = (user.pk, key)
+
+        cached = _recent.get(cache_key)
+        if cached is not None:
+            return cls(replay=cls._check_replay(cached, fingerprint))
+
+        try:
+            with transaction.atomic():
+                return cls(record=IdempotencyRecord.objects.create(user=user, key=key, request_hash=fingerprint))
+        except IntegrityError:
+            pass
+
+        record = IdempotencyRecord.objects.filter(user=user, key=key).first()
+        if record is None:
+            # The holder released the key between our insert and this read: the client retries
+            raise IdempotencyError(409, 'A request with this Idempotency-Key is still in progress')
+        current = now()
+        if record.response_status is not None and record.claimed_at > current - IDEMPOTENCY_TTL:
+            stored = (record.request_hash, record.response_status, record.response_body)
+            _recent.put(cache_key, stored)
+            return cls(replay=cls._check_replay(stored, fingerprint))
+        if record.request_hash != fingerprint and record.response_status is None:
+            raise IdempotencyError(422, f'{IDEMPOTENCY_HEADER} was already used for a different request')
+
+        # Expired, or claimed by a request that never finished: take it over (compare-and-set)
+        takeover = IdempotencyRecord.objects.filter(pk=record.pk, claimed_at=record.claimed_at).filter(
+            Q(response_status__isnull=False)
+            | Q(claimed_at__lt=current - timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS))
+        ).update(
+            request_hash=fingerprint, response_status=None, response_body=None, claimed_at=current, completed_at=None
+        )
+        if not takeover:
+            raise IdempotencyError(409, 'A request with this Idempotency-Key is still in progress')
+        record.request_hash, record.claimed_at = fingerprint, current
+        record.response_status = record.response_body = record.completed_at = None
+        return cls(record=record)
+
+    @staticmethod
+    def _check_replay(stored, fingerprint):
+        request_hash, status_code, body = stored
+        if request_hash != fingerprint:
+            raise IdempotencyError(422, f'{IDEMPOTENCY_HEADER} was already used for a different request')
+        return status_code, body
+
+    def complete(self, status_code, body):
+        """Store the response; call inside the transaction that made the request's writes."""
+        IdempotencyRecord.objects.filter(pk=self.record.pk).update(
+            response_status=status_code, response_body=body, completed_at=now()
+        )
+        stored = (self.record.request_hash, status_code, body)
+        cache_key = (self.record.user_id, self.record.key)
+        transaction.on_commit(lambda: _recent.put(cache_key, stored))
+
+    def release(self):
+        """Give the key back after a failure that a retry could fix."""
+        IdempotencyRecord.objects.filter(pk=self.record.pk, response_status__isnull=True).delete()
+
+
+def prune_idempotency_records(older_than=IDEMPOTENCY_TTL):
+    return IdempotencyRecord.objects.filter(claimed_at__lt=now() - older_than).delete()[0]
@@ -0,0 +1,100 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+
+class RecentValues:
+    """
+    Bounded, thread-safe key -> value map with a TTL (oldest evicted first).
+
+    An in-process front for durable rows: a hit skips the database, a miss (None)
+    means "ask the database".
+    """
+
+    def __init__(self, max_size, ttl_seconds):
+        self.max_size = max(1, max_size)
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._items = OrderedDict()  # key -> (expires_at (monotonic), value)
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            if item[0] <= now:
+                del self._items[key]
+                return None
+            return item[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._items)
+
+
+class RecentKeys(RecentValues):
+    """RecentValues used as a set: `key in recent` after `recent.add(key)`."""
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def add(self, key):
+        self.put(key, True)
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Concurrent calls with the same key share one execution: the first caller runs the
+    function, later arrivals wait for it and get a copy of its result (or its exception).
+    Nothing is cached once the call returns.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.shared = 0  # calls answered by another caller's request
+
+    def do(self, key, fn):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                flight.waiters += 1
+                self.shared += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return copy.deepcopy(flight.result)
+
+        try:
+            flight.result = fn()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+                shared = flight.waiters > 0  # nobody can join once the key is gone
+            flight.done.set()
+        return copy.deepcopy(flight.result) if shared else flight.result
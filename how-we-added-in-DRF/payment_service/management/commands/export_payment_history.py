@@ -0,0 +1,45 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from payment_service.export import EXPORT_FORMATS, export_lines, export_rows
+from payment_service.models import PaymentHistory
+
+
+class Command(BaseCommand):
+    help = "Stream PaymentHistory rows as CSV or NDJSON in constant memory."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', dest='export_format', choices=EXPORT_FORMATS, default='csv')
+        parser.add_argument('--output', default='-', help='File path, or - for stdout')
+        parser.add_argument('--user', help='Only this user (email)')
+        parser.add_argument('--since', help='Only rows created at/after this ISO timestamp')
+        parser.add_argument('--until', help='Only rows created before this ISO timestamp')
+
+    def handle(self, *args, **options):
+        queryset = PaymentHistory.objects.all()
+        if options['user']:
+            queryset = queryset.filter(user__email=options['user'])
+        for bound, lookup in (('since', 'created_at__gte'), ('until', 'created_at__lt')):
+            if options[bound]:
+                value = parse_datetime(options[bound])
+                if value is None:
+                    raise CommandError(f"--{bound} must be an ISO timestamp")
+                if timezone.is_naive(value):
+                    value = timezone.make_aware(value)
+                queryset = queryset.filter(**{lookup: value})
+
+        out = sys.stdout if options['output'] == '-' else open(options['output'], 'w', encoding='utf-8', newline='')
+        count = 0
+        try:
+            for line in export_lines(export_rows(queryset), options['export_format']):
+                out.write(line)
+                count += 1
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        if options['export_format'] == 'csv':
+            count -= 1  # header
+        self.stderr.write(f"[Export] {count} row(s)")
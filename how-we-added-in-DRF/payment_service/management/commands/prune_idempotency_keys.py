@@ -0,0 +1,19 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from payment_service.idempotency import IDEMPOTENCY_TTL, prune_idempotency_records
+
+
+class Command(BaseCommand):
+    help = "Delete Idempotency-Key records older than the replay window (run daily, e.g. from cron)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than-hours', type=float, default=IDEMPOTENCY_TTL.total_seconds() / 3600,
+            help='Age in hours (default: the replay window)',
+        )
+
+    def handle(self, *args, **options):
+        deleted = prune_idempotency_records(timedelta(hours=options['older_than_hours']))
+        self.stdout.write(f"[Idempotency] pruned {deleted} key(s)")
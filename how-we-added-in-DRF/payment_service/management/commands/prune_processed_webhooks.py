@@ -0,0 +1,22 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from payment_service.webhook_dedup import WEBHOOK_DEDUP_RETENTION, prune_processed_webhooks
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete webhook dedup keys (ProcessedWebhook) older than UnivaPay's redelivery window "
+        "(run daily, e.g. from cron)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than-hours', type=float, default=WEBHOOK_DEDUP_RETENTION.total_seconds() / 3600,
+            help='Age in hours since receipt (default: 7 days); keep it longer than the retry window',
+        )
+
+    def handle(self, *args, **options):
+        deleted = prune_processed_webhooks(timedelta(hours=options['older_than_hours']))
+        self.stdout.write(f"[Webhooks] pruned {deleted} dedup key(s)")
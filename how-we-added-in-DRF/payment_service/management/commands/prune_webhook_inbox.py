@@ -0,0 +1,19 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from payment_service.webhook_inbox import WEBHOOK_INBOX_RETENTION, prune_webhook_inbox
+
+
+class Command(BaseCommand):
+    help = "Delete processed webhook inbox events older than the retention window (run daily, e.g. from cron)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than-hours', type=float, default=WEBHOOK_INBOX_RETENTION.total_seconds() / 3600,
+            help='Age in hours since processing (default: 7 days)',
+        )
+
+    def handle(self, *args, **options):
+        deleted = prune_webhook_inbox(timedelta(hours=options['older_than_hours']))
+        self.stdout.write(f"[Webhooks] pruned {deleted} inbox event(s)")
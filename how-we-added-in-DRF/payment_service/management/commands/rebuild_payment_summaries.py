@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from payment_service.models import PaymentSummary
+from payment_service.payment_summary import summary_values
+
+
+class Command(BaseCommand):
+    help = "Recompute PaymentSummary rows from PaymentHistory (repair; normal writes keep them current)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user-id', type=int, action='append', help='Only these users (repeatable)')
+
+    def handle(self, *args, **options):
+        user_ids = options['user_id']
+        with transaction.atomic():
+            summaries = PaymentSummary.objects.select_for_update()
+            if user_ids:
+                summaries = summaries.filter(user_id__in=user_ids)
+            # Lock existing rows so concurrent payment writes wait for the rebuild
+            list(summaries.values_list('pk', flat=True))
+            values = summary_values(user_ids=user_ids)
+            stale = summaries.exclude(user_id__in=list(values))
+            stale.update(
+                spend_by_currency={}, payments_count=0, successful_payments=0, active_subscriptions=0,
+                last_payment=None, last_payment_status='', last_payment_at=None,
+            )
+            for user_id, fields in values.items():
+                PaymentSummary.objects.update_or_create(user_id=user_id, defaults=fields)
+        self.stdout.write(f"[Summary] rebuilt {len(values)} user summary(ies)")
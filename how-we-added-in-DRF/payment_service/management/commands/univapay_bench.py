@@ -0,0 +1,176 @@
+import contextlib
+import hashlib
+import hmac
+import io
+import json
+import time
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from payment_service.univapay_client import UNIVAPAY_WEBHOOK_AUTH, get_univapay_client
+from payment_service.views import PaymentHistoryViewSet, UnivapayChargeView, WebhookView
+
+# Constants
+SCENARIOS = ('charge', 'payment_history', 'webhook')
+
+
+def percentile(sorted_vals, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_vals:
+        return 0.0
+    k = max(0, min(len(sorted_vals) - 1, int(round(pct / 100.0 * len(sorted_vals) + 0.5)) - 1))
+    return sorted_vals[k]
+
+
+def summarize(samples, wall_s):
+    """samples: (latency_s, sql_statements, http_status) per request."""
+    lat = sorted(s[0] * 1000.0 for s in samples)
+    n = len(samples)
+    return {
+        'count': n,
+        'errors': sum(1 for s in samples if s[2] >= 400),
+        'p50_ms': round(percentile(lat, 50), 2),
+        'p95_ms': round(percentile(lat, 95), 2),
+        'p99_ms': round(percentile(lat, 99), 2),
+        'mean_ms': round(sum(lat) / n, 2) if n else 0.0,
+        'rps': round(n / wall_s, 1) if wall_s > 0 else 0.0,
+        'queries_per_req': round(sum(s[1] for s in samples) / n, 2) if n else 0.0,
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark UnivapayChargeView, PaymentHistoryViewSet.list and WebhookView against a running "
+        "UnivaPay simulator (backend/bench/univapay_simulator.py), on a throwaway test database. "
+        "Reports p50/p95/p99 latency, throughput and SQL queries per request."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Requests per scenario')
+        parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+        parser.add_argument('--base-url', default=None, help='Simulator URL (defaults to UNIVAPAY_BASE_URL)')
+        parser.add_argument('--save-baseline', metavar='PATH')
+        parser.add_argument('--compare', metavar='PATH', help='Fail if results regress against this baseline')
+        parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed p95 growth vs baseline (fraction)')
+
+    def handle(self, *args, **options):
+        scenarios = [s.strip() for s in options['scenarios'].split(',') if s.strip()]
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+        univapay = get_univapay_client()
+        if options['base_url']:
+            univapay.base_url = options['base_url'].rstrip('/')
+
+        # Never write benchmark rows into the real database; the test environment also
+        # allows the factory's 'testserver' host (paginated responses build absolute URLs)
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            results = self._run(scenarios, options['requests'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        self._print_table(results)
+        report = {
+            'meta': {
+                'requests': options['requests'],
+                'base_url': univapay.base_url,
+                'database': connection.vendor,
+                'recorded_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            },
+            'results': results,
+        }
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as f:
+                json.dump(report, f, indent=2)
+                f.write('\n')
+            self.stdout.write(f"baseline saved to {options['save_baseline']}")
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+            problems = self._compare(results, baseline, options['tolerance'])
+            if problems:
+                raise CommandError('Regressions vs baseline:\n  ' + '\n  '.join(problems))
+            self.stdout.write('no regressions vs baseline')
+
+    def _run(self, scenarios, n):
+        user = get_user_model().objects.create_user(username='bench-user', password=uuid.uuid4().hex)
+        factory = APIRequestFactory()
+        charge_view = UnivapayChargeView.as_view()
+        history_view = PaymentHistoryViewSet.as_view({'get': 'list'})
+        webhook_view = WebhookView.as_view()
+        charge_ids = []
+
+        def charge(i):
+            request = factory.post('/api/univapay/charge/', {
+                'transaction_token_id': str(uuid.uuid4()),
+                'amount': 1000,
+                'currency': 'JPY',
+            }, format='json')
+            force_authenticate(request, user=user)
+            resp = charge_view(request)
+            if resp.status_code == 201 and resp.data['univapay'].get('charge_id'):
+                charge_ids.append(resp.data['univapay']['charge_id'])
+            return resp.status_code
+
+        def payment_history(i):
+            request = factory.get('/api/payment-history/')
+            force_authenticate(request, user=user)
+            resp = history_view(request)
+            resp.render()
+            return resp.status_code
+
+        def webhook(i):
+            charge_id = charge_ids[i % len(charge_ids)] if charge_ids else f'missing_{i}'
+            body = json.dumps({
+                'event': 'charge.finished',
+                'data': {'id': charge_id, 'status': 'successful' if i % 2 else 'pending'},
+            }).encode()
+            headers = {}
+            if UNIVAPAY_WEBHOOK_AUTH:
+                headers['HTTP_X_SIGNATURE'] = hmac.new(UNIVAPAY_WEBHOOK_AUTH.encode(), body, hashlib.sha256).hexdigest()
+            request = factory.post('/api/webhook/univapay/', body, content_type='application/json', **headers)
+            return webhook_view(request).status_code
+
+        calls = {'charge': charge, 'payment_history': payment_history, 'webhook': webhook}
+        results = {}
+        for name in scenarios:
+            samples = []
+            started = time.perf_counter()
+            for i in range(n):
+                # The views print per-request debug output; keep it out of the report
+                with contextlib.redirect_stdout(io.StringIO()), CaptureQueriesContext(connection) as queries:
+                    t0 = time.perf_counter()
+                    code = calls[name](i)
+                    elapsed = time.perf_counter() - t0
+                samples.append((elapsed, len(queries), code))
+            results[name] = summarize(samples, time.perf_counter() - started)
+        return results
+
+    def _print_table(self, results):
+        self.stdout.write(f"{'scenario':<20}{'n':>6}{'err':>5}{'p50ms':>9}{'p95ms':>9}{'p99ms':>9}{'req/s':>9}{'sql/req':>9}")
+        for name, r in results.items():
+            self.stdout.write(
+                f"{name:<20}{r['count']:>6}{r['errors']:>5}{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}"
+                f"{r['p99_ms']:>9.1f}{r['rps']:>9.1f}{r['queries_per_req']:>9.2f}"
+            )
+
+    def _compare(self, results, baseline, tolerance):
+        problems = []
+        for name, r in results.items():
+            base = baseline.get('results', {}).get(name)
+            if not base:
+                continue
+            if base['p95_ms'] and r['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+                problems.append(f"{name}: p95 {r['p95_ms']:.1f}ms vs baseline {base['p95_ms']:.1f}ms")
+            if r['queries_per_req'] > base['queries_per_req'] + 0.01:
+                problems.append(f"{name}: {r['queries_per_req']:.2f} sql/req vs baseline {base['queries_per_req']:.2f}")
+        return problems
@@ -0,0 +1,67 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from payment_service.fields import compress_json_text, decompress_json_text, is_compressed
+from payment_service.models import PaymentPayload, TransactionToken
+
+# Constants
+COMPRESSED_COLUMNS = (
+    (PaymentPayload, 'raw_json'),
+    (TransactionToken, 'raw_token_data'),
+)
+
+
+class Command(BaseCommand):
+    help = "Rewrite raw UnivaPay payloads stored before compression (safe to re-run)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows per transaction')
+        parser.add_argument(
+            '--expand', action='store_true',
+            help='Store plain UTF-8 JSON again (run before migrating back past 0006)',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options['batch_size'])
+        expand = options['expand']
+        qn = connection.ops.quote_name
+
+        for model, field_name in COMPRESSED_COLUMNS:
+            table = qn(model._meta.db_table)
+            pk = qn(model._meta.pk.column)
+            column = qn(model._meta.get_field(field_name).column)
+            select = f'SELECT {pk}, {column} FROM {table} WHERE {pk} > %s ORDER BY {pk} LIMIT %s'
+            update = f'UPDATE {table} SET {column} = %s WHERE {pk} = %s'
+
+            rows = bytes_before = bytes_after = 0
+            last_pk = 0
+            while True:
+                # Raw SQL: the field would decode on read and re-encode on write
+                with transaction.atomic(), connection.cursor() as cursor:
+                    cursor.execute(select, [last_pk, batch_size])
+                    chunk = cursor.fetchall()
+                    if not chunk:
+                        break
+                    last_pk = chunk[-1][0]
+                    changes = []
+                    for row_pk, raw in chunk:
+                        if raw is None or is_compressed(raw) != expand:
+                            continue
+                        text = decompress_json_text(raw)
+                        if not expand:
+                            new = compress_json_text(text)
+                        elif connection.vendor == 'sqlite':
+                            new = text  # TEXT again, so the JSON_VALID check holds after 0005
+                        else:
+                            new = text.encode('utf-8')
+                        bytes_before += len(text.encode('utf-8')) if isinstance(raw, str) else len(raw)
+                        bytes_after += len(new.encode('utf-8')) if isinstance(new, str) else len(new)
+                        changes.append((new, row_pk))
+                    if changes:
+                        cursor.executemany(update, changes)
+                        rows += len(changes)
+
+            self.stdout.write(
+                f"[Payloads] {model._meta.db_table}.{field_name}: {rows} row(s), "
+                f"{bytes_before} -> {bytes_after} bytes"
+            )
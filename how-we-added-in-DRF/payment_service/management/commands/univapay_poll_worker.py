@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from payment_service.polling import drain_due_jobs, seconds_until_next_job
+from payment_service.univapay_client import get_univapay_client
+
+
+class Command(BaseCommand):
+    help = "Drain the durable UnivaPay status-poll queue (PollJob) with bounded concurrency."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=4, help='Max provider calls in flight')
+        parser.add_argument('--idle-seconds', type=float, default=30.0, help='Max sleep when the queue is empty')
+        parser.add_argument('--once', action='store_true', help='Process due jobs once and exit')
+
+    def handle(self, *args, **options):
+        univapay = get_univapay_client()
+        concurrency = max(1, options['concurrency'])
+
+        while True:
+            processed = drain_due_jobs(univapay, concurrency=concurrency)
+            if processed:
+                self.stdout.write(f"[Poller] processed {processed} job(s)")
+            if options['once']:
+                return
+            # Sleep until the earliest job is due (rows survive restarts, so nothing is lost meanwhile)
+            time.sleep(seconds_until_next_job(options['idle_seconds']))
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from payment_service.webhook_inbox import WEBHOOK_BATCH_SIZE, apply_pending_webhooks
+
+
+class Command(BaseCommand):
+    help = "Apply queued UnivaPay webhook events (WebhookInboxEvent) in coalesced batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=WEBHOOK_BATCH_SIZE, help='Events per transaction')
+        parser.add_argument('--idle-seconds', type=float, default=1.0, help='Sleep when the inbox is empty')
+        parser.add_argument('--once', action='store_true', help='Drain the inbox once and exit')
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options['batch_size'])
+
+        while True:
+            total = 0
+            while True:
+                applied = apply_pending_webhooks(limit=batch_size)
+                if not applied:
+                    break
+                total += applied
+            if total:
+                self.stdout.write(f"[Webhooks] applied {total} event(s)")
+            if options['once']:
+                return
+            time.sleep(options['idle_seconds'])
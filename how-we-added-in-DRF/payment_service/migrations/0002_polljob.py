@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment_service', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PollJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('charge', 'Charge'), ('subscription', 'Subscription')], max_length=20)),
+                ('attempt', models.PositiveIntegerField(default=0)),
+                ('next_poll_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('payment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='poll_jobs', to='payment_service.paymenthistory')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['next_poll_at'], name='payment_ser_next_po_c7761d_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 13:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment_service', '0003_processedwebhook'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookInboxEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('charge', 'Charge'), ('subscription', 'Subscription'), ('refund', 'Refund')], max_length=20)),
+                ('univapay_id', models.UUIDField(blank=True, null=True)),
+                ('event_type', models.CharField(blank=True, default='', max_length=100)),
+                ('payload', models.JSONField()),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['processed_at', 'id'], name='payment_ser_process_5531ec_idx')],
+            },
+        ),
+    ]
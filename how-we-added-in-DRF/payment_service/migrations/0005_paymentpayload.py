@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-17 13:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def copy_raw_json_to_payload(apps, schema_editor):
+    PaymentHistory = apps.get_model('payment_service', 'PaymentHistory')
+    PaymentPayload = apps.get_model('payment_service', 'PaymentPayload')
+    batch = []
+    for payment_id, raw_json in PaymentHistory.objects.values_list('id', 'raw_json').iterator(chunk_size=1000):
+        batch.append(PaymentPayload(payment_id=payment_id, raw_json=raw_json or {}))
+        if len(batch) >= 1000:
+            PaymentPayload.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        PaymentPayload.objects.bulk_create(batch)
+
+
+def copy_payload_to_raw_json(apps, schema_editor):
+    PaymentHistory = apps.get_model('payment_service', 'PaymentHistory')
+    PaymentPayload = apps.get_model('payment_service', 'PaymentPayload')
+    for payload in PaymentPayload.objects.iterator(chunk_size=1000):
+        PaymentHistory.objects.filter(id=payload.payment_id).update(raw_json=payload.raw_json)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment_service', '0004_webhookinboxevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentPayload',
+            fields=[
+                ('payment', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='payload', serialize=False, to='payment_service.paymenthistory')),
+                ('raw_json', models.JSONField(blank=True, default=dict)),
+            ],
+        ),
+        migrations.RunPython(copy_raw_json_to_payload, copy_payload_to_raw_json),
+        migrations.RemoveField(
+            model_name='paymenthistory',
+            name='raw_json',
+        ),
+    ]
@@ -0,0 +1,91 @@
+# Generated by Django 5.2.18 on 2026-10-17 13:20
+
+import payment_service.fields
+from django.db import migrations, models
+
+COLUMNS = (
+    ('paymentpayload', 'raw_json'),
+    ('transactiontoken', 'raw_token_data'),
+)
+
+
+def _alter_columns(apps, schema_editor, old_field, new_field, using):
+    for model_name, field_name in COLUMNS:
+        model = apps.get_model('payment_service', model_name)
+        if schema_editor.connection.vendor == 'postgresql':
+            # jsonb -> bytea has no implicit cast; existing rows keep their JSON text
+            # as UTF-8 bytes until `univapay_compress_payloads` rewrites them
+            schema_editor.execute(
+                'ALTER TABLE %s ALTER COLUMN %s TYPE %s USING %s' % (
+                    schema_editor.quote_name(model._meta.db_table),
+                    schema_editor.quote_name(field_name),
+                    'bytea' if using == 'to_bytes' else 'jsonb',
+                    ("convert_to(%s::text, 'UTF8')" if using == 'to_bytes' else "convert_from(%s, 'UTF8')::jsonb")
+                    % schema_editor.quote_name(field_name),
+                )
+            )
+            continue
+        old = old_field()
+        old.set_attributes_from_name(field_name)
+        old.model = model
+        new = new_field()
+        new.set_attributes_from_name(field_name)
+        new.model = model
+        schema_editor.alter_field(model, old, new)
+
+
+def to_compressed(apps, schema_editor):
+    _alter_columns(
+        apps, schema_editor,
+        lambda: models.JSONField(blank=True, default=dict),
+        lambda: payment_service.fields.CompressedJSONField(blank=True, default=dict),
+        'to_bytes',
+    )
+
+
+def to_json(apps, schema_editor):
+    # Only valid once compressed rows have been expanded again; refuse otherwise
+    for model_name, field_name in COLUMNS:
+        table = apps.get_model('payment_service', model_name)._meta.db_table
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute('SELECT %s FROM %s' % (
+                schema_editor.quote_name(field_name), schema_editor.quote_name(table)))
+            for (raw,) in cursor.fetchall():
+                if payment_service.fields.is_compressed(raw):
+                    raise RuntimeError(
+                        f'{table}.{field_name} holds compressed rows; '
+                        'run univapay_compress_payloads --expand first'
+                    )
+    _alter_columns(
+        apps, schema_editor,
+        lambda: payment_service.fields.CompressedJSONField(blank=True, default=dict),
+        lambda: models.JSONField(blank=True, default=dict),
+        'to_json',
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment_service', '0005_paymentpayload'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(to_compressed, to_json),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='paymentpayload',
+                    name='raw_json',
+                    field=payment_service.fields.CompressedJSONField(blank=True, default=dict),
+                ),
+                migrations.AlterField(
+                    model_name='transactiontoken',
+                    name='raw_token_data',
+                    field=payment_service.fields.CompressedJSONField(blank=True, default=dict),
+                ),
+            ],
+        ),
+    ]
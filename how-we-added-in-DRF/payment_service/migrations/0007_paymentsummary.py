@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-17 13:30
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+from payment_service.payment_summary import summary_values
+
+
+def build_summaries(apps, schema_editor):
+    PaymentHistory = apps.get_model('payment_service', 'PaymentHistory')
+    PaymentSummary = apps.get_model('payment_service', 'PaymentSummary')
+    batch = [
+        PaymentSummary(user_id=user_id, **fields)
+        for user_id, fields in summary_values(PaymentHistory).items()
+    ]
+    PaymentSummary.objects.bulk_create(batch, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('payment_service', '0006_compress_payloads'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentSummary',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='payment_summary', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('spend_by_currency', models.JSONField(blank=True, default=dict)),
+                ('payments_count', models.IntegerField(default=0)),
+                ('successful_payments', models.IntegerField(default=0)),
+                ('active_subscriptions', models.IntegerField(default=0)),
+                ('last_payment_status', models.CharField(blank=True, default='', max_length=20)),
+                ('last_payment_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('last_payment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='payment_service.paymenthistory')),
+            ],
+            options={
+                'verbose_name_plural': 'Payment Summaries',
+            },
+        ),
+        migrations.RunPython(build_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 14:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment_service', '0008_idempotencyrecord'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webhookinboxevent',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='webhookinboxevent',
+            name='retry_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
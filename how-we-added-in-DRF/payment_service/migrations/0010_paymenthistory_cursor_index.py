@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 14:04
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment_service', '0009_webhookinbox_retry'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='paymenthistory',
+            name='payment_ser_user_id_0ec75a_idx',
+        ),
+        migrations.AddIndex(
+            model_name='paymenthistory',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='payment_ser_user_id_d0193d_idx'),
+        ),
+    ]
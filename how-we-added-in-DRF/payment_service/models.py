@@ -1,6 +1,10 @@
 from django.db import models
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import MinValueValidator
+from django.utils.timezone import now
+
+from .fields import CompressedJSONField
 
 
 class SubscriptionPlan(models.Model):
@@ -78,7 +82,7 @@ class TransactionToken(models.Model):
     mode = models.CharField(max_length=10, default='test')  # test or live
     
     # Raw response from UnivaPay when token was created
-    raw_token_data = models.JSONField(default=dict, blank=True)
+    raw_token_data = CompressedJSONField(default=dict, blank=True)
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -178,8 +182,7 @@ class PaymentHistory(models.Model):
     mode = models.CharField(max_length=10)  # test or live
     created_on = models.DateTimeField(null=True, blank=True)  # CORRECTED to be nullable
     
-    # Raw JSON response - ADDED (was missing)
-    raw_json = models.JSONField(default=dict, blank=True)
+    # Raw JSON response lives in PaymentPayload (payment.payload.raw_json), read only on detail views
 
     # Status field - will be interpreted based on payment_type
     status = models.CharField(max_length=20)
@@ -282,7 +285,7 @@ class PaymentHistory(models.Model):
         verbose_name_plural = "Payment Histories"
         indexes = [
             models.Index(fields=['univapay_id']),
-            models.Index(fields=['user', 'created_at']),
+            models.Index(fields=['user', 'created_at', 'id']),  # unique cursor order for payment history pages
             models.Index(fields=['payment_type', 'status']),
             models.Index(fields=['transaction_token', 'created_at']),  # ADDED index
         ]
@@ -314,4 +317,125 @@ class PaymentHistory(models.Model):
             for code, name in self.RECURRING_STATUS_CHOICES:
                 if code == self.status:
                     return name
-        return self.status
\ No newline at end of file
+        return self.status
+
+class PaymentPayload(models.Model):
+    """Raw UnivaPay response for a payment, kept out of the hot PaymentHistory row"""
+    payment = models.OneToOneField(
+        PaymentHistory, on_delete=models.CASCADE, primary_key=True, related_name='payload'
+    )
+    raw_json = CompressedJSONField(default=dict, blank=True)
+
+    def __str__(self):
+        return f"Payload for payment {self.payment_id}"
+
+class PollJob(models.Model):
+    """Durable status-poll queue, drained by the `univapay_poll_worker` management command"""
+    KIND_CHOICES = [
+        ('charge', 'Charge'),
+        ('subscription', 'Subscription'),
+    ]
+
+    payment = models.ForeignKey(PaymentHistory, on_delete=models.CASCADE, related_name='poll_jobs')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    attempt = models.PositiveIntegerField(default=0)  # polls completed so far
+    next_poll_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['next_poll_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} poll for payment {self.payment_id} (attempt {self.attempt})"
+
+class ProcessedWebhook(models.Model):
+    """
+    One row per accepted webhook delivery; the unique key rejects provider retries.
+    Rows past the retry window are deleted by the `prune_processed_webhooks` command.
+    """
+    dedup_key = models.CharField(max_length=80, unique=True)  # sha256 of the raw body
+    event_type = models.CharField(max_length=100, blank=True, default='')
+    received_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.event_type or 'webhook'} {self.dedup_key[:19]}"
+
+
+class WebhookInboxEvent(models.Model):
+    """Accepted webhook deliveries awaiting the `univapay_webhook_worker` batch applier"""
+    KIND_CHOICES = [
+        ('charge', 'Charge'),
+        ('subscription', 'Subscription'),
+        ('refund', 'Refund'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    univapay_id = models.UUIDField(null=True, blank=True)  # charge/subscription the event is about
+    event_type = models.CharField(max_length=100, blank=True, default='')
+    payload = models.JSONField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)  # batches that found no PaymentHistory row yet
+    retry_at = models.DateTimeField(null=True, blank=True)  # deferred until the charge row commits
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['processed_at', 'id']),
+        ]
+
+    def __str__(self):
+        return f"{self.event_type or self.kind} for {self.univapay_id}"
+
+
+class PaymentSummary(models.Model):
+    """
+    Per-user dashboard totals, kept current in the same transaction as every payment
+    write (see payment_summary.record_transitions), so reads are one primary-key lookup.
+    """
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name='payment_summary'
+    )
+    # Settled one-time charges, {"JPY": "12000.00"} (Decimal strings)
+    spend_by_currency = models.JSONField(default=dict, blank=True)
+    payments_count = models.IntegerField(default=0)
+    successful_payments = models.IntegerField(default=0)
+    active_subscriptions = models.IntegerField(default=0)
+    last_payment = models.ForeignKey(
+        PaymentHistory, on_delete=models.SET_NULL, null=True, blank=True, related_name='+'
+    )
+    last_payment_status = models.CharField(max_length=20, blank=True, default='')
+    last_payment_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = "Payment Summaries"
+
+    def __str__(self):
+        return f"Summary for {self.user}"
+
+
+class IdempotencyRecord(models.Model):
+    """
+    A client-supplied Idempotency-Key claimed by one user, and the response it produced
+    (see idempotency.py); repeats of the request replay the stored response.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64)  # sha256 of the request body
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)  # NULL while in progress
+    response_body = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    claimed_at = models.DateTimeField(default=now)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='uniq_idempotency_user_key'),
+        ]
+        indexes = [
+            models.Index(fields=['claimed_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.key} for {self.user_id} ({self.response_status or 'in progress'})"
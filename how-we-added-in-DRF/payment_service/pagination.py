@@ -0,0 +1,20 @@
+from rest_framework.pagination import CursorPagination
+
+# Constants
+PAYMENT_HISTORY_PAGE_SIZE = 50
+PAYMENT_HISTORY_MAX_PAGE_SIZE = 200
+
+
+class PaymentHistoryCursorPagination(CursorPagination):
+    """
+    Newest-first cursor pages over a user's payments.
+
+    The id tie-breaker makes the ordering unique, so rows sharing a created_at (bulk
+    inserts, coarse clocks) are never skipped or repeated across pages. The
+    (user, created_at, id) index serves both the filter and the sort, so page N costs
+    the same as page 1 (no OFFSET scan).
+    """
+    ordering = ('-created_at', '-id')
+    page_size = PAYMENT_HISTORY_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = PAYMENT_HISTORY_MAX_PAGE_SIZE
@@ -0,0 +1,178 @@
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Q, Sum
+from django.utils.timezone import now
+
+from .models import PaymentHistory, PaymentSummary
+
+# Constants
+SPEND_STATUSES = ('successful', 'partially_refunded')  # one-time charges that count as money spent
+ACTIVE_SUBSCRIPTION_STATUSES = ('current',)
+SUCCESSFUL_STATUSES = {'one_time': ('successful',), 'recurring': ('current',)}  # PaymentHistory.is_successful
+
+CENTS = Decimal('0.01')
+
+# PaymentHistory columns a transition needs (read with select_for_update by the writers)
+SUMMARY_ROW_FIELDS = ('id', 'user_id', 'payment_type', 'status', 'amount', 'currency', 'created_at')
+
+
+def lock_payment_rows(queryset, *extra_fields):
+    """Lock and read the rows a write is about to change, for record_transitions."""
+    return list(queryset.select_for_update().values(*SUMMARY_ROW_FIELDS, *extra_fields))
+
+
+def payment_row(payment):
+    return {name: getattr(payment, name) for name in SUMMARY_ROW_FIELDS}
+
+
+def _money(value):
+    return str(Decimal(value).quantize(CENTS))
+
+
+def _contribution(row, status):
+    """(payments, successful, active_subscriptions, spend currency or None) of one row in `status`."""
+    if status is None:  # row did not exist yet
+        return 0, 0, 0, None
+    payment_type = row['payment_type']
+    successful = int(status in SUCCESSFUL_STATUSES.get(payment_type, ()))
+    active = int(payment_type == 'recurring' and status in ACTIVE_SUBSCRIPTION_STATUSES)
+    spend = row['currency'] if payment_type == 'one_time' and status in SPEND_STATUSES else None
+    return 1, successful, active, spend
+
+
+def summary_values(payment_model=PaymentHistory, user_ids=None):
+    """
+    Full recomputation: {user_id: PaymentSummary field values} from the payment rows.
+    Used for users without a summary row yet, for the 0007 backfill and for repairs.
+    """
+    payments = payment_model.objects.all()
+    if user_ids is not None:
+        payments = payments.filter(user_id__in=user_ids)
+
+    values = {}
+
+    def blank():
+        return {
+            'spend_by_currency': {}, 'payments_count': 0, 'successful_payments': 0,
+            'active_subscriptions': 0, 'last_payment_id': None, 'last_payment_status': '',
+            'last_payment_at': None,
+        }
+
+    successful = Q()
+    for payment_type, statuses in SUCCESSFUL_STATUSES.items():
+        successful |= Q(payment_type=payment_type, status__in=statuses)
+    for row in payments.order_by().values('user_id').annotate(
+        total=Count('id'),
+        successful=Count('id', filter=successful),
+        active=Count('id', filter=Q(payment_type='recurring', status__in=ACTIVE_SUBSCRIPTION_STATUSES)),
+    ):
+        values[row['user_id']] = {
+            **blank(), 'payments_count': row['total'],
+            'successful_payments': row['successful'], 'active_subscriptions': row['active'],
+        }
+
+    for row in (
+        payments.filter(payment_type='one_time', status__in=SPEND_STATUSES)
+        .order_by().values('user_id', 'currency').annotate(total=Sum('amount'))
+    ):
+        values[row['user_id']]['spend_by_currency'][row['currency']] = _money(row['total'])
+
+    # Newest payment per user: served by the (user, created_at) index
+    for user_id, summary in values.items():
+        last = (
+            payments.filter(user_id=user_id).order_by('-created_at', '-id')
+            .values('id', 'status', 'created_at').first()
+        )
+        summary.update(
+            last_payment_id=last['id'], last_payment_status=last['status'], last_payment_at=last['created_at']
+        )
+    return values
+
+
+def record_transitions(transitions):
+    """
+    Fold payment status changes into their owners' PaymentSummary rows.
+
+    `transitions` is an iterable of (row, old_status, new_status): row holds
+    SUMMARY_ROW_FIELDS as they were read under lock, old_status is None for a payment
+    created in this transaction. Must run inside the transaction that wrote the payments,
+    after the write. Summary rows are locked, so concurrent writers for the same user
+    serialize; users without a row get one computed from scratch (which already sees
+    this transaction's writes).
+    """
+    deltas = {}
+    for row, old_status, new_status in transitions:
+        if old_status == new_status:
+            continue
+        delta = deltas.setdefault(row['user_id'], {'counts': [0, 0, 0], 'spend': {}, 'rows': []})
+        before, after = _contribution(row, old_status), _contribution(row, new_status)
+        for i in range(3):
+            delta['counts'][i] += after[i] - before[i]
+        amount = Decimal(row['amount'] or 0)
+        if before[3]:
+            delta['spend'][before[3]] = delta['spend'].get(before[3], Decimal(0)) - amount
+        if after[3]:
+            delta['spend'][after[3]] = delta['spend'].get(after[3], Decimal(0)) + amount
+        delta['rows'].append((row, new_status))
+    if not deltas:
+        return
+
+    with transaction.atomic(savepoint=False):  # joins the writer's transaction
+        summaries = {
+            s.user_id: s for s in PaymentSummary.objects.select_for_update().filter(user_id__in=list(deltas))
+        }
+        missing = [user_id for user_id in deltas if user_id not in summaries]
+        for user_id, fields in (summary_values(user_ids=missing) if missing else {}).items():
+            try:
+                with transaction.atomic():
+                    PaymentSummary.objects.create(user_id=user_id, **fields)
+            except IntegrityError:
+                # Created concurrently from rows that can't include ours yet: apply the delta
+                summaries[user_id] = PaymentSummary.objects.select_for_update().get(user_id=user_id)
+
+        touched_at = now()
+        for user_id, summary in summaries.items():
+            delta = deltas[user_id]
+            summary.updated_at = touched_at
+            summary.payments_count += delta['counts'][0]
+            summary.successful_payments += delta['counts'][1]
+            summary.active_subscriptions += delta['counts'][2]
+            spend = dict(summary.spend_by_currency or {})
+            for currency, change in delta['spend'].items():
+                total = Decimal(spend.get(currency, '0')) + change
+                if total:
+                    spend[currency] = _money(total)
+                else:
+                    spend.pop(currency, None)
+            summary.spend_by_currency = spend
+            for row, new_status in delta['rows']:
+                newest = (summary.last_payment_at, summary.last_payment_id or 0)
+                if row['id'] == summary.last_payment_id or summary.last_payment_at is None or (
+                    (row['created_at'], row['id']) > newest
+                ):
+                    summary.last_payment_id = row['id']
+                    summary.last_payment_status = new_status
+                    summary.last_payment_at = row['created_at']
+
+        PaymentSummary.objects.bulk_update(
+            summaries.values(),
+            ['payments_count', 'successful_payments', 'active_subscriptions', 'spend_by_currency',
+             'last_payment', 'last_payment_status', 'last_payment_at', 'updated_at'],
+        )
+
+
+def record_payment_created(payment):
+    record_transitions([(payment_row(payment), None, payment.status)])
+
+
+def set_payment_status(payment, new_status, update_fields=()):
+    """
+    Save a new status on a payment read with select_for_update (plus any other changed
+    `update_fields`) and fold the transition into the owner's summary. Call inside
+    transaction.atomic().
+    """
+    row = payment_row(payment)
+    payment.status = new_status
+    payment.save(update_fields=['status', *update_fields, 'updated_at'])
+    record_transitions([(row, row['status'], new_status)])
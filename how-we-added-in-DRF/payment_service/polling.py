@@ -0,0 +1,129 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import close_old_connections, transaction
+from django.utils.timezone import now
+
+from .models import PaymentHistory, PollJob
+from .payment_summary import set_payment_status
+from .univapay_client import get_univapay_client
+
+# Constants
+POLL_AFTER_SECONDS = 30
+POLL_RETRY_AFTER_SECONDS = 60
+POLL_BACKOFF_MAX_SECONDS = 3600
+POLL_MAX_ATTEMPTS = 6
+POLL_LEASE_SECONDS = 120  # claim window so concurrent workers skip a job in flight
+ENABLE_POLL_FALLBACK = True
+
+# Statuses that are still worth polling again
+UNSETTLED_STATUSES = {
+    'charge': (None, '', 'pending', 'awaiting'),
+    'subscription': (None, '', 'unverified', 'unconfirmed'),
+}
+
+
+def enqueue_status_poll(kind, payment_id, delay_s=POLL_AFTER_SECONDS):
+    """
+    Queue a durable background poll to refresh provider status.
+    kind: 'charge' | 'subscription'
+    payment_id: PaymentHistory.id
+    delay_s: seconds until the first poll
+    """
+    if not ENABLE_POLL_FALLBACK:
+        return None
+    return PollJob.objects.create(
+        payment_id=payment_id,
+        kind=kind,
+        next_poll_at=now() + timedelta(seconds=delay_s),
+    )
+
+
+def cancel_settled_polls(settled):
+    """
+    Delete queued polls made redundant by a webhook: `settled` yields (kind, payment_id, status).
+    Call in the webhook's transaction, so the worker never spends a provider GET on them.
+    """
+    payment_ids = [payment_id for kind, payment_id, status in settled if status not in UNSETTLED_STATUSES[kind]]
+    if payment_ids:
+        PollJob.objects.filter(payment_id__in=payment_ids).delete()
+
+
+def poll_backoff(attempt):
+    """Exponential backoff after `attempt` completed polls, capped."""
+    return timedelta(seconds=min(POLL_BACKOFF_MAX_SECONDS, POLL_RETRY_AFTER_SECONDS * 2 ** max(0, attempt - 1)))
+
+
+def claim_due_jobs(limit):
+    """Lease up to `limit` due jobs, skipping rows another worker has locked."""
+    current = now()
+    with transaction.atomic():
+        jobs = list(
+            PollJob.objects.select_for_update(skip_locked=True)
+            .filter(next_poll_at__lte=current)
+            .order_by('next_poll_at')[:limit]
+        )
+        if jobs:
+            PollJob.objects.filter(id__in=[j.id for j in jobs]).update(
+                next_poll_at=current + timedelta(seconds=POLL_LEASE_SECONDS)
+            )
+    return jobs
+
+
+def process_poll_job(job, univapay):
+    """Poll UnivaPay once for a claimed job, then reschedule it with backoff or delete it."""
+    close_old_connections()
+    try:
+        payment = PaymentHistory.objects.only('id', 'univapay_id', 'status').get(id=job.payment_id)
+    except PaymentHistory.DoesNotExist:
+        job.delete()
+        return
+
+    settled = False
+    try:
+        if job.kind == 'charge' and payment.univapay_id:
+            data = univapay.get_charge(payment.univapay_id)
+        elif job.kind == 'subscription' and payment.univapay_id:
+            data = univapay.get_subscription(payment.univapay_id)
+        else:
+            job.delete()
+            return
+
+        status_val = (data or {}).get('status')
+        if status_val:
+            # Lock only after the API call; the summary needs the status as of this write
+            with transaction.atomic():
+                locked = PaymentHistory.objects.select_for_update().get(id=payment.id)
+                set_payment_status(locked, status_val)
+        settled = status_val not in UNSETTLED_STATUSES.get(job.kind, ())
+    except Exception as e:
+        print(f"[Poller] Error polling {job.kind} provider_id={job.payment_id}: {e}")
+
+    job.attempt += 1
+    if settled or job.attempt >= POLL_MAX_ATTEMPTS:
+        job.delete()
+    else:
+        # A webhook may have settled the payment (and deleted this job) while we polled
+        PollJob.objects.filter(id=job.id).update(attempt=job.attempt, next_poll_at=now() + poll_backoff(job.attempt))
+
+
+def drain_due_jobs(univapay=None, concurrency=4):
+    """Process every currently due job with at most `concurrency` provider calls in flight."""
+    univapay = univapay or get_univapay_client()
+    processed = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        while True:
+            jobs = claim_due_jobs(concurrency)
+            if not jobs:
+                break
+            list(pool.map(lambda j: process_poll_job(j, univapay), jobs))
+            processed += len(jobs)
+    return processed
+
+
+def seconds_until_next_job(default):
+    """Seconds until the earliest queued job is due, capped at `default`."""
+    nxt = PollJob.objects.order_by('next_poll_at').values_list('next_poll_at', flat=True).first()
+    if nxt is None:
+        return default
+    return max(0.0, min(default, (nxt - now()).total_seconds()))
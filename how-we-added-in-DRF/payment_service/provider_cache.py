@@ -0,0 +1,73 @@
+import time
+
+from django.core.cache import caches
+
+from .polling import UNSETTLED_STATUSES
+from .univapay_client import get_univapay_client
+from .webhook_inbox import webhook_target
+
+# Constants
+PROVIDER_CACHE_ALIAS = 'default'  # point at a shared backend (Redis/Memcached) so every worker sees invalidations
+PROVIDER_CACHE_PREFIX = 'univapay'
+
+# How long a read is served locally, by the status it returned. Terminal objects are kept
+# until a webhook invalidates them; unsettled ones settle within seconds.
+TERMINAL_STATUSES = {
+    'charge': ('successful', 'failed', 'error', 'canceled', 'refunded'),
+    'subscription': ('canceled', 'completed'),
+}
+UNSETTLED_TTL_SECONDS = 5
+DEFAULT_TTL_SECONDS = 60  # live states: authorized, partially_refunded, current, unpaid, suspended
+INVALIDATION_TTL_SECONDS = 300  # outlives any read that was in flight when the webhook arrived
+
+
+def status_ttl(kind, status):
+    """Cache timeout for a provider object in `status` (None = until invalidated)."""
+    if status in TERMINAL_STATUSES.get(kind, ()):
+        return None
+    if status in UNSETTLED_STATUSES.get(kind, ()):
+        return UNSETTLED_TTL_SECONDS
+    return DEFAULT_TTL_SECONDS
+
+
+def _keys(kind, provider_id):
+    key = f'{PROVIDER_CACHE_PREFIX}:{kind}:{str(provider_id).lower()}'
+    return key, f'{key}:invalidated'
+
+
+def get_provider_object(kind, provider_id, univapay=None):
+    """
+    Read-through cache in front of get_charge / get_subscription.
+
+    Entries remember when their fetch started; a webhook for the object deletes the entry
+    and records when it arrived, so a read that raced the webhook is neither stored nor
+    served afterwards.
+    """
+    cache = caches[PROVIDER_CACHE_ALIAS]
+    key, invalidated_key = _keys(kind, provider_id)
+    cached = cache.get_many([key, invalidated_key])
+    entry = cached.get(key)
+    if entry is not None and entry['fetched_at'] > cached.get(invalidated_key, 0):
+        return entry['data']
+
+    started = time.time()
+    univapay = univapay or get_univapay_client()
+    data = univapay.get_charge(provider_id) if kind == 'charge' else univapay.get_subscription(provider_id)
+    status = (data or {}).get('status')
+    if status and cache.get(invalidated_key, 0) < started:
+        cache.set(key, {'fetched_at': started, 'data': data}, status_ttl(kind, status))
+    return data
+
+
+def invalidate_provider_object(kind, provider_id):
+    cache = caches[PROVIDER_CACHE_ALIAS]
+    key, invalidated_key = _keys(kind, provider_id)
+    cache.set(invalidated_key, time.time(), INVALIDATION_TTL_SECONDS)
+    cache.delete(key)
+
+
+def invalidate_for_webhook(data, event_type):
+    """Drop the cached read of whatever object a webhook is about (refunds target their charge)."""
+    target = webhook_target(data, event_type)
+    if target is not None:
+        invalidate_provider_object(*target)
@@ -1,7 +1,7 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
 from django.core.validators import MinValueValidator
-from .models import SubscriptionPlan, TransactionToken, PaymentHistory
+from .models import SubscriptionPlan, TransactionToken, PaymentHistory, PaymentSummary
 
 User = get_user_model()
 
@@ -126,6 +126,7 @@ class PaymentHistorySerializer(serializers.ModelSerializer):
     transaction_token = TransactionTokenSerializer(read_only=True)
     status_display = serializers.CharField(source='get_status_display', read_only=True)
     is_successful = serializers.BooleanField(read_only=True)
+    raw_json = serializers.JSONField(source='payload.raw_json', read_only=True)
     
     class Meta:
         model = PaymentHistory
@@ -152,6 +153,18 @@ class PaymentHistoryListSerializer(serializers.ModelSerializer):
         read_only_fields = fields
 
 
+class PaymentSummarySerializer(serializers.ModelSerializer):
+    """Per-user dashboard totals (one primary-key read)"""
+
+    class Meta:
+        model = PaymentSummary
+        fields = [
+            'spend_by_currency', 'payments_count', 'successful_payments', 'active_subscriptions',
+            'last_payment', 'last_payment_status', 'last_payment_at', 'updated_at'
+        ]
+        read_only_fields = fields
+
+
 class WebhookEventSerializer(serializers.Serializer):
     """Serializer for UnivaPay webhook events"""
     event = serializers.CharField(required=False, allow_blank=True)
@@ -1,3 +1,362 @@
+import uuid
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import IntegrityError, connection, transaction
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from .models import (
+    IdempotencyRecord, PaymentHistory, PaymentPayload, PaymentSummary, PollJob, ProcessedWebhook,
+    SubscriptionPlan, TransactionToken, WebhookInboxEvent,
+)
+from .payment_summary import record_payment_created, summary_values
+from .polling import enqueue_status_poll
+from .provider_cache import PROVIDER_CACHE_ALIAS
+from .univapay_client import UnivapayError
+from .views import PaymentHistoryViewSet, PaymentStatusView, PaymentSummaryView, UnivapayChargeView, WebhookView
+from .webhook_dedup import prune_processed_webhooks
+from .webhook_inbox import apply_pending_webhooks, enqueue_webhook, prune_webhook_inbox
+
+
+class PaymentHistoryListTests(TestCase):
+    """List pages stay one query per page, however deep, and skip detail-only joins."""
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.user = User.objects.create_user(username='buyer', email='buyer@example.com', password='x')
+        other = User.objects.create_user(username='other', email='other@example.com', password='x')
+        token = TransactionToken.objects.create(
+            user=cls.user, univapay_token_id=uuid.uuid4(), token_type='recurring'
+        )
+        plan = SubscriptionPlan.objects.create(name='Monthly', amount=1000, period='monthly')
+
+        base = timezone.now() - timedelta(days=1)
+        for i in range(25):
+            payment = PaymentHistory.objects.create(
+                user=cls.user, payment_type='recurring' if i % 2 else 'one_time',
+                transaction_token=token, subscription_plan=plan if i % 2 else None,
+                univapay_id=uuid.uuid4(), amount=1000, currency='JPY', mode='test',
+                status='current' if i % 2 else 'successful',
+            )
+            PaymentPayload.objects.create(payment=payment, raw_json={'id': str(payment.univapay_id)})
+            # Pairs of rows share a timestamp, so cursor pages must split ties correctly
+            PaymentHistory.objects.filter(pk=payment.pk).update(created_at=base + timedelta(seconds=i // 2))
+        PaymentHistory.objects.create(
+            user=other, payment_type='one_time', amount=500, currency='JPY', mode='test', status='pending'
+        )
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+
+    def _get(self, action, url, **kwargs):
+        request = self.factory.get(url)
+        force_authenticate(request, user=self.user)
+        view = PaymentHistoryViewSet.as_view({'get': action})
+        with CaptureQueriesContext(connection) as queries:
+            response = view(request, **kwargs)
+            response.render()
+        return response, queries
+
+    def test_list_page_is_one_query_without_detail_joins(self):
+        response, queries = self._get('list', '/payment-history/?page_size=10')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 10)
+        self.assertEqual(len(queries), 1)
+        sql = queries[0]['sql']
+        for table in (TransactionToken, SubscriptionPlan, PaymentPayload):
+            self.assertNotIn(table._meta.db_table, sql)
+        self.assertNotIn('error_message', sql)
+        self.assertNotIn('OFFSET', sql.upper())
+
+    def test_cursor_pages_cover_every_row_once_newest_first(self):
+        seen = []
+        url = '/payment-history/?page_size=4'
+        while url:
+            response, queries = self._get('list', url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(queries), 1)
+            seen.extend(row['id'] for row in response.data['results'])
+            url = response.data['next']
+
+        expected = list(
+            PaymentHistory.objects.filter(user=self.user).order_by('-created_at', '-pk').values_list('id', flat=True)
+        )
+        # (created_at, id) is unique: every row once, ties included, in exactly that order
+        self.assertEqual(len(seen), 25)
+        self.assertEqual(seen, expected)
+
+    def test_retrieve_is_one_query(self):
+        payment = PaymentHistory.objects.filter(user=self.user).first()
+        response, queries = self._get('retrieve', f'/payment-history/{payment.pk}/', pk=payment.pk)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['raw_json'], {'id': str(payment.univapay_id)})
+        self.assertEqual(len(queries), 1)
+
+
+class PaymentSummaryTests(TestCase):
+    """The incrementally maintained summary always equals a full recomputation."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='payer', email='payer@example.com', password='x')
+
+    def _create(self, payment_type, status, amount, currency='JPY'):
+        with transaction.atomic():
+            payment = PaymentHistory.objects.create(
+                user=self.user, payment_type=payment_type, univapay_id=uuid.uuid4(),
+                amount=amount, currency=currency, mode='test', status=status,
+            )
+            record_payment_created(payment)
+        return payment
+
+    def _summary(self):
+        summary = PaymentSummary.objects.get(pk=self.user.pk)
+        return {
+            'spend_by_currency': summary.spend_by_currency,
+            'payments_count': summary.payments_count,
+            'successful_payments': summary.successful_payments,
+            'active_subscriptions': summary.active_subscriptions,
+            'last_payment_id': summary.last_payment_id,
+            'last_payment_status': summary.last_payment_status,
+            'last_payment_at': summary.last_payment_at,
+        }
+
+    def test_transitions_match_recomputation(self):
+        first = self._create('one_time', 'pending', 1000)
+        second = self._create('one_time', 'pending', 2500)
+        usd = self._create('one_time', 'pending', 12, currency='USD')
+        sub = self._create('recurring', 'unverified', 980)
+
+        # Batched webhook application; the later of two equal-rank events wins (second -> failed)
+        for payment, status in ((first, 'successful'), (second, 'successful'), (usd, 'successful'), (second, 'failed')):
+            enqueue_webhook({'event': 'charge.finished', 'data': {'id': str(payment.univapay_id), 'status': status}},
+                            'charge.finished')
+        enqueue_webhook({'event': 'subscription.updated', 'data': {'id': str(sub.univapay_id), 'status': 'current'}},
+                        'subscription.updated')
+        apply_pending_webhooks()
+
+        expected = summary_values(user_ids=[self.user.pk])[self.user.pk]
+        self.assertEqual(self._summary(), expected)
+        self.assertEqual(expected['spend_by_currency'], {'JPY': '1000.00', 'USD': '12.00'})
+        self.assertEqual(expected['active_subscriptions'], 1)
+
+        # Inline refunds: partial keeps the spend, full removes it
+        with transaction.atomic():
+            WebhookView()._handle_refund_event({'charge_id': str(first.univapay_id), 'amount': 100})
+            WebhookView()._handle_refund_event({'charge_id': str(usd.univapay_id)})
+        expected = summary_values(user_ids=[self.user.pk])[self.user.pk]
+        self.assertEqual(self._summary(), expected)
+        self.assertEqual(expected['spend_by_currency'], {'JPY': '1000.00'})
+        self.assertEqual(expected['last_payment_id'], sub.pk)
+
+    def test_summary_endpoint_is_one_primary_key_read(self):
+        self._create('one_time', 'successful', 1000)
+        request = APIRequestFactory().get('/payment-summary/')
+        force_authenticate(request, user=self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = PaymentSummaryView.as_view()(request)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['spend_by_currency'], {'JPY': '1000.00'})
+        self.assertEqual(len(queries), 1)
+
+
+class ProviderStatusCacheTests(TestCase):
+    """Status checks are served locally until the object's webhook arrives."""
+
+    def setUp(self):
+        caches[PROVIDER_CACHE_ALIAS].clear()
+        self.user = get_user_model().objects.create_user(username='checker', email='checker@example.com', password='x')
+        self.charge_id = uuid.uuid4()
+        self.univapay = mock.Mock()
+        patcher = mock.patch('payment_service.provider_cache.get_univapay_client', return_value=self.univapay)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _check(self):
+        request = APIRequestFactory().post(
+            '/payment-status/', {'payment_id': str(self.charge_id), 'payment_type': 'charge'}, format='json'
+        )
+        force_authenticate(request, user=self.user)
+        response = PaymentStatusView.as_view()(request)
+        self.assertEqual(response.status_code, 200)
+        return response.data['univapay']['status']
+
+    def _webhook(self, status):
+        request = APIRequestFactory().post(
+            '/webhook/', {'event': 'charge.updated', 'data': {'id': str(self.charge_id), 'status': status}}, format='json'
+        )
+        WebhookView.as_view()(request)
+
+    def test_terminal_status_is_cached_until_webhook(self):
+        self.univapay.get_charge.return_value = {'id': str(self.charge_id), 'status': 'successful'}
+        self.assertEqual([self._check() for _ in range(3)], ['successful'] * 3)
+        self.assertEqual(self.univapay.get_charge.call_count, 1)
+
+        self.univapay.get_charge.return_value = {'id': str(self.charge_id), 'status': 'refunded'}
+        self._webhook('refunded')
+        self.assertEqual(self._check(), 'refunded')
+        self.assertEqual(self.univapay.get_charge.call_count, 2)
+
+    def test_unsettled_status_expires_quickly(self):
+        self.univapay.get_charge.return_value = {'id': str(self.charge_id), 'status': 'pending'}
+        with mock.patch('payment_service.provider_cache.UNSETTLED_TTL_SECONDS', 0):
+            self._check()
+            self._check()
+        self.assertEqual(self.univapay.get_charge.call_count, 2)
+
+
+class WebhookRetryTests(TestCase):
+    def setUp(self):
+        self.charge_id = uuid.uuid4()
+
+    def _deliver(self):
+        request = APIRequestFactory().post(
+            '/webhook/', {'event': 'charge.finished', 'data': {'id': str(self.charge_id), 'status': 'successful'}},
+            format='json',
+        )
+        return WebhookView.as_view()(request)
+
+    def test_failed_delivery_is_redelivered(self):
+        with mock.patch('payment_service.views.enqueue_webhook', side_effect=RuntimeError('db down')):
+            self.assertEqual(self._deliver().status_code, 500)
+        # The claim was rolled back, so the provider's retry of the same body is processed
+        response = self._deliver()
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('duplicate', response.data)
+        self.assertTrue(self._deliver().data.get('duplicate'))
+
+    def test_prune_keeps_keys_inside_the_retry_window(self):
+        self._deliver()
+        ProcessedWebhook.objects.create(dedup_key='sha256:old', event_type='charge.finished')
+        ProcessedWebhook.objects.filter(dedup_key='sha256:old').update(received_at=timezone.now() - timedelta(days=8))
+
+        self.assertEqual(prune_processed_webhooks(), 1)
+        self.assertTrue(self._deliver().data.get('duplicate'))
+
+
+class WebhookInboxTests(TestCase):
+    """The batch applier folds queued events without letting stale ones win."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='settled', email='settled@example.com', password='x')
+
+    def _create(self, status, **fields):
+        with transaction.atomic():
+            payment = PaymentHistory.objects.create(
+                user=self.user, payment_type='one_time', univapay_id=uuid.uuid4(),
+                amount=1000, currency='JPY', mode='test', status=status, **fields,
+            )
+            record_payment_created(payment)
+        return payment
+
+    def _charge_event(self, payment, status, **data):
+        enqueue_webhook({'event': 'charge.updated', 'data': {'id': str(payment.univapay_id), 'status': status, **data}},
+                        'charge.updated')
+
+    def test_stale_event_leaves_settled_row_unchanged(self):
+        payment = self._create('successful', charged_amount=1000, charged_currency='JPY')
+        self._charge_event(payment, 'pending', charged_amount=1, charged_currency='USD',
+                           error={'code': 'E1', 'message': 'declined', 'detail': 'old failure'})
+        apply_pending_webhooks()
+
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'successful')
+        self.assertEqual((payment.charged_amount, payment.charged_currency), (1000, 'JPY'))
+        self.assertIsNone(payment.error_message)
+
+    def test_event_before_its_payment_row_stays_pending(self):
+        payment = PaymentHistory(
+            user=self.user, payment_type='one_time', univapay_id=uuid.uuid4(),
+            amount=1000, currency='JPY', mode='test', status='pending',
+        )
+        self._charge_event(payment, 'successful')
+        apply_pending_webhooks()
+        event = WebhookInboxEvent.objects.get()
+        self.assertIsNone(event.processed_at)
+        self.assertEqual(event.attempts, 1)
+
+        # The charge row commits; the deferred event applies once its retry is due
+        with transaction.atomic():
+            payment.save()
+            record_payment_created(payment)
+        WebhookInboxEvent.objects.update(retry_at=timezone.now())
+        apply_pending_webhooks()
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'successful')
+        self.assertIsNotNone(WebhookInboxEvent.objects.get().processed_at)
+
+        self.assertEqual(prune_webhook_inbox(timedelta(0)), 1)
+        self.assertFalse(WebhookInboxEvent.objects.exists())
+
+    def test_settling_webhook_drops_the_queued_poll(self):
+        settled, waiting = self._create('pending'), self._create('pending')
+        refunded = self._create('successful')
+        for payment in (settled, waiting, refunded):
+            enqueue_status_poll('charge', payment.pk)
+        self._charge_event(settled, 'successful')
+        self._charge_event(waiting, 'awaiting')
+        apply_pending_webhooks()
+        with transaction.atomic():
+            WebhookView()._handle_refund_event({'charge_id': str(refunded.univapay_id)})
+
+        self.assertEqual(list(PollJob.objects.values_list('payment_id', flat=True)), [waiting.pk])
+
+
+class ChargeIdempotencyTests(TestCase):
+    """A repeated Idempotency-Key replays the first response instead of charging again."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='clicker', email='clicker@example.com', password='x')
+        self.univapay = mock.Mock()
+        self.univapay.create_charge.side_effect = lambda **kwargs: {
+            'id': str(uuid.uuid4()), 'status': 'pending', 'requested_amount': kwargs['amount'],
+            'requested_currency': kwargs['currency'], 'mode': 'test', 'only_direct_currency': False,
+        }
+        patcher = mock.patch('payment_service.views.get_univapay_client', return_value=self.univapay)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.body = {'transaction_token_id': str(uuid.uuid4()), 'amount': 1200, 'currency': 'JPY'}
+
+    def _charge(self, body, key):
+        request = APIRequestFactory().post('/univapay/charge/', body, format='json', HTTP_IDEMPOTENCY_KEY=key)
+        force_authenticate(request, user=self.user)
+        return UnivapayChargeView.as_view()(request)
+
+    def test_repeat_is_replayed_without_provider_call(self):
+        first = self._charge(self.body, 'click-1')
+        second = self._charge(self.body, 'click-1')
+
+        self.assertEqual((first.status_code, second.status_code), (201, 201))
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(second.data['univapay']['charge_id'], first.data['univapay']['charge_id'])
+        self.assertEqual(self.univapay.create_charge.call_count, 1)
+        self.assertEqual(PaymentHistory.objects.filter(user=self.user).count(), 1)
+        # The provider gets a key derived from (user, client key), so its own dedup agrees with ours
+        sent_key = self.univapay.create_charge.call_args.kwargs['idempotency_key']
+        self.assertEqual(str(uuid.UUID(sent_key)), sent_key)
+
+    def test_key_reuse_with_different_body_is_rejected(self):
+        self._charge(self.body, 'click-2')
+        response = self._charge({**self.body, 'amount': 9999}, 'click-2')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(self.univapay.create_charge.call_count, 1)
+
+    def test_transient_failure_releases_the_key(self):
+        self.univapay.create_charge.side_effect = UnivapayError(503, 'unavailable')
+        self.assertEqual(self._charge(self.body, 'click-3').status_code, 400)
+        self.assertFalse(IdempotencyRecord.objects.filter(key='click-3').exists())
 
-# Create your tests here.
+    def test_key_released_during_claim_is_a_conflict(self):
+        # Our insert lost to a holder that then released the key before we could read its row
+        with mock.patch('payment_service.idempotency.IdempotencyRecord.objects.create', side_effect=IntegrityError):
+            response = self._charge(self.body, 'click-4')
+        self.assertEqual(response.status_code, 409)
+        self.univapay.create_charge.assert_not_called()
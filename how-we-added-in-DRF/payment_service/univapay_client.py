@@ -1,7 +1,12 @@
 import uuid
 import requests
 import os
+import threading
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .inprocess import SingleFlight
 
 # Load .env file
 load_dotenv()
@@ -12,6 +17,13 @@ UNIVAPAY_WEBHOOK_AUTH = os.getenv('UNIVAPAY_WEBHOOK_AUTH', '')
 UNIVAPAY_STORE_ID = os.getenv('UNIVAPAY_STORE_ID', '')
 UNIVAPAY_BASE_URL = os.getenv('UNIVAPAY_BASE_URL', 'https://api.univapay.com')
 
+# Connection pool / timeouts / retries
+UNIVAPAY_POOL_SIZE = int(os.getenv('UNIVAPAY_POOL_SIZE', '20'))
+UNIVAPAY_CONNECT_TIMEOUT = float(os.getenv('UNIVAPAY_CONNECT_TIMEOUT', '3.05'))
+UNIVAPAY_READ_TIMEOUT = float(os.getenv('UNIVAPAY_READ_TIMEOUT', '10'))         # status lookups
+UNIVAPAY_WRITE_TIMEOUT = float(os.getenv('UNIVAPAY_WRITE_TIMEOUT', '30'))       # charges, subscriptions, refunds
+UNIVAPAY_RETRIES = int(os.getenv('UNIVAPAY_RETRIES', '2'))
+
 
 class UnivapayError(Exception):
     def __init__(self, status, body):
@@ -20,8 +32,33 @@ class UnivapayError(Exception):
         super().__init__(f"Univapay API error: {status} - {body}")
 
 
+def _build_session():
+    """
+    One pooled Session per process: keep-alive connections are reused across requests,
+    so calls after the first skip the TCP+TLS handshake.
+    Connection failures are retried for every method (nothing was sent yet); 429/5xx
+    responses are only retried for reads, honouring Retry-After.
+    """
+    retry = Retry(
+        total=UNIVAPAY_RETRIES,
+        connect=UNIVAPAY_RETRIES,
+        read=UNIVAPAY_RETRIES,
+        status=UNIVAPAY_RETRIES,
+        backoff_factor=0.4,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset({'GET'}),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=UNIVAPAY_POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
 class UnivapayClient:
-    def __init__(self):
+    def __init__(self, session=None):
         self.base_url = UNIVAPAY_BASE_URL
         self.secret_key = UNIVAPAY_APP_SECRET
         self.jwt_token = UNIVAPAY_APP_TOKEN
@@ -35,11 +72,20 @@ class UnivapayClient:
             'Authorization': self.auth_header,
             'Content-Type': 'application/json',
         }
+        self.session = session or _build_session()
+        # PaymentStatusView, the poller and user refreshes often ask for the same charge at once
+        self.single_flight = SingleFlight()
 
     @staticmethod
     def new_idempotency_key():
         return str(uuid.uuid4())
 
+    @staticmethod
+    def _timeout_for(method):
+        """(connect, read) timeout: status lookups fail fast, writes get time for the acquirer."""
+        read = UNIVAPAY_READ_TIMEOUT if method == 'GET' else UNIVAPAY_WRITE_TIMEOUT
+        return (UNIVAPAY_CONNECT_TIMEOUT, read)
+
     def _request(self, method, endpoint, data=None, idempotency_key=None):
         url = f"{self.base_url}{endpoint}"
         headers = self.headers.copy()
@@ -47,15 +93,24 @@ class UnivapayClient:
         if idempotency_key:
             headers['Idempotency-Key'] = idempotency_key
 
+        method = method.upper()
+        if method == 'GET':
+            key = (url, tuple(sorted((k, str(v)) for k, v in (data or {}).items())))
+            return self.single_flight.do(key, lambda: self._send(method, url, headers, data))
+        return self._send(method, url, headers, data)
+
+    def _send(self, method, url, headers, data):
+        timeout = self._timeout_for(method)
+
         try:
-            if method.upper() == 'GET':
-                response = requests.get(url, headers=headers, params=data)
-            elif method.upper() == 'POST':
-                response = requests.post(url, headers=headers, json=data)
-            elif method.upper() == 'PUT':
-                response = requests.put(url, headers=headers, json=data)
-            elif method.upper() == 'DELETE':
-                response = requests.delete(url, headers=headers)
+            if method == 'GET':
+                response = self.session.get(url, headers=headers, params=data, timeout=timeout)
+            elif method == 'POST':
+                response = self.session.post(url, headers=headers, json=data, timeout=timeout)
+            elif method == 'PUT':
+                response = self.session.put(url, headers=headers, json=data, timeout=timeout)
+            elif method == 'DELETE':
+                response = self.session.delete(url, headers=headers, timeout=timeout)
             else:
                 raise ValueError(f"Unsupported HTTP method: {method}")
 
@@ -167,4 +222,18 @@ class UnivapayClient:
             data["reason"] = reason
         if metadata:
             data["metadata"] = metadata
-        return self._request('POST', endpoint, data, idempotency_key)
\ No newline at end of file
+        return self._request('POST', endpoint, data, idempotency_key)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_univapay_client():
+    """Process-wide UnivapayClient (and its pooled Session), built on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = UnivapayClient()
+    return _client
@@ -10,6 +10,7 @@ from .views import (
     CancelSubscriptionView,
     RefundChargeView,
     PaymentStatusView,
+    PaymentSummaryView,
     WebhookView,
 )
 
@@ -30,6 +31,9 @@ urlpatterns = [
     path('univapay/cancel-subscription/', CancelSubscriptionView.as_view(), name='univapay-cancel-subscription'),
     path('univapay/refund-charge/', RefundChargeView.as_view(), name='univapay-refund-charge'),
     path('univapay/payment-status/', PaymentStatusView.as_view(), name='univapay-payment-status'),
+
+    # Per-user totals
+    path('payment-summary/', PaymentSummaryView.as_view(), name='payment-summary'),
     
     # Webhook
     path('webhook/univapay/', WebhookView.as_view(), name='univapay-webhook'),
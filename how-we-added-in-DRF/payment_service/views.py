@@ -1,7 +1,5 @@
 import os
 import json
-import threading
-import time
 import hmac
 import hashlib
 from datetime import datetime
@@ -17,11 +15,13 @@ from rest_framework.authentication import SessionAuthentication, TokenAuthentica
 
 from django.conf import settings
 from django.db import transaction
+from django.db.models import Case, Value, When
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 
-from .models import SubscriptionPlan, PaymentHistory, TransactionToken
+from .models import SubscriptionPlan, PaymentHistory, PaymentPayload, PaymentSummary, TransactionToken
 from .serializers import (
     SubscriptionPlanSerializer,
     PurchaseSerializer, 
@@ -30,6 +30,7 @@ from .serializers import (
     UnivapaySubscriptionSerializer, 
     PaymentHistorySerializer,
     PaymentHistoryListSerializer,
+    PaymentSummarySerializer,
     WebhookEventSerializer,
     WebhookChargeSerializer,
     WebhookSubscriptionSerializer,
@@ -39,12 +40,26 @@ from .serializers import (
     CreateTransactionTokenSerializer,
     TransactionTokenSerializer
 )
-from .univapay_client import UnivapayClient, UnivapayError, UNIVAPAY_WEBHOOK_AUTH
-
-# Constants
-POLL_AFTER_SECONDS = 30
-POLL_RETRY_AFTER_SECONDS = 60
-ENABLE_POLL_FALLBACK = True
+from .univapay_client import get_univapay_client, UnivapayError, UNIVAPAY_WEBHOOK_AUTH
+from .polling import cancel_settled_polls, enqueue_status_poll, ENABLE_POLL_FALLBACK, POLL_AFTER_SECONDS
+from .export import CONTENT_TYPES, EXPORT_FORMATS, export_lines, export_rows
+from .idempotency import IDEMPOTENCY_HEADER, IdempotencyError, IdempotentRequest
+from .pagination import PaymentHistoryCursorPagination
+from .provider_cache import get_provider_object, invalidate_for_webhook
+from .payment_summary import (
+    lock_payment_rows,
+    record_payment_created,
+    record_transitions,
+    set_payment_status,
+)
+from .webhook_dedup import claim_webhook, webhook_dedup_key
+from .webhook_inbox import (
+    ENABLE_WEBHOOK_INBOX,
+    charge_event_fields,
+    enqueue_webhook,
+    refund_status,
+    subscription_event_fields,
+)
 
 
 # Helper functions
@@ -103,47 +118,6 @@ def parse_datetime(dt_string):
         return None
 
 
-def _poll_provider_status_later(kind, provider_id, delay_s, retry=False):
-    """
-    Schedule a one-off background poll to refresh provider status.
-    kind: 'charge' | 'subscription'
-    provider_id: PaymentHistory.id
-    delay_s: seconds to wait
-    retry: whether this is the second attempt
-    """
-    if not ENABLE_POLL_FALLBACK:
-        return
-
-    def _task():
-        time.sleep(delay_s)
-        try:
-            payment = PaymentHistory.objects.get(id=provider_id)
-            univapay = UnivapayClient()
-
-            if kind == "charge" and payment.univapay_id:
-                data = univapay.get_charge(payment.univapay_id)
-            elif kind == "subscription" and payment.univapay_id:
-                data = univapay.get_subscription(payment.univapay_id)
-            else:
-                return
-
-            status_val = (data or {}).get("status")
-            if status_val:
-                payment.status = status_val
-                payment.save(update_fields=['status', 'updated_at'])
-
-                # Optional: second attempt if still "pending/awaiting" for charges
-                if not retry and kind == "charge" and status_val in ("pending", "awaiting"):
-                    _poll_provider_status_later(kind, provider_id, POLL_RETRY_AFTER_SECONDS, retry=True)
-
-        except Exception as e:
-            print(f"[Poller] Error polling {kind} provider_id={provider_id}: {e}")
-
-    thread = threading.Thread(target=_task)
-    thread.daemon = True
-    thread.start()
-
-
 # Widget Configuration Endpoint
 class WidgetConfigView(APIView):
     """
@@ -179,20 +153,67 @@ class PaymentHistoryViewSet(viewsets.ReadOnlyModelViewSet):
     """
     serializer_class = PaymentHistoryListSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = PaymentHistoryCursorPagination
+
+    # Columns PaymentHistoryListSerializer reads; everything else stays on disk for list pages
+    list_fields = (
+        'id', 'user__email', 'payment_type', 'amount', 'currency',
+        'status', 'mode', 'univapay_id', 'created_at',
+    )
 
     def get_queryset(self):
-        return PaymentHistory.objects.filter(
-            user=self.request.user
-        ).select_related(
-            'transaction_token',
-            'subscription_plan'
-        ).order_by('-created_at')
+        queryset = PaymentHistory.objects.filter(user=self.request.user).order_by('-created_at', '-id')
+        if self.action == 'list':
+            return queryset.select_related('user').only(*self.list_fields)
+        return queryset.select_related(
+            'user',
+            'transaction_token__user',  # TransactionTokenSerializer nests the token's user
+            'subscription_plan',
+            'payload'
+        )
 
     def get_serializer_class(self):
         if self.action == 'retrieve':
             return PaymentHistorySerializer
         return PaymentHistoryListSerializer
 
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """
+        Stream payment history as CSV (default) or NDJSON: ?fmt=csv|ndjson.
+        Staff can pass ?all=1 to export every user's payments.
+        """
+        export_format = request.query_params.get('fmt', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            return Response(
+                {'error': f"fmt must be one of {', '.join(EXPORT_FORMATS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        queryset = PaymentHistory.objects.all()
+        if not (request.user.is_staff and request.query_params.get('all') in ('1', 'true')):
+            queryset = queryset.filter(user=request.user)
+
+        response = StreamingHttpResponse(
+            export_lines(export_rows(queryset), export_format),
+            content_type=CONTENT_TYPES[export_format]
+        )
+        stamp = timezone.now().strftime('%Y%m%d-%H%M%S')
+        response['Content-Disposition'] = f'attachment; filename="payment-history-{stamp}.{export_format}"'
+        return response
+
+
+class PaymentSummaryView(APIView):
+    """
+    API endpoint for the current user's payment totals, maintained on every payment write.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        # Primary-key read; users with no payments yet get an all-zero summary
+        summary = PaymentSummary.objects.filter(pk=request.user.pk).first() or PaymentSummary(user=request.user)
+        return Response(PaymentSummarySerializer(summary).data)
+
 
 # Transaction Token Views
 class TransactionTokenViewSet(viewsets.ModelViewSet):
@@ -316,16 +337,18 @@ class PurchaseView(APIView):
             amount = serializer.validated_data['amount']
 
             # Create a local payment record
-            payment = PaymentHistory.objects.create(
-                user=request.user,
-                payment_type='one_time',
-                amount=amount,
-                currency='JPY',
-                status='pending',
-                mode='test' if settings.DEBUG else 'live',
-                created_on=now(),
-                metadata={'item_name': item_name}
-            )
+            with transaction.atomic():
+                payment = PaymentHistory.objects.create(
+                    user=request.user,
+                    payment_type='one_time',
+                    amount=amount,
+                    currency='JPY',
+                    status='pending',
+                    mode='test' if settings.DEBUG else 'live',
+                    created_on=now(),
+                    metadata={'item_name': item_name}
+                )
+                record_payment_created(payment)
 
             return Response({
                 'ok': True,
@@ -350,18 +373,20 @@ class SubscribeView(APIView):
             subscription_plan = get_object_or_404(SubscriptionPlan, id=plan_id, is_active=True)
 
             # Create a local subscription record
-            payment = PaymentHistory.objects.create(
-                user=request.user,
-                payment_type='recurring',
-                subscription_plan=subscription_plan,
-                amount=subscription_plan.amount,
-                currency=subscription_plan.currency,
-                period=subscription_plan.period,
-                status='unverified',
-                mode='test' if settings.DEBUG else 'live',
-                created_on=now(),
-                metadata={'plan': subscription_plan.name}
-            )
+            with transaction.atomic():
+                payment = PaymentHistory.objects.create(
+                    user=request.user,
+                    payment_type='recurring',
+                    subscription_plan=subscription_plan,
+                    amount=subscription_plan.amount,
+                    currency=subscription_plan.currency,
+                    period=subscription_plan.period,
+                    status='unverified',
+                    mode='test' if settings.DEBUG else 'live',
+                    created_on=now(),
+                    metadata={'plan': subscription_plan.name}
+                )
+                record_payment_created(payment)
 
             return Response({
                 'ok': True,
@@ -381,6 +406,19 @@ class UnivapayChargeView(APIView):
     def post(self, request):
         serializer = UnivapayChargeSerializer(data=request.data)
         if serializer.is_valid():
+            # Optional client Idempotency-Key: a repeat (double click, client retry) replays the
+            # first response without another provider call or payment row
+            idem = None
+            client_key = request.headers.get(IDEMPOTENCY_HEADER, '').strip()
+            if client_key:
+                try:
+                    idem = IdempotentRequest.begin(request.user, client_key, request.data)
+                except IdempotencyError as e:
+                    return Response({'error': str(e)}, status=e.status)
+                if idem.replay is not None:
+                    status_code, body = idem.replay
+                    return Response(body, status=status_code, headers={'Idempotent-Replayed': 'true'})
+
             try:
                 token_id = _coerce_token_id(serializer.validated_data['transaction_token_id'])
                 amount = serializer.validated_data['amount']
@@ -400,8 +438,8 @@ class UnivapayChargeView(APIView):
                     # Token doesn't exist in our DB, but we can still proceed with the charge
                     pass
                 
-                univapay = UnivapayClient()
-                idem_key = univapay.new_idempotency_key()
+                univapay = get_univapay_client()
+                idem_key = idem.provider_key if idem else univapay.new_idempotency_key()
 
                 # Create charge with Univapay
                 resp = univapay.create_charge(
@@ -421,69 +459,84 @@ class UnivapayChargeView(APIView):
                 error_data = resp.get('error') or {}
 
                 # Create local payment record with TransactionToken link
-                payment = PaymentHistory.objects.create(
-                    user=request.user,
-                    payment_type='one_time',
-                    transaction_token=token_record,  # Link the token if it exists
-                    univapay_id=resp.get('id'),
-                    store_id=resp.get('store_id'),
-                    univapay_transaction_token_id=resp.get('transaction_token_id'),
-                    transaction_token_type=resp.get('transaction_token_type'),
-                    subscription_id=resp.get('subscription_id'),
-                    merchant_transaction_id=resp.get('merchant_transaction_id'),
-                    requested_amount=resp.get('requested_amount'),
-                    requested_currency=resp.get('requested_currency'),
-                    requested_amount_formatted=resp.get('requested_amount_formatted'),
-                    charged_amount=resp.get('charged_amount'),
-                    charged_currency=resp.get('charged_currency'),
-                    charged_amount_formatted=resp.get('charged_amount_formatted'),
-                    fee_amount=resp.get('fee_amount'),
-                    fee_currency=resp.get('fee_currency'),
-                    fee_amount_formatted=resp.get('fee_amount_formatted'),
-                    amount=resp.get('charged_amount') or resp.get('requested_amount') or amount,
-                    currency=resp.get('charged_currency') or resp.get('requested_currency') or currency,
-                    amount_formatted=resp.get('charged_amount_formatted') or resp.get('requested_amount_formatted'),
-                    only_direct_currency=resp.get('only_direct_currency'),
-                    capture_at=parse_datetime(resp.get('capture_at')),
-                    descriptor=resp.get('descriptor'),
-                    descriptor_phone_number=resp.get('descriptor_phone_number'),
-                    status=resp.get('status', 'pending'),
-                    error_code=error_data.get('code'),
-                    error_message=error_data.get('message'),
-                    error_detail=error_data.get('detail'),
-                    metadata=resp.get('metadata', {}),
-                    mode=resp.get('mode', 'test'),
-                    created_on=parse_datetime(resp.get('created_on')) or now(),
-                    redirect_endpoint=resp.get('redirect', {}).get('endpoint') if resp.get('redirect') else None,
-                    redirect_id=resp.get('redirect', {}).get('redirect_id') if resp.get('redirect') else None,
-                    three_ds_redirect_endpoint=resp.get('three_ds', {}).get('redirect_endpoint') if resp.get('three_ds') else None,
-                    three_ds_redirect_id=resp.get('three_ds', {}).get('redirect_id') if resp.get('three_ds') else None,
-                    three_ds_mode=resp.get('three_ds', {}).get('mode') if resp.get('three_ds') else None,
-                    raw_json=resp
-                )
+                with transaction.atomic():
+                    payment = PaymentHistory.objects.create(
+                        user=request.user,
+                        payment_type='one_time',
+                        transaction_token=token_record,  # Link the token if it exists
+                        univapay_id=resp.get('id'),
+                        store_id=resp.get('store_id'),
+                        univapay_transaction_token_id=resp.get('transaction_token_id'),
+                        transaction_token_type=resp.get('transaction_token_type'),
+                        subscription_id=resp.get('subscription_id'),
+                        merchant_transaction_id=resp.get('merchant_transaction_id'),
+                        requested_amount=resp.get('requested_amount'),
+                        requested_currency=resp.get('requested_currency'),
+                        requested_amount_formatted=resp.get('requested_amount_formatted'),
+                        charged_amount=resp.get('charged_amount'),
+                        charged_currency=resp.get('charged_currency'),
+                        charged_amount_formatted=resp.get('charged_amount_formatted'),
+                        fee_amount=resp.get('fee_amount'),
+                        fee_currency=resp.get('fee_currency'),
+                        fee_amount_formatted=resp.get('fee_amount_formatted'),
+                        amount=resp.get('charged_amount') or resp.get('requested_amount') or amount,
+                        currency=resp.get('charged_currency') or resp.get('requested_currency') or currency,
+                        amount_formatted=resp.get('charged_amount_formatted') or resp.get('requested_amount_formatted'),
+                        only_direct_currency=resp.get('only_direct_currency'),
+                        capture_at=parse_datetime(resp.get('capture_at')),
+                        descriptor=resp.get('descriptor'),
+                        descriptor_phone_number=resp.get('descriptor_phone_number'),
+                        status=resp.get('status', 'pending'),
+                        error_code=error_data.get('code'),
+                        error_message=error_data.get('message'),
+                        error_detail=error_data.get('detail'),
+                        metadata=resp.get('metadata', {}),
+                        mode=resp.get('mode', 'test'),
+                        created_on=parse_datetime(resp.get('created_on')) or now(),
+                        redirect_endpoint=resp.get('redirect', {}).get('endpoint') if resp.get('redirect') else None,
+                        redirect_id=resp.get('redirect', {}).get('redirect_id') if resp.get('redirect') else None,
+                        three_ds_redirect_endpoint=resp.get('three_ds', {}).get('redirect_endpoint') if resp.get('three_ds') else None,
+                        three_ds_redirect_id=resp.get('three_ds', {}).get('redirect_id') if resp.get('three_ds') else None,
+                        three_ds_mode=resp.get('three_ds', {}).get('mode') if resp.get('three_ds') else None,
+                    )
+                    PaymentPayload.objects.create(payment=payment, raw_json=resp)
+                    record_payment_created(payment)
 
-                # Schedule a one-off poll as fallback to webhook
-                if ENABLE_POLL_FALLBACK and payment.univapay_id:
-                    _poll_provider_status_later("charge", payment.id, POLL_AFTER_SECONDS)
+                    # Queue a durable status poll as fallback to webhook
+                    if ENABLE_POLL_FALLBACK and payment.univapay_id:
+                        enqueue_status_poll("charge", payment.id, POLL_AFTER_SECONDS)
 
-                return Response({
-                    'ok': True,
-                    'payment': PaymentHistorySerializer(payment).data,
-                    'univapay': {
-                        'charge_id': resp.get('id'),
-                        'status': resp.get('status'),
-                        'mode': resp.get('mode'),
-                        'redirect': resp.get('redirect') or resp.get('three_ds'),
+                    body = {
+                        'ok': True,
+                        'payment': PaymentHistorySerializer(payment).data,
+                        'univapay': {
+                            'charge_id': resp.get('id'),
+                            'status': resp.get('status'),
+                            'mode': resp.get('mode'),
+                            'redirect': resp.get('redirect') or resp.get('three_ds'),
+                        }
                     }
-                }, status=status.HTTP_201_CREATED)
+                    if idem:
+                        idem.complete(status.HTTP_201_CREATED, body)
+
+                return Response(body, status=status.HTTP_201_CREATED)
 
             except UnivapayError as e:
-                return Response({
+                body = {
                     'error': 'UnivaPay charge failed',
                     'detail': e.body,
                     'status': e.status
-                }, status=status.HTTP_400_BAD_REQUEST)
+                }
+                if idem:
+                    # A decline or validation error is final; throttling and outages are worth retrying
+                    if e.status is not None and 400 <= e.status < 500 and e.status != 429:
+                        idem.complete(status.HTTP_400_BAD_REQUEST, body)
+                    else:
+                        idem.release()
+                return Response(body, status=status.HTTP_400_BAD_REQUEST)
             except Exception as e:
+                if idem:
+                    idem.release()
                 return Response({
                     'error': 'Unexpected error creating charge',
                     'detail': str(e)
@@ -521,7 +574,7 @@ class UnivapaySubscriptionView(APIView):
                     # Token doesn't exist in our DB, but we can still proceed
                     pass
                 
-                univapay = UnivapayClient()
+                univapay = get_univapay_client()
                 idem_key = univapay.new_idempotency_key()
 
                 # Create subscription with Univapay
@@ -544,51 +597,53 @@ class UnivapaySubscriptionView(APIView):
                 next_payment_data = resp.get('next_payment', {})
 
                 # Create local payment record with TransactionToken link
-                payment = PaymentHistory.objects.create(
-                    user=request.user,
-                    payment_type='recurring',
-                    transaction_token=token_record,  # Link the token if it exists
-                    univapay_id=resp.get('id'),
-                    store_id=resp.get('store_id'),
-                    univapay_transaction_token_id=resp.get('transaction_token_id'),
-                    amount=resp.get('amount'),
-                    currency=resp.get('currency'),
-                    amount_formatted=resp.get('amount_formatted'),
-                    initial_amount=resp.get('initial_amount'),
-                    initial_amount_formatted=resp.get('initial_amount_formatted'),
-                    subsequent_cycles_start=resp.get('subsequent_cycles_start'),
-                    schedule_settings=resp.get('schedule_settings', {}),
-                    only_direct_currency=resp.get('only_direct_currency'),
-                    first_charge_capture_after=resp.get('first_charge_capture_after'),
-                    first_charge_authorization_only=resp.get('first_charge_authorization_only'),
-                    status=resp.get('status', 'unverified'),
-                    metadata=resp.get('metadata', {}),
-                    mode=resp.get('mode', 'test'),
-                    created_on=parse_datetime(resp.get('created_on')) or now(),
-                    period=resp.get('period'),
-                    cyclical_period=resp.get('cyclical_period'),
-                    next_payment_id=next_payment_data.get('id'),
-                    next_payment_due_date=next_payment_data.get('due_date'),
-                    next_payment_zone_id=next_payment_data.get('zone_id'),
-                    next_payment_amount=next_payment_data.get('amount'),
-                    next_payment_currency=next_payment_data.get('currency'),
-                    next_payment_amount_formatted=next_payment_data.get('amount_formatted'),
-                    next_payment_is_paid=next_payment_data.get('is_paid', False),
-                    next_payment_is_last_payment=next_payment_data.get('is_last_payment', False),
-                    next_payment_created_on=parse_datetime(next_payment_data.get('created_on')),
-                    next_payment_updated_on=parse_datetime(next_payment_data.get('updated_on')),
-                    next_payment_retry_date=next_payment_data.get('retry_date'),
-                    redirect_endpoint=resp.get('redirect', {}).get('endpoint') if resp.get('redirect') else None,
-                    redirect_id=resp.get('redirect', {}).get('redirect_id') if resp.get('redirect') else None,
-                    three_ds_redirect_endpoint=resp.get('three_ds', {}).get('redirect_endpoint') if resp.get('three_ds') else None,
-                    three_ds_redirect_id=resp.get('three_ds', {}).get('redirect_id') if resp.get('three_ds') else None,
-                    three_ds_mode=resp.get('three_ds', {}).get('mode') if resp.get('three_ds') else None,
-                    raw_json=resp
-                )
+                with transaction.atomic():
+                    payment = PaymentHistory.objects.create(
+                        user=request.user,
+                        payment_type='recurring',
+                        transaction_token=token_record,  # Link the token if it exists
+                        univapay_id=resp.get('id'),
+                        store_id=resp.get('store_id'),
+                        univapay_transaction_token_id=resp.get('transaction_token_id'),
+                        amount=resp.get('amount'),
+                        currency=resp.get('currency'),
+                        amount_formatted=resp.get('amount_formatted'),
+                        initial_amount=resp.get('initial_amount'),
+                        initial_amount_formatted=resp.get('initial_amount_formatted'),
+                        subsequent_cycles_start=resp.get('subsequent_cycles_start'),
+                        schedule_settings=resp.get('schedule_settings', {}),
+                        only_direct_currency=resp.get('only_direct_currency'),
+                        first_charge_capture_after=resp.get('first_charge_capture_after'),
+                        first_charge_authorization_only=resp.get('first_charge_authorization_only'),
+                        status=resp.get('status', 'unverified'),
+                        metadata=resp.get('metadata', {}),
+                        mode=resp.get('mode', 'test'),
+                        created_on=parse_datetime(resp.get('created_on')) or now(),
+                        period=resp.get('period'),
+                        cyclical_period=resp.get('cyclical_period'),
+                        next_payment_id=next_payment_data.get('id'),
+                        next_payment_due_date=next_payment_data.get('due_date'),
+                        next_payment_zone_id=next_payment_data.get('zone_id'),
+                        next_payment_amount=next_payment_data.get('amount'),
+                        next_payment_currency=next_payment_data.get('currency'),
+                        next_payment_amount_formatted=next_payment_data.get('amount_formatted'),
+                        next_payment_is_paid=next_payment_data.get('is_paid', False),
+                        next_payment_is_last_payment=next_payment_data.get('is_last_payment', False),
+                        next_payment_created_on=parse_datetime(next_payment_data.get('created_on')),
+                        next_payment_updated_on=parse_datetime(next_payment_data.get('updated_on')),
+                        next_payment_retry_date=next_payment_data.get('retry_date'),
+                        redirect_endpoint=resp.get('redirect', {}).get('endpoint') if resp.get('redirect') else None,
+                        redirect_id=resp.get('redirect', {}).get('redirect_id') if resp.get('redirect') else None,
+                        three_ds_redirect_endpoint=resp.get('three_ds', {}).get('redirect_endpoint') if resp.get('three_ds') else None,
+                        three_ds_redirect_id=resp.get('three_ds', {}).get('redirect_id') if resp.get('three_ds') else None,
+                        three_ds_mode=resp.get('three_ds', {}).get('mode') if resp.get('three_ds') else None,
+                    )
+                    PaymentPayload.objects.create(payment=payment, raw_json=resp)
+                    record_payment_created(payment)
 
-                # Schedule a one-off poll as fallback to webhook
-                if ENABLE_POLL_FALLBACK and payment.univapay_id:
-                    _poll_provider_status_later("subscription", payment.id, POLL_AFTER_SECONDS)
+                    # Queue a durable status poll as fallback to webhook
+                    if ENABLE_POLL_FALLBACK and payment.univapay_id:
+                        enqueue_status_poll("subscription", payment.id, POLL_AFTER_SECONDS)
 
                 return Response({
                     'ok': True,
@@ -630,7 +685,7 @@ class CancelSubscriptionView(APIView):
                 termination_mode = serializer.validated_data.get('termination_mode', 'immediate')
                 reason = serializer.validated_data.get('reason', '')
 
-                univapay = UnivapayClient()
+                univapay = get_univapay_client()
 
                 # Cancel subscription with Univapay
                 resp = univapay.cancel_subscription(
@@ -639,17 +694,17 @@ class CancelSubscriptionView(APIView):
                     reason=reason
                 )
 
-                # Update local payment record
-                payment = get_object_or_404(
-                    PaymentHistory, 
-                    univapay_id=subscription_id, 
-                    user=request.user,
-                    payment_type='recurring'
-                )
-                payment.status = 'canceled'
-                payment.cancelled_on = now()
-                payment.termination_mode = termination_mode
-                payment.save(update_fields=['status', 'cancelled_on', 'termination_mode', 'updated_at'])
+                # Update local payment record (and the user's summary) in one transaction
+                with transaction.atomic():
+                    payment = get_object_or_404(
+                        PaymentHistory.objects.select_for_update(),
+                        univapay_id=subscription_id,
+                        user=request.user,
+                        payment_type='recurring'
+                    )
+                    payment.cancelled_on = now()
+                    payment.termination_mode = termination_mode
+                    set_payment_status(payment, 'canceled', update_fields=['cancelled_on', 'termination_mode'])
 
                 return Response({
                     'ok': True,
@@ -687,7 +742,7 @@ class RefundChargeView(APIView):
                 reason = serializer.validated_data.get('reason', '')
                 metadata = serializer.validated_data.get('metadata', {})
 
-                univapay = UnivapayClient()
+                univapay = get_univapay_client()
                 idem_key = univapay.new_idempotency_key()
 
                 # Refund charge with Univapay
@@ -699,21 +754,16 @@ class RefundChargeView(APIView):
                     idempotency_key=idem_key,
                 )
 
-                # Update local payment record
-                payment = get_object_or_404(
-                    PaymentHistory, 
-                    univapay_id=charge_id, 
-                    user=request.user,
-                    payment_type='one_time'
-                )
-                
-                # Set status based on refund amount
-                if amount and amount < payment.amount:
-                    payment.status = 'partially_refunded'
-                else:
-                    payment.status = 'refunded'
-                
-                payment.save(update_fields=['status', 'updated_at'])
+                # Update local payment record (and the user's summary) in one transaction
+                with transaction.atomic():
+                    payment = get_object_or_404(
+                        PaymentHistory.objects.select_for_update(),
+                        univapay_id=charge_id,
+                        user=request.user,
+                        payment_type='one_time'
+                    )
+                    # Set status based on refund amount
+                    set_payment_status(payment, refund_status(amount, payment.amount))
 
                 return Response({
                     'ok': True,
@@ -749,27 +799,23 @@ class PaymentStatusView(APIView):
                 payment_id = serializer.validated_data['payment_id']
                 payment_type = serializer.validated_data['payment_type']
 
-                univapay = UnivapayClient()
-
-                if payment_type == 'charge':
-                    resp = univapay.get_charge(payment_id)
-                elif payment_type == 'subscription':
-                    resp = univapay.get_subscription(payment_id)
-                else:
+                if payment_type not in ('charge', 'subscription'):
                     return Response({
                         'error': 'Invalid payment type. Must be "charge" or "subscription"'
                     }, status=status.HTTP_400_BAD_REQUEST)
+                # Served from the webhook-invalidated cache when the object hasn't changed
+                resp = get_provider_object(payment_type, payment_id)
+
+                # Update local payment record (and the user's summary) if it exists
+                with transaction.atomic():
+                    payment = PaymentHistory.objects.select_for_update().filter(
+                        univapay_id=payment_id,
+                        user=request.user
+                    ).first()
+                    if payment:
+                        set_payment_status(payment, resp.get('status', payment.status))
 
-                # Update local payment record if it exists
-                payment = PaymentHistory.objects.filter(
-                    univapay_id=payment_id, 
-                    user=request.user
-                ).first()
-                
                 if payment:
-                    payment.status = resp.get('status', payment.status)
-                    payment.save(update_fields=['status', 'updated_at'])
-                    
                     return Response({
                         'ok': True,
                         'payment': PaymentHistorySerializer(payment).data,
@@ -812,119 +858,110 @@ class WebhookView(APIView):
         if not verify_webhook_signature(request):
             return Response({'error': 'Invalid signature'}, status=status.HTTP_401_UNAUTHORIZED)
         
+        claimed = False
         try:
+            dedup_key = webhook_dedup_key(request.body)  # read before request.data consumes the stream
             data = request.data
             event_type = data.get('event') or data.get('type') or data.get('object')
-            
-            # Log webhook for debugging
-            print(f"Received webhook event: {event_type}")
-            print(f"Webhook data: {json.dumps(data, indent=2)}")
-            
-            # Handle different event types
-            if event_type in ['charge.finished', 'charge.updated', 'charge']:
-                self._handle_charge_event(data)
-            elif event_type in ['subscription.updated', 'subscription.payment', 'subscription.canceled', 'subscription']:
-                self._handle_subscription_event(data)
-            elif event_type in ['refund.finished', 'refund']:
-                self._handle_refund_event(data)
-            
+
+            with transaction.atomic():
+                # Provider retries resend the same body; drop them before touching PaymentHistory
+                if not claim_webhook(dedup_key, event_type):
+                    return Response({'ok': True, 'duplicate': True}, status=status.HTTP_200_OK)
+                claimed = True
+
+                # The provider object changed: the next status check must not be served from cache
+                invalidate_for_webhook(data, event_type)
+
+                # Log webhook for debugging
+                print(f"Received webhook event: {event_type}")
+                print(f"Webhook data: {json.dumps(data, indent=2)}")
+
+                # Hand off to the batch applier (univapay_webhook_worker), or apply inline
+                if ENABLE_WEBHOOK_INBOX:
+                    enqueue_webhook(data, event_type)
+                elif event_type in ['charge.finished', 'charge.updated', 'charge']:
+                    self._handle_charge_event(data)
+                elif event_type in ['subscription.updated', 'subscription.payment', 'subscription.canceled', 'subscription']:
+                    self._handle_subscription_event(data)
+                elif event_type in ['refund.finished', 'refund']:
+                    self._handle_refund_event(data)
+
             return Response({'ok': True}, status=status.HTTP_200_OK)
             
         except Exception as e:
             print(f"Webhook error: {e}")
-            # Always return OK to prevent retries
+            if claimed:
+                # The claim was rolled back with the processing: ask UnivaPay to redeliver
+                return Response({'error': 'Webhook processing failed'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            # An unreadable payload fails the same way on every retry
             return Response({'ok': True}, status=status.HTTP_200_OK)
     
     def _handle_charge_event(self, data):
-        """Handle charge-related webhook events."""
+        """Handle charge-related webhook events with one field-scoped UPDATE."""
         charge_data = data.get('data') or data
         charge_id = charge_data.get('id')
-        
+
         if not charge_id:
             return
-        
-        payment = PaymentHistory.objects.filter(
-            univapay_id=charge_id,
-            payment_type='one_time'
-        ).first()
-        
-        if payment:
-            # Update payment status
-            payment.status = charge_data.get('status', payment.status)
-            
-            # Update amounts if provided
-            if charge_data.get('charged_amount'):
-                payment.charged_amount = charge_data['charged_amount']
-            if charge_data.get('charged_currency'):
-                payment.charged_currency = charge_data['charged_currency']
-            
-            # Update error information
-            error_info = charge_data.get('error', {})
-            if error_info:
-                payment.error_code = error_info.get('code')
-                payment.error_message = error_info.get('message')
-                payment.error_detail = error_info.get('detail')
-            
-            payment.save()
-            print(f"Updated charge {charge_id} status to {payment.status}")
-    
+
+        fields = charge_event_fields(charge_data)
+        if not fields:
+            return
+        payments = PaymentHistory.objects.filter(univapay_id=charge_id, payment_type='one_time')
+        # Status changes also move the owner's PaymentSummary, which needs the old status
+        rows = lock_payment_rows(payments) if 'status' in fields else []
+        updated = payments.update(updated_at=now(), **fields)
+        record_transitions((row, row['status'], fields['status']) for row in rows)
+        cancel_settled_polls(('charge', row['id'], fields['status']) for row in rows)
+
+        if updated:
+            print(f"Updated charge {charge_id} fields {sorted(fields)}")
+
     def _handle_subscription_event(self, data):
-        """Handle subscription-related webhook events."""
+        """Handle subscription-related webhook events with one field-scoped UPDATE."""
         sub_data = data.get('data') or data
         sub_id = sub_data.get('id')
-        
+
         if not sub_id:
             return
-        
-        payment = PaymentHistory.objects.filter(
-            univapay_id=sub_id,
-            payment_type='recurring'
-        ).first()
-        
-        if payment:
-            # Update subscription status
-            payment.status = sub_data.get('status', payment.status)
-            
-            # Update cancellation info
-            if sub_data.get('cancelled_on'):
-                payment.cancelled_on = parse_datetime(sub_data['cancelled_on'])
-            
-            # Update next payment information
-            next_payment = sub_data.get('next_payment', {})
-            if next_payment:
-                payment.next_payment_id = next_payment.get('id')
-                payment.next_payment_due_date = next_payment.get('due_date')
-                payment.next_payment_amount = next_payment.get('amount')
-                payment.next_payment_currency = next_payment.get('currency')
-                payment.next_payment_is_paid = next_payment.get('is_paid', False)
-                payment.next_payment_is_last_payment = next_payment.get('is_last_payment', False)
-                payment.next_payment_retry_date = next_payment.get('retry_date')
-            
-            payment.save()
-            print(f"Updated subscription {sub_id} status to {payment.status}")
-    
+
+        fields = subscription_event_fields(sub_data)
+        if not fields:
+            return
+        payments = PaymentHistory.objects.filter(univapay_id=sub_id, payment_type='recurring')
+        # Status changes also move the owner's PaymentSummary, which needs the old status
+        rows = lock_payment_rows(payments) if 'status' in fields else []
+        updated = payments.update(updated_at=now(), **fields)
+        record_transitions((row, row['status'], fields['status']) for row in rows)
+        cancel_settled_polls(('subscription', row['id'], fields['status']) for row in rows)
+
+        if updated:
+            print(f"Updated subscription {sub_id} fields {sorted(fields)}")
+
     def _handle_refund_event(self, data):
-        """Handle refund-related webhook events."""
+        """Handle refund-related webhook events; partial vs full refund is decided in SQL."""
         refund_data = data.get('data') or data
         charge_id = refund_data.get('charge_id')
-        
+
         if not charge_id:
             return
-        
-        payment = PaymentHistory.objects.filter(
-            univapay_id=charge_id,
-            payment_type='one_time'
-        ).first()
-        
-        if payment:
-            # Update payment status based on refund
-            refund_amount = refund_data.get('amount')
-            if refund_amount and refund_amount < payment.amount:
-                payment.status = 'partially_refunded'
-            else:
-                payment.status = 'refunded'
-            
-            payment.save()
+
+        refund_amount = refund_data.get('amount')
+        if refund_amount:
+            new_status = Case(
+                When(amount__gt=refund_amount, then=Value('partially_refunded')),
+                default=Value('refunded'),
+            )
+        else:
+            new_status = Value('refunded')
+        payments = PaymentHistory.objects.filter(univapay_id=charge_id, payment_type='one_time')
+        rows = lock_payment_rows(payments)
+        updated = payments.update(status=new_status, updated_at=now())
+        record_transitions((row, row['status'], refund_status(refund_amount, row['amount'])) for row in rows)
+        cancel_settled_polls(('charge', row['id'], 'refunded') for row in rows)
+
+        if updated:
             print(f"Updated charge {charge_id} to refunded status")
 
 
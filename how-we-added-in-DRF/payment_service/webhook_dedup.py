@@ -0,0 +1,48 @@
+import hashlib
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.utils.timezone import now
+
+from .inprocess import RecentKeys
+from .models import ProcessedWebhook
+
+# Constants
+WEBHOOK_DEDUP_TTL_SECONDS = 600  # in-memory front only; the unique index is the source of truth
+WEBHOOK_DEDUP_CACHE_SIZE = 10000
+# Keys only need to outlive UnivaPay's redelivery schedule; prune_processed_webhooks deletes older ones
+WEBHOOK_DEDUP_RETENTION = timedelta(days=7)
+
+
+_recent = RecentKeys(WEBHOOK_DEDUP_CACHE_SIZE, WEBHOOK_DEDUP_TTL_SECONDS)
+
+
+def webhook_dedup_key(raw_body):
+    """
+    Identity of a webhook delivery. UnivaPay payloads carry the charge/subscription id
+    but no delivery id, and a retry resends the identical body, so hash the body.
+    """
+    return 'sha256:' + hashlib.sha256(raw_body).hexdigest()
+
+
+def claim_webhook(dedup_key, event_type=''):
+    """
+    Record a delivery; returns False if it was already processed.
+    Call inside transaction.atomic() together with the processing: a failed delivery
+    rolls back its claim, and WebhookView answers 500 so the provider's retry is accepted.
+    """
+    if dedup_key in _recent:
+        return False
+    try:
+        with transaction.atomic():
+            ProcessedWebhook.objects.create(dedup_key=dedup_key, event_type=(event_type or '')[:100])
+    except IntegrityError:
+        _recent.add(dedup_key)
+        return False
+    transaction.on_commit(lambda: _recent.add(dedup_key))
+    return True
+
+
+def prune_processed_webhooks(older_than=WEBHOOK_DEDUP_RETENTION):
+    """Delete dedup keys received more than `older_than` ago (past the provider's retry window)."""
+    return ProcessedWebhook.objects.filter(received_at__lt=now() - older_than).delete()[0]
@@ -0,0 +1,224 @@
+import uuid
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import now
+
+from .models import PaymentHistory, WebhookInboxEvent
+from .payment_summary import lock_payment_rows, record_transitions
+from .polling import cancel_settled_polls
+
+# Constants
+WEBHOOK_BATCH_SIZE = 500
+ENABLE_WEBHOOK_INBOX = True  # False: WebhookView applies each event inline
+WEBHOOK_UNMATCHED_RETRY_SECONDS = 30  # an event can arrive before its charge row commits
+WEBHOOK_UNMATCHED_MAX_ATTEMPTS = 20  # then it is dropped (about 10 minutes)
+WEBHOOK_INBOX_RETENTION = timedelta(days=7)  # processed events kept for debugging
+
+CHARGE_EVENTS = ('charge.finished', 'charge.updated', 'charge')
+SUBSCRIPTION_EVENTS = ('subscription.updated', 'subscription.payment', 'subscription.canceled', 'subscription')
+REFUND_EVENTS = ('refund.finished', 'refund')
+
+# Coalescing order: within a batch a status never moves to a lower rank; equal ranks
+# take the later event (subscriptions legitimately cycle current <-> unpaid)
+ONETIME_STATUS_RANK = {
+    'pending': 0, 'awaiting': 0,
+    'authorized': 1,
+    'successful': 2, 'failed': 2, 'error': 2, 'canceled': 2,
+    'partially_refunded': 3,
+    'refunded': 4,
+}
+RECURRING_STATUS_RANK = {
+    'unverified': 0, 'unconfirmed': 0,
+    'current': 1, 'unpaid': 1, 'suspended': 1,
+    'canceled': 2, 'completed': 2,
+}
+
+
+def event_kind(event_type):
+    if event_type in CHARGE_EVENTS:
+        return 'charge'
+    if event_type in SUBSCRIPTION_EVENTS:
+        return 'subscription'
+    if event_type in REFUND_EVENTS:
+        return 'refund'
+    return None
+
+
+def charge_event_fields(charge_data):
+    """PaymentHistory fields carried by a charge event (only those present)."""
+    fields = {}
+    if charge_data.get('status'):
+        fields['status'] = charge_data['status']
+    if charge_data.get('charged_amount'):
+        fields['charged_amount'] = charge_data['charged_amount']
+    if charge_data.get('charged_currency'):
+        fields['charged_currency'] = charge_data['charged_currency']
+    error_info = charge_data.get('error') or {}
+    if error_info:
+        fields['error_code'] = error_info.get('code')
+        fields['error_message'] = error_info.get('message')
+        fields['error_detail'] = error_info.get('detail')
+    return fields
+
+
+def subscription_event_fields(sub_data):
+    """PaymentHistory fields carried by a subscription event (only those present)."""
+    fields = {}
+    if sub_data.get('status'):
+        fields['status'] = sub_data['status']
+    if sub_data.get('cancelled_on'):
+        fields['cancelled_on'] = parse_datetime(sub_data['cancelled_on'])
+    next_payment = sub_data.get('next_payment') or {}
+    if next_payment:
+        fields.update({
+            'next_payment_id': next_payment.get('id'),
+            'next_payment_due_date': next_payment.get('due_date'),
+            'next_payment_amount': next_payment.get('amount'),
+            'next_payment_currency': next_payment.get('currency'),
+            'next_payment_is_paid': next_payment.get('is_paid', False),
+            'next_payment_is_last_payment': next_payment.get('is_last_payment', False),
+            'next_payment_retry_date': next_payment.get('retry_date'),
+        })
+    return fields
+
+
+def refund_status(refund_amount, payment_amount):
+    if refund_amount and payment_amount is not None and refund_amount < payment_amount:
+        return 'partially_refunded'
+    return 'refunded'
+
+
+def _target_id(kind, obj):
+    raw = obj.get('charge_id') if kind == 'refund' else obj.get('id')
+    try:
+        return uuid.UUID(str(raw)) if raw else None
+    except ValueError:
+        return None
+
+
+def webhook_target(data, event_type):
+    """('charge' | 'subscription', UnivaPay id) of the provider object a webhook changed, or None."""
+    kind = event_kind(event_type)
+    if kind is None:
+        return None
+    target = _target_id(kind, data.get('data') or data)
+    if target is None:
+        return None
+    return ('charge' if kind == 'refund' else kind), target
+
+
+def enqueue_webhook(data, event_type):
+    """
+    Append a webhook to the inbox for `apply_pending_webhooks`.
+    Returns the row, or None for event types we don't act on.
+    """
+    kind = event_kind(event_type)
+    if kind is None:
+        return None
+    obj = data.get('data') or data
+    return WebhookInboxEvent.objects.create(
+        kind=kind,
+        univapay_id=_target_id(kind, obj),
+        event_type=(event_type or '')[:100],
+        payload=data,
+    )
+
+
+def apply_pending_webhooks(limit=WEBHOOK_BATCH_SIZE):
+    """
+    Apply up to `limit` pending inbox events in one transaction.
+
+    Events are grouped per (payment_type, univapay_id) and folded in arrival order into
+    one set of field changes, with status respecting the rank order above. The touched
+    rows are then written with one bulk_update per distinct field set, so a burst of
+    events costs a handful of statements. An event whose PaymentHistory row doesn't exist
+    yet stays pending and is retried later, up to WEBHOOK_UNMATCHED_MAX_ATTEMPTS times.
+    Returns the number of events taken from the inbox.
+    """
+    current_time = now()
+    with transaction.atomic():
+        events = list(
+            WebhookInboxEvent.objects.select_for_update(skip_locked=True)
+            .filter(processed_at__isnull=True)
+            .filter(Q(retry_at__isnull=True) | Q(retry_at__lte=current_time))
+            .order_by('id')[:limit]
+        )
+        if not events:
+            return 0
+
+        ids = {e.univapay_id for e in events if e.univapay_id}
+        # Locked: the owners' PaymentSummary rows are moved by the status transitions below
+        current = {
+            (row['payment_type'], row['univapay_id']): row
+            for row in lock_payment_rows(PaymentHistory.objects.filter(univapay_id__in=ids), 'univapay_id')
+        }
+
+        merged = {}  # PaymentHistory.id -> field changes
+        rows_by_id = {row['id']: row for row in current.values()}
+        unmatched = []
+        for evt in events:
+            payment_type = 'recurring' if evt.kind == 'subscription' else 'one_time'
+            row = current.get((payment_type, evt.univapay_id))
+            if row is None:
+                if evt.univapay_id and evt.attempts + 1 < WEBHOOK_UNMATCHED_MAX_ATTEMPTS:
+                    unmatched.append(evt)
+                else:
+                    print(f"[Webhooks] dropping {evt.event_type or evt.kind} for {evt.univapay_id}: no payment row")
+                continue
+            obj = evt.payload.get('data') or evt.payload
+            if evt.kind == 'charge':
+                fields = charge_event_fields(obj)
+            elif evt.kind == 'subscription':
+                fields = subscription_event_fields(obj)
+            else:
+                fields = {'status': refund_status(obj.get('amount'), row['amount'])}
+
+            changes = merged.setdefault(row['id'], {})
+            ranks = RECURRING_STATUS_RANK if payment_type == 'recurring' else ONETIME_STATUS_RANK
+            new_status = fields.pop('status', None)
+            if new_status:
+                held = changes.get('status', row['status'])
+                if ranks.get(new_status, 0) < ranks.get(held, 0):
+                    # A stale event: its error/charge fields describe the state we just refused
+                    continue
+                changes['status'] = new_status
+            changes.update(fields)
+
+        # One bulk_update per distinct set of touched fields
+        touched_at = now()
+        by_fields = {}
+        for payment_id, changes in merged.items():
+            if not changes:
+                continue
+            obj = PaymentHistory(id=payment_id, updated_at=touched_at, **changes)
+            by_fields.setdefault(tuple(sorted(changes)), []).append(obj)
+        for fields, objs in by_fields.items():
+            PaymentHistory.objects.bulk_update(objs, [*fields, 'updated_at'], batch_size=500)
+        record_transitions(
+            (rows_by_id[payment_id], rows_by_id[payment_id]['status'], changes['status'])
+            for payment_id, changes in merged.items() if 'status' in changes
+        )
+        cancel_settled_polls(
+            ('subscription' if rows_by_id[payment_id]['payment_type'] == 'recurring' else 'charge',
+             payment_id, changes['status'])
+            for payment_id, changes in merged.items() if 'status' in changes
+        )
+
+        for evt in unmatched:
+            evt.attempts += 1
+            evt.retry_at = touched_at + timedelta(seconds=WEBHOOK_UNMATCHED_RETRY_SECONDS)
+        if unmatched:
+            WebhookInboxEvent.objects.bulk_update(unmatched, ['attempts', 'retry_at'])
+        deferred = {evt.id for evt in unmatched}
+        WebhookInboxEvent.objects.filter(id__in=[e.id for e in events if e.id not in deferred]).update(
+            processed_at=touched_at
+        )
+    return len(events)
+
+
+def prune_webhook_inbox(older_than=WEBHOOK_INBOX_RETENTION):
+    """Delete inbox events processed more than `older_than` ago; pending ones are kept."""
+    return WebhookInboxEvent.objects.filter(processed_at__lt=now() - older_than).delete()[0]